@@ -0,0 +1,309 @@
+"""Admission control and resource budgets for the endpoints that extract or process an upload.
+
+A bounded number of heavy requests run at a time. A heavy view answers what it can without extracting anything,
+invalid arguments and not-modified revalidations, right away and takes a slot with start_job only before the
+work itself. Further requests wait in a bounded queue for up to a timeout and are answered with 503 and
+Retry-After when the queue is full or the wait times out. Every admitted request
+runs as a job with a wall-clock and a memory ceiling, checked by check_job_budget between files during
+extraction, validation and processing and between chunks while a zip member is decompressed. A job that exceeds
+either is aborted with ResourceLimitError. Zip uploads are checked against a member-count and a decompressed-bytes
+budget before anything is extracted, and ZipReader holds every member it reads to the bytes it actually
+decompresses, per member and in total, whatever the central directory declares.
+
+Limits and metrics are per process: every gunicorn worker admits its own jobs.
+"""
+import os
+import math
+import time
+import zipfile
+import logging
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from flask import jsonify
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENT = 2
+DEFAULT_MAX_QUEUED = 8
+DEFAULT_QUEUE_TIMEOUT = 30.0
+# Below gunicorn's worker timeout, so a job is aborted with an error before its worker is killed
+DEFAULT_JOB_SECONDS = 240.0
+DEFAULT_JOB_MEMORY_MB = 2048
+DEFAULT_ZIP_MAX_MEMBERS = 20000
+DEFAULT_ZIP_MAX_BYTES = 4 * 1024 ** 3
+DEFAULT_ZIP_MAX_MEMBER_BYTES = 256 * 1024 ** 2
+ZIP_READ_CHUNK = 1024 ** 2
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+_current_job = contextvars.ContextVar('admission_job', default=None)
+# The heavy view of the current request: its name and, once start_job admitted it, its job token
+_current_view = contextvars.ContextVar('admission_view', default=None)
+_limit_counts = Counter()
+_limit_counts_lock = threading.Lock()
+zip_limits = {'max_members': DEFAULT_ZIP_MAX_MEMBERS, 'max_bytes': DEFAULT_ZIP_MAX_BYTES, 'max_member_bytes': DEFAULT_ZIP_MAX_MEMBER_BYTES}
+
+
+class ResourceLimitError(Exception):
+    """A request was rejected or aborted by an admission limit or resource budget.
+
+    limit names the budget, status is the HTTP status the request is answered with."""
+
+    def __init__(self, limit, message, status=503, retry_after=None):
+        super().__init__(message)
+        self.limit = limit
+        self.status = status
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        # Raised in pool workers too, keep all arguments when it is sent back
+        return (type(self), (self.limit, str(self), self.status, self.retry_after))
+
+    def to_dict(self):
+        return {'error': str(self), 'limit': self.limit}
+
+
+def limit_exceeded(limit, message, status=503, retry_after=None):
+    """Counts a rejection or abort for the metrics and returns the error to raise."""
+    with _limit_counts_lock:
+        _limit_counts[limit] += 1
+    logger.warning(f"Resource limit {limit}: {message}")
+    return ResourceLimitError(limit, message, status, retry_after)
+
+
+def resource_limit_response(e):
+    response = jsonify(e.to_dict())
+    response.status_code = e.status
+    if e.retry_after:
+        response.headers['Retry-After'] = str(max(1, math.ceil(e.retry_after)))
+    return response
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def set_zip_limits(max_members, max_bytes, max_member_bytes=DEFAULT_ZIP_MAX_MEMBER_BYTES):
+    zip_limits['max_members'] = max_members
+    zip_limits['max_bytes'] = max_bytes
+    zip_limits['max_member_bytes'] = max_member_bytes
+
+
+def check_zip_budget(zip_ref):
+    """Checks the member count and total decompressed size of a zip against the budget and returns the size.
+
+    The sizes come from the central directory and are only what the zip declares: this rejects honest zips
+    early, ZipReader enforces the budget on the bytes actually decompressed."""
+    infos = zip_ref.infolist()
+    if len(infos) > zip_limits['max_members']:
+        raise limit_exceeded('zip_members', f"Zip has {len(infos)} members, the limit is {zip_limits['max_members']}", 413)
+    total = sum(info.file_size for info in infos)
+    if total > zip_limits['max_bytes']:
+        raise limit_exceeded('zip_bytes', f"Zip decompresses to {total} bytes, the limit is {zip_limits['max_bytes']}", 413)
+    largest = max(infos, key=lambda info: info.file_size, default=None)
+    if largest is not None and largest.file_size > zip_limits['max_member_bytes']:
+        raise limit_exceeded('zip_member_bytes', f"Zip member {largest.filename} decompresses to {largest.file_size} bytes, "
+                                                 f"the limit is {zip_limits['max_member_bytes']}", 413)
+    return total
+
+
+def check_zip_file(file_path):
+    """check_zip_budget for an upload on disk. Files that are not readable zips pass unchecked."""
+    if not zipfile.is_zipfile(file_path):
+        return None
+    with zipfile.ZipFile(file_path, 'r') as zip_ref:
+        return check_zip_budget(zip_ref)
+
+
+class ZipReader:
+    """Reads members of an open zip in chunks, counting the bytes actually decompressed against the per-member
+    and the total budget of the zip and checking the job budget between chunks."""
+
+    def __init__(self, zip_ref):
+        self.zip_ref = zip_ref
+        self.total = 0
+
+    def chunks(self, member):
+        size = 0
+        with self.zip_ref.open(member) as source:
+            while True:
+                check_job_budget()
+                chunk = source.read(ZIP_READ_CHUNK)
+                if not chunk:
+                    return
+                size += len(chunk)
+                self.total += len(chunk)
+                if size > zip_limits['max_member_bytes']:
+                    raise limit_exceeded('zip_member_bytes', f"Zip member {member} decompresses to more than {zip_limits['max_member_bytes']} bytes", 413)
+                if self.total > zip_limits['max_bytes']:
+                    raise limit_exceeded('zip_bytes', f"Zip decompresses to more than {zip_limits['max_bytes']} bytes", 413)
+                yield chunk
+
+    def read(self, member):
+        return b''.join(self.chunks(member))
+
+    def extract(self, member, folder):
+        """Writes a member below folder like ZipFile.extract, dropping drive letters, absolute and .. parts of
+        its name, and returns its path. A member over the budget is removed again."""
+        info = member if isinstance(member, zipfile.ZipInfo) else self.zip_ref.getinfo(member)
+        name = os.path.splitdrive(info.filename.replace('/', os.path.sep))[1]
+        name = os.path.sep.join(part for part in name.split(os.path.sep) if part not in ('', os.path.curdir, os.path.pardir))
+        path = os.path.normpath(os.path.join(folder, name))
+        if info.is_dir():
+            os.makedirs(path, exist_ok=True)
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with open(path, 'wb') as target:
+                for chunk in self.chunks(info):
+                    target.write(chunk)
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        return path
+
+
+def extract_zip(zip_ref, upload_folder, members=None):
+    """Extracts the given members of an open zip, or all of them, after checking the zip budget. The bytes
+    written are held to the budget while they are decompressed, see ZipReader. Returns the extracted paths."""
+    check_zip_budget(zip_ref)
+    reader = ZipReader(zip_ref)
+    return [reader.extract(member, upload_folder) for member in (zip_ref.namelist() if members is None else members)]
+
+
+class JobBudget:
+    """Wall-clock and memory ceiling of one admitted request.
+
+    Memory is the growth of the process's resident set since the job started, so jobs running at the same
+    time see each other's allocations: the ceiling guards the process, it is not an exact per-job account."""
+
+    def __init__(self, name, max_seconds, max_memory_bytes):
+        self.name = name
+        self.max_seconds = max_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.started = time.monotonic()
+        self.rss_start = current_rss() if max_memory_bytes else None
+
+    def check(self):
+        elapsed = time.monotonic() - self.started
+        if self.max_seconds and elapsed > self.max_seconds:
+            raise limit_exceeded('wall_time', f"{self.name} was aborted after {elapsed:.1f}s, the limit is {self.max_seconds:g}s")
+        if self.rss_start is not None:
+            rss = current_rss()
+            if rss is not None and rss - self.rss_start > self.max_memory_bytes:
+                raise limit_exceeded('memory', f"{self.name} was aborted after using {(rss - self.rss_start) / 2 ** 20:.0f} MB, "
+                                               f"the limit is {self.max_memory_bytes / 2 ** 20:.0f} MB")
+
+
+def check_job_budget():
+    """Raises ResourceLimitError if the current job is over its wall-clock or memory ceiling. Outside an
+    admitted request (CLI, warm-up, worker processes) it does nothing."""
+    job = _current_job.get()
+    if job is not None:
+        job.check()
+
+
+class AdmissionController:
+    """Runs at most max_concurrent jobs at a time, with at most max_queued requests waiting for a slot."""
+
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT, max_queued=DEFAULT_MAX_QUEUED, queue_timeout=DEFAULT_QUEUE_TIMEOUT,
+                 job_seconds=DEFAULT_JOB_SECONDS, job_memory_mb=DEFAULT_JOB_MEMORY_MB):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.job_seconds = job_seconds
+        self.job_memory_bytes = job_memory_mb * 2 ** 20 if job_memory_mb else None
+        self.condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.completed = 0
+        self.queue_wait_seconds = 0.0
+
+    def _acquire(self):
+        """Waits for a slot, or raises ResourceLimitError when the queue is full or the wait times out."""
+        queued = time.monotonic()
+        with self.condition:
+            if self.active >= self.max_concurrent:
+                if self.waiting >= self.max_queued:
+                    raise limit_exceeded('queue_full', f"Server busy: {self.active} jobs running and {self.waiting} waiting, try again later",
+                                         retry_after=self.queue_timeout)
+                self.waiting += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+                try:
+                    admitted = self.condition.wait_for(lambda: self.active < self.max_concurrent, timeout=self.queue_timeout)
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    raise limit_exceeded('queue_timeout', f"Server busy: no slot became free within {self.queue_timeout:g}s, try again later",
+                                         retry_after=self.queue_timeout)
+            self.active += 1
+            self.admitted += 1
+            self.queue_wait_seconds += time.monotonic() - queued
+
+    def _release(self):
+        with self.condition:
+            self.active -= 1
+            self.completed += 1
+            self.condition.notify()
+
+    @contextmanager
+    def admit(self, name):
+        """Waits for a slot and runs the block as a job with its budget."""
+        self._acquire()
+        token = _current_job.set(JobBudget(name, self.job_seconds, self.job_memory_bytes))
+        try:
+            yield
+        finally:
+            _current_job.reset(token)
+            self._release()
+
+    def start_job(self):
+        """Waits for a slot for the current heavy view and starts its job budget. The slot is held until the
+        view returns. Calling it again in the same request does nothing."""
+        view = _current_view.get()
+        if view is None:
+            raise RuntimeError("start_job called outside a view decorated with heavy")
+        if view['token'] is None:
+            self._acquire()
+            view['token'] = _current_job.set(JobBudget(view['name'], self.job_seconds, self.job_memory_bytes))
+
+    def heavy(self, view):
+        """Decorator for a Flask view that calls start_job before its heavy work, releases the slot when it
+        returns and answers rejections and aborts."""
+        @wraps(view)
+        def admitted_view(*args, **kwargs):
+            state = {'name': view.__name__, 'token': None}
+            view_token = _current_view.set(state)
+            try:
+                return view(*args, **kwargs)
+            except ResourceLimitError as e:
+                return resource_limit_response(e)
+            finally:
+                _current_view.reset(view_token)
+                if state['token'] is not None:
+                    _current_job.reset(state['token'])
+                    self._release()
+        return admitted_view
+
+    def metrics(self):
+        with self.condition:
+            metrics = {'active': self.active, 'queue_depth': self.waiting, 'max_queue_depth': self.max_waiting,
+                       'admitted': self.admitted, 'completed': self.completed,
+                       'mean_queue_wait_seconds': self.queue_wait_seconds / self.admitted if self.admitted else 0.0,
+                       'limits': {'max_concurrent': self.max_concurrent, 'max_queued': self.max_queued, 'queue_timeout': self.queue_timeout,
+                                  'job_seconds': self.job_seconds, 'job_memory_bytes': self.job_memory_bytes, **zip_limits}}
+        with _limit_counts_lock:
+            metrics['rejected'] = {limit: count for limit, count in _limit_counts.items() if limit.startswith(('queue_', 'zip_'))}
+            metrics['aborted'] = {limit: count for limit, count in _limit_counts.items() if not limit.startswith(('queue_', 'zip_'))}
+        return metrics
@@ -1,28 +1,77 @@
 import os
+import json
+import shutil
 import pandas as pd
 import numpy as np
 import zipfile
-from flask import Flask, request, send_file, jsonify, send_from_directory, session
+from flask import Flask, Response, request, send_file, jsonify, send_from_directory, session
 from werkzeug.utils import secure_filename
-from finalJSONtoCSV import get_column_groups, JSONtoCSV, get_summary_columns, calculate_pi_averages, clean_column_groups, calculate_pointing_averages, calculate_pet_averages
-from getTrialNumbers import findAllTrials
+from finalJSONtoCSV import get_column_groups, get_summary_columns, clean_column_groups, build_summary_table
+from datasetCache import (load_dataset, load_summary, load_outlier_reference, get_valid_json_files, get_cached_dataset, get_summary_path, load_page,
+                          get_trial_counts)
+from incrementalAverages import IncrementalAverages
+from cohortStatistics import CohortStatistics, stream_statistics, DEFAULT_QUANTILES
+from longFormat import to_long_format, parse_trial_column
+from circularStatistics import circular_statistics_without
+from httpCaching import make_etag, matching_etag, not_modified_response, choose_encoding, cached_response, iter_file, remember_upload_hash
+from chunkedUpload import create_upload, get_upload, discard_upload
+from sessionValidation import load_validation, validation_summary, validation_version, discard_validation
+from sessionIndex import SessionIndex, DuplicateSessionError
+from warmup import warm_up_extraction, timed_warm_up
+from outlierFlags import OutlierFlags, OutlierOptionError, parse_outlier_options
+from metadataFilter import MetadataFilterError, parse_filter
+from admissionControl import AdmissionController, ResourceLimitError, resource_limit_response, set_zip_limits, check_zip_file, check_zip_budget
+from outputFormats import OUTPUT_FORMATS, DEFAULT_FORMAT, OutputFormatError, check_format, write_frame, frame_to_bytes, output_filename
 from flask_cors import CORS
 from flask_session import Session
+from sessionBackends import create_session_interface
 from datetime import timedelta
 import logging
 import sys
+import time
+import uuid
+
+# Setup time of the app after its imports, the imports themselves are part of the "Master ready" time gunicorn logs
+SETUP_STARTED = time.perf_counter()
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
 app.secret_key = "supersecretkey"  # Make sure this is set
-app.config['SESSION_TYPE'] = 'filesystem'  # Use filesystem-based sessions
-app.config['SESSION_FILE_DIR'] = '/tmp/flask_session'
+# Session backend: 'sqlite' (WAL database shared by workers), 'memory' (in-process LRU with TTL, for tests and
+# single-process runs only) or 'filesystem' (flask_session)
+app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND', 'sqlite')
+app.config['SESSION_SQLITE_PATH'] = os.environ.get('SESSION_SQLITE_PATH', '/tmp/flask_session.sqlite3')
 app.config['SESSION_PERMANENT'] = True
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
+# Duplicate sessions within an upload and across uploads: 'keep_first', 'keep_latest' (most recently written into the zip,
+# or the most recent upload) or 'error'
+app.config['DUPLICATE_POLICY'] = os.environ.get('DUPLICATE_POLICY', 'keep_first')
+# Worker processes for cohort statistics of uploads that are not extracted yet
+app.config['STATISTICS_WORKERS'] = int(os.environ.get('STATISTICS_WORKERS', '1'))
+# Run a warm-up extraction on a synthetic session at import, set by gunicorn.conf.py so preloaded workers start warm
+app.config['WARM_UP'] = os.environ.get('WARM_UP', '0') == '1'
+# Admission control of the endpoints that extract or process an upload, per process: concurrent jobs, requests
+# waiting for a slot and how long they wait, wall-clock and memory ceiling of a job (0 disables a ceiling)
+app.config['MAX_CONCURRENT_JOBS'] = int(os.environ.get('MAX_CONCURRENT_JOBS', '2'))
+app.config['MAX_QUEUED_JOBS'] = int(os.environ.get('MAX_QUEUED_JOBS', '8'))
+app.config['QUEUE_TIMEOUT'] = float(os.environ.get('QUEUE_TIMEOUT', '30'))
+app.config['JOB_MAX_SECONDS'] = float(os.environ.get('JOB_MAX_SECONDS', '240'))
+app.config['JOB_MAX_MEMORY_MB'] = int(os.environ.get('JOB_MAX_MEMORY_MB', '2048'))
+# Budgets of a zip upload, checked before anything is extracted
+app.config['ZIP_MAX_MEMBERS'] = int(os.environ.get('ZIP_MAX_MEMBERS', '20000'))
+app.config['ZIP_MAX_BYTES'] = int(os.environ.get('ZIP_MAX_BYTES', str(4 * 1024 ** 3)))
+app.config['ZIP_MAX_MEMBER_BYTES'] = int(os.environ.get('ZIP_MAX_MEMBER_BYTES', str(256 * 1024 ** 2)))
 UPLOAD_FOLDER = 'uploads'
 DOWNLOAD_FOLDER = 'downloads'
 ALLOWED_EXTENSIONS = {'json', 'zip'}
-Session(app)
+PREVIEW_DEFAULT_LIMIT = 20
+PREVIEW_MAX_LIMIT = 200
+if app.config['SESSION_BACKEND'] == 'filesystem':
+    app.config['SESSION_TYPE'] = 'filesystem'  # Use filesystem-based sessions
+    app.config['SESSION_FILE_DIR'] = '/tmp/flask_session'
+    Session(app)
+else:
+    app.session_interface = create_session_interface(app)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO,
@@ -36,6 +85,8 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# The session index belongs with the uploads it describes
+app.config['SESSION_INDEX_PATH'] = os.environ.get('SESSION_INDEX_PATH', os.path.join(UPLOAD_FOLDER, '.session_index.sqlite3'))
 app.config['DOWNLOAD_FOLDER'] = DOWNLOAD_FOLDER
 
 # At the top of your file, after your imports
@@ -43,23 +94,60 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 app.config['DOWNLOAD_FOLDER'] = os.path.join(project_root, 'downloads')
 app_logger.info(f"DOWNLOAD_FOLDER set to: {app.config['DOWNLOAD_FOLDER']}")
 
+# Sessions of the other uploads, skipped by the duplicate policy when they appear again
+session_index = SessionIndex(app.config['SESSION_INDEX_PATH'])
+
+admission = AdmissionController(app.config['MAX_CONCURRENT_JOBS'], app.config['MAX_QUEUED_JOBS'], app.config['QUEUE_TIMEOUT'],
+                                app.config['JOB_MAX_SECONDS'], app.config['JOB_MAX_MEMORY_MB'])
+set_zip_limits(app.config['ZIP_MAX_MEMBERS'], app.config['ZIP_MAX_BYTES'], app.config['ZIP_MAX_MEMBER_BYTES'])
+
+def dataset_options():
+    return {'duplicate_policy': app.config['DUPLICATE_POLICY'], 'session_index': session_index}
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def clear_folder(folder):
-    for filename in os.listdir(folder):
-        file_path = os.path.join(folder, filename)
+def remove_previous_upload(file_path):
+    """Deletes an earlier upload stored under file_path together with its sidecar files and extracted members.
+    Uploads of other users in the folder are left alone, but those sharing sessions with it are validated again."""
+    folder, filename = os.path.split(file_path)
+    for upload_name in session_index.forget_upload(filename):
+        discard_validation(os.path.join(folder, upload_name))
+    for name in os.listdir(folder):
+        if name != filename and not name.startswith(filename + '.'):
+            continue
+        path = os.path.join(folder, name)
         try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
-        except Exception as e:
-            print(f'Failed to delete {file_path}. Reason: {e}')
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+        except OSError as e:
+            app_logger.error(f'Failed to delete {path}. Reason: {e}')
+
+def materialize_summary(file_path):
+    """Validates a new upload and stores its summary table next to it, so the first columns, process or
+    statistics request reads the summary instead of extracting the upload. A failure is only logged, the
+    first request on the upload reports it."""
+    try:
+        load_summary(file_path, app.config['UPLOAD_FOLDER'], **dataset_options())
+    except Exception as e:
+        app_logger.warning(f"Summary table of {file_path} not built at upload: {e}")
+
+def upload_etag(file_path, name, metadata_filter, *parts):
+    """ETag of the response of route name on an upload for the request parameters in parts. It also covers the
+    participant filter, the duplicate policy and the stored validation report, which decide the sessions a
+    response is built from. The report is written by the first build, so a route computes the ETag of its
+    response again after building it."""
+    return make_etag(file_path, name, *parts, metadata_filter.key if metadata_filter else None,
+                     app.config['DUPLICATE_POLICY'], validation_version(file_path, metadata_filter))
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/api/upload', methods=['POST'])
+@admission.heavy
 def upload_file():
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
@@ -67,36 +155,117 @@ def upload_file():
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
     if file and allowed_file(file.filename):
-        clear_folder(app.config['UPLOAD_FOLDER'])
         filename = secure_filename(file.filename)
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        remove_previous_upload(file_path)
         file.save(file_path)
-        session['file_path'] = file_path
+        try:
+            check_zip_file(file_path)
+        except ResourceLimitError as e:
+            os.remove(file_path)
+            return resource_limit_response(e)
+        admission.start_job()
+        materialize_summary(file_path)
+        # Only the upload id is kept in the session, the path is derived from it
+        session['upload_id'] = filename
         app_logger.info(f"File uploaded successfully: {file_path}")
-        app_logger.info(f"Session file_path set to: {session.get('file_path')}")
         return jsonify({'success': True, 'message': 'File uploaded successfully', 'file_path': file_path}), 200
     return jsonify({'error': 'Invalid file type'}), 400
 
+# Chunked uploads: POST /api/upload/init, then PUT /api/upload/<id>/chunk/<n> for n = 0, 1, ..., then POST /api/upload/<id>/finalize.
+# GET /api/upload/<id> returns the next chunk expected, so an interrupted upload resumes from the last acknowledged chunk.
+@app.route('/api/upload/init', methods=['POST'])
+def init_chunked_upload():
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename', ''))
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'Invalid file type'}), 400
+    try:
+        upload = create_upload(filename, data.get('chunk_size'), app.config['UPLOAD_FOLDER'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid chunk size'}), 400
+    app_logger.info(f"Chunked upload {upload.upload_id} started for {filename} with chunk size {upload.chunk_size}")
+    return jsonify(upload.status()), 200
+
+@app.route('/api/upload/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    upload = get_upload(upload_id, app.config['UPLOAD_FOLDER'])
+    if upload is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    with upload.locked() as current:
+        if not current:
+            return jsonify({'error': 'Unknown upload'}), 404
+        return jsonify(upload.status()), 200
+
+@app.route('/api/upload/<upload_id>/chunk/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    upload = get_upload(upload_id, app.config['UPLOAD_FOLDER'])
+    if upload is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    data = request.get_data(cache=False)
+    with upload.locked() as current:
+        if not current:
+            return jsonify({'error': 'Unknown upload'}), 404
+        error = upload.write_chunk(index, data)
+        if error:
+            return jsonify({'error': error, **upload.status()}), 409
+        return jsonify(upload.status()), 200
+
+@app.route('/api/upload/<upload_id>/finalize', methods=['POST'])
+@admission.heavy
+def finalize_chunked_upload(upload_id):
+    upload = get_upload(upload_id, app.config['UPLOAD_FOLDER'])
+    if upload is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    data = request.get_json(silent=True) or {}
+    # Waiting for a slot must not hold the upload, its status and chunk requests stay answered meanwhile
+    admission.start_job()
+    with upload.locked() as current:
+        if not current:
+            return jsonify({'error': 'Unknown upload'}), 404
+        if upload.bytes_received == 0:
+            return jsonify({'error': 'No chunks received', **upload.status()}), 409
+        expected_sha256 = data.get('sha256')
+        if expected_sha256 and expected_sha256.lower() != upload.digest.hexdigest():
+            return jsonify({'error': 'Checksum mismatch', **upload.status()}), 409
+        if zipfile.is_zipfile(upload.part_path):
+            try:
+                with zipfile.ZipFile(upload.part_path, 'r') as zip_ref:
+                    check_zip_budget(zip_ref)
+            except ResourceLimitError as e:
+                return resource_limit_response(e)
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], upload.filename)
+        remove_previous_upload(file_path)
+        sha256, trial_counts = upload.finalize(file_path)
+        remember_upload_hash(file_path, sha256)
+    discard_upload(upload_id)
+    materialize_summary(file_path)
+    session['upload_id'] = upload.filename
+    app_logger.info(f"File uploaded successfully: {file_path}")
+    return jsonify({'success': True, 'message': 'File uploaded successfully', 'file_path': file_path,
+                    'sha256': sha256, 'trial_counts': trial_counts}), 200
+
 @app.route('/api/columns', methods=['GET', 'POST'])
+@admission.heavy
 def get_columns():
-    app_logger.info(f"Session contents: {dict(session)}")
     app_logger.info(f"Request method: {request.method}")
     app_logger.info(f"Request args: {request.args}")
-    app_logger.info(f"Request form: {request.form}")
-    app_logger.info(f"Request headers: {dict(request.headers)}")
     
     if request.method == 'GET':
         output_option = request.args.get('option', 'all_trials')
         file_path = request.args.get('file_path')
+        filter_options = request.args.get('filter')
     else:  # POST
         data = request.get_json(silent=True) or {}
         output_option = data.get('option', 'all_trials')
         file_path = data.get('file_path')
+        filter_options = data.get('filter')
     
     app_logger.info(f"Output option: {output_option}")
     app_logger.info(f"File path from request: {file_path}")
     
-    session_file_path = session.get('file_path')
+    upload_id = session.get('upload_id')
+    session_file_path = os.path.join(app.config['UPLOAD_FOLDER'], upload_id) if upload_id else None
     app_logger.info(f"File path from session: {session_file_path}")
     
     if not file_path and not session_file_path:
@@ -108,38 +277,40 @@ def get_columns():
     if not os.path.exists(file_path):
         app_logger.error(f"File not found at path: {file_path}")
         return jsonify({'error': 'File not found at the specified path'}), 400
+    try:
+        metadata_filter = parse_filter(filter_options)
+    except MetadataFilterError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def columns_etag():
+        return upload_etag(file_path, 'columns', metadata_filter, output_option)
+
+    etag = columns_etag()
+    matched_etag = matching_etag(etag)
+    if matched_etag:
+        app_logger.info(f"Columns not modified: {matched_etag}")
+        return not_modified_response(matched_etag)
+    admission.start_job()
 
     try:
-        json_files = []
-        if file_path.endswith('.zip'):
-            with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                zip_ref.extractall(app.config['UPLOAD_FOLDER'])
-                json_files = [os.path.join(app.config['UPLOAD_FOLDER'], f) for f in zip_ref.namelist() if f.endswith('.json')]
-        else:
-            json_files = [file_path]
-        num_pi, num_pj, num_pot, num_pet = findAllTrials(json_files)
-        df = JSONtoCSV(json_files, os.path.basename(file_path), num_pi, num_pj, num_pot, num_pet)
-        app_logger.info(f"OMG！！！DataFrame shape: {df.shape}")
-        app_logger.info(f"OMG！！！DataFrame columns: {df.columns.tolist()}")
-        app_logger.info(f"OMG ！！！DataFrame: {df['Nest_X'].values}")
-        app_logger.info(f"OMG ！！！DataFrame: {df['Nest_Y'].values}")
-        app_logger.info(f"OMG ！！！DataFrame: {df['Cave_X'].values}")
-        app_logger.info(f"OMG ！！！DataFrame: {df['Cave_Y'].values}")
-        app_logger.info(f"OMG ！！！DataFrame: {df['Arch_X'].values}")
-        app_logger.info(f"OMG ！！！DataFrame: {df['Arch_Y'].values}")
         if output_option == 'summary':
+            # Served from the summary table materialized at ingest, the wide table is not needed
             app_logger.info("Returning summary columns")
+            df = load_summary(file_path, app.config['UPLOAD_FOLDER'], metadata_filter=metadata_filter, **dataset_options())
             column_groups = get_summary_columns()
         else:
+            dataset = load_dataset(file_path, app.config['UPLOAD_FOLDER'], metadata_filter=metadata_filter, **dataset_options())
+            num_pi, num_pj, num_pot, num_pet = dataset.trial_counts
+            with dataset.lock:
+                dataset.averages.reset()
+                df = dataset.df.copy()
+            app_logger.debug(f"DataFrame shape: {df.shape}")
             app_logger.info("Returning all trials columns")
             column_groups = get_column_groups(df, num_pi, num_pj, num_pot, num_pet)
-        app_logger.info(f"OMG！！！Column groups: {column_groups}")
-        
+
         cleaned_column_groups = clean_column_groups(column_groups, df)
-        
-        app_logger.info(f"Processed column groups: {cleaned_column_groups}")
-        app_logger.info(f"Column groups type: {type(cleaned_column_groups)}")
-        app_logger.info(f"Column groups keys: {cleaned_column_groups.keys() if isinstance(cleaned_column_groups, dict) else 'Not a dict'}")
+
+        app_logger.debug(f"Column groups: {len(cleaned_column_groups)}")
         
         def process_group(group):
             if isinstance(group, dict):
@@ -157,9 +328,18 @@ def get_columns():
             return group
        
         top_level_groups = {k: process_group(v) for k, v in cleaned_column_groups.items()}
-        app_logger.info(f"Processed top_level_groups: {top_level_groups}")
-        response_data = {"columns": top_level_groups}
-        return jsonify(response_data)
+        app_logger.debug(f"Top-level column groups: {list(top_level_groups)}")
+        response_data = {"columns": top_level_groups, "validation": validation_summary(load_validation(file_path, metadata_filter))}
+        body = app.json.dumps(response_data).encode()
+        # Building the dataset may have (re)written the validation report
+        return cached_response([body], 'application/json', columns_etag(), choose_encoding(len(body)))
+    except DuplicateSessionError as e:
+        app_logger.error(f'Duplicate sessions in {file_path}: {e.duplicates}')
+        return jsonify({'error': str(e), 'duplicates': e.duplicates}), 409
+    except ResourceLimitError as e:
+        return resource_limit_response(e)
+    except MetadataFilterError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         app_logger.error(f'Error in get_columns: {str(e)}')
         import traceback
@@ -167,11 +347,31 @@ def get_columns():
         return jsonify({'error': f'An error occurred while fetching columns: {str(e)}'}), 500
     
 
+@app.route('/api/validation', methods=['GET'])
+@admission.heavy
+def get_validation():
+    """Per-file completeness report of an upload, including the files that were quarantined."""
+    upload_id = session.get('upload_id')
+    file_path = request.args.get('file_path') or (os.path.join(app.config['UPLOAD_FOLDER'], upload_id) if upload_id else None)
+    if not file_path:
+        return jsonify({'error': 'File path not found'}), 400
+    if not os.path.exists(file_path):
+        return jsonify({'error': 'File not found at the specified path'}), 400
+
+    validation = load_validation(file_path)
+    if validation is None:
+        admission.start_job()
+        try:
+            validation, _ = get_valid_json_files(file_path, app.config['UPLOAD_FOLDER'], **dataset_options())
+        except DuplicateSessionError as e:
+            return jsonify({'error': str(e), 'duplicates': e.duplicates}), 409
+    return jsonify(validation), 200
+
 def expand_selected_columns(selected_columns, column_groups_all_trials, column_groups_average, df, output_option):
     expanded_columns = []
     app_logger.info(f"Input selected_columns: {selected_columns}")
     app_logger.info(f"Output option: {output_option}")
-    app_logger.info(f"DataFrame columns: {df.columns.tolist()}")
+    app_logger.debug(f"DataFrame columns: {len(df.columns)}")
     if not selected_columns:
         app_logger.warning("No columns selected")
         return expanded_columns
@@ -210,7 +410,103 @@ def expand_selected_columns(selected_columns, column_groups_all_trials, column_g
     expanded_columns = list(dict.fromkeys(expanded_columns))  # Remove duplicates
     return expanded_columns
 
+def get_cleaned_column_groups(df, trial_counts, averages):
+    """The all-trials and summary column groups of df without its empty columns.
+
+    Cleaning reads every value of df, so the groups are kept on the dataset's IncrementalAverages and only
+    cleaned again when the columns of df change."""
+    key = (tuple(df.columns), trial_counts)
+    if averages.column_groups_key != key:
+        averages.column_groups = (clean_column_groups(get_column_groups(df, *trial_counts), df),
+                                  clean_column_groups(get_summary_columns(), df))
+        averages.column_groups_key = key
+    return averages.column_groups
+
+def get_circular_statistics_without(df, outliers, averages):
+    """The circular summaries of df without the trials the outlier flags exclude, kept on the dataset's
+    IncrementalAverages for the flags they were computed for."""
+    if averages.circular_key != outliers.key:
+        averages.circular_columns = circular_statistics_without(df, outliers.excluded())
+        averages.circular_key = outliers.key
+    return averages.circular_columns
+
+def select_output_frame(df, trial_counts, averages, selected_columns, output_option, outliers=None, exclude_outliers=False):
+    """Expands a column selection on a wide table and recomputes the averages of the selected trials.
+    Returns None if none of the selected columns exist.
+
+    With the OutlierFlags of the cohort, the flagged trials are marked in the output and, with exclude_outliers,
+    left out of the averages and the circular summaries."""
+    cleaned_column_groups_all_trials, cleaned_column_groups_averages = get_cleaned_column_groups(df, trial_counts, averages)
+
+    # The long format selects trials the same way as the wide all-trials output
+    expand_option = 'all_trials' if output_option == 'long' else output_option
+    expanded_columns = expand_selected_columns(selected_columns, cleaned_column_groups_all_trials, cleaned_column_groups_averages, df, expand_option)
+    app_logger.info(f"Expanded columns: {expanded_columns}")
+    existing_columns = list(dict.fromkeys([col for col in expanded_columns if col in df.columns]))
+    app_logger.info(f"Existing columns: {existing_columns}")
+    # Identify missing columns
+    missing_columns = [col for col in expanded_columns if col not in df.columns]
+    app_logger.info(f"Missing columns: {missing_columns}")
+
+    if not existing_columns:
+        app_logger.error("No valid columns selected")
+        return None
+
+    if outliers is not None and exclude_outliers:
+        averages.set_exclusions(outliers.excluded(), outliers.key)
+    else:
+        averages.set_exclusions(None)
+    # Only the trial blocks whose selection changed since the last request are recomputed
+    unselected_pot = averages.apply_selection(selected_columns)
+
+    # Drop unselected averages if needed
+    columns_to_drop = [f'Avg_PointingJudgement_AbsoluteError_{trial}' for trial in unselected_pot]
+    app_logger.info(f"UnSelected_trials_Pointing: {columns_to_drop}")
+    existing_columns = [item for item in existing_columns if item not in columns_to_drop]
+
+    new_df = df[existing_columns]
+    if outliers is not None and exclude_outliers:
+        # The circular summaries leave the excluded trials out like the averages do
+        circular = get_circular_statistics_without(df, outliers, averages)
+        new_df = new_df.assign(**{col: values for col, values in circular.items() if col in new_df.columns})
+    if output_option == 'long':
+        # Selected columns that are not per trial, e.g. the Avg_* averages of the selection, stay as participant columns
+        participant_columns = [col for col in existing_columns if parse_trial_column(col) is None and col != 'Player_ID']
+        new_df = to_long_format(new_df, df['Player_ID'], outliers, participant_columns)
+    elif outliers is not None:
+        new_df = outliers.add_columns(new_df)
+    return new_df
+
+def select_summary_frame(df, selected_columns):
+    cleaned_column_groups_averages = clean_column_groups(get_summary_columns(), df)
+    expanded_columns = expand_selected_columns(selected_columns, None, cleaned_column_groups_averages, df, 'summary')
+    app_logger.info(f"Expanded columns: {expanded_columns}")
+    if not any(col in df.columns for col in expanded_columns):
+        app_logger.error("No valid columns selected")
+        return None
+    return df[expanded_columns]
+
+def build_output_frame(file_path, selected_columns, output_option, outlier_options=None, metadata_filter=None):
+    """Builds the output DataFrame for one column selection. Returns None if none of the selected columns exist.
+
+    outlier_options is (method, threshold, exclude) from parse_outlier_options, or None. With a MetadataFilter
+    only the participants it selects are extracted and output."""
+    if output_option == 'summary':
+        if outlier_options:
+            raise OutlierOptionError("Outlier flags need the trial columns and are not available for the summary output")
+        df = load_summary(file_path, app.config['UPLOAD_FOLDER'], metadata_filter=metadata_filter, **dataset_options())
+        return select_summary_frame(df, selected_columns)
+
+    dataset = load_dataset(file_path, app.config['UPLOAD_FOLDER'], metadata_filter=metadata_filter, **dataset_options())
+    with dataset.lock:
+        outliers, exclude = None, False
+        if outlier_options:
+            method, threshold, exclude = outlier_options
+            outliers = dataset.get_outlier_flags(method, threshold)
+        return select_output_frame(dataset.df, dataset.trial_counts, dataset.averages, selected_columns, output_option, outliers, exclude)
+
 @app.route('/api/process', methods=['POST'])
+@admission.heavy
 def process_columns():
     data = request.json
     download_folder = app.config['DOWNLOAD_FOLDER']
@@ -222,82 +518,296 @@ def process_columns():
     selected_columns = data.get('columns', [])
     output_option = data.get('option', 'all_trials')
     file_path = data.get('file_path')
+    output_format = data.get('format', DEFAULT_FORMAT)
+    compression = data.get('compression')
+    float_precision = data.get('float_precision')
     app_logger.info(f"Selected columns: {selected_columns}")
     app_logger.info(f"Output option: {output_option}")
+    app_logger.info(f"Output format: {output_format}")
     app_logger.info(f"File path: {file_path}")
     if not file_path or not os.path.exists(file_path):
         app_logger.error(f"File not found at path: {file_path}")
         return jsonify({'error': 'File not found'}), 400
+    try:
+        check_format(output_format)
+        outlier_options = parse_outlier_options(data.get('outliers'))
+        metadata_filter = parse_filter(data.get('filter'))
+    except (OutputFormatError, OutlierOptionError, MetadataFilterError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    def process_etag():
+        return upload_etag(file_path, 'process', metadata_filter, output_option, selected_columns, output_format, compression,
+                           float_precision, outlier_options)
+
+    etag = process_etag()
+    matched_etag = matching_etag(etag)
+    if matched_etag:
+        app_logger.info(f"Export not modified: {matched_etag}")
+        return not_modified_response(matched_etag)
+    admission.start_job()
 
     try:
-        json_files = []
-        if file_path.endswith('.zip'):
-            with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                zip_ref.extractall(app.config['UPLOAD_FOLDER'])
-                json_files = [os.path.join(app.config['UPLOAD_FOLDER'], f) for f in zip_ref.namelist() if f.endswith('.json')]
-        else:
-            json_files = [file_path]
-
-        num_pi, num_pj, num_pot, num_pet = findAllTrials(json_files)
-        app_logger.info(f"Number of PI: {num_pi}, Number of PJ: {num_pj}, Number of POT: {num_pot}, Number of PET: {num_pet}")
-        df = JSONtoCSV(json_files, os.path.basename(file_path), num_pi, num_pj, num_pot, num_pet)
-        app_logger.info(f"SOS！！！DataFrame shape: {df.shape}")
-        app_logger.info(f"SOS！！！DataFrame columns: {df.columns.tolist()}")
-        app_logger.info(f"SOS！！！DataFrame: {df[['Nest_X', 'Nest_Y', 'Cave_X', 'Cave_Y', 'Arch_X', 'Arch_Y']]}")
-        column_groups_all_trials = get_column_groups(df, num_pi, num_pj, num_pot, num_pet)
-        column_groups_average = get_summary_columns()
-        cleaned_column_groups_all_trials = clean_column_groups(column_groups_all_trials, df)
-        cleaned_column_groups_averages = clean_column_groups(column_groups_average, df)
-
-        expanded_columns = expand_selected_columns(selected_columns, cleaned_column_groups_all_trials, cleaned_column_groups_averages, df, output_option)
-        app_logger.info(f"Expanded columns: {expanded_columns}")
-        existing_columns = list(dict.fromkeys([col for col in expanded_columns if col in df.columns]))
-        app_logger.info(f"Existing columns: {existing_columns}")
-        # Identify missing columns
-        missing_columns = [col for col in expanded_columns if col not in df.columns]
-        app_logger.info(f"Missing columns: {missing_columns}")
-        
-        if not existing_columns:
-            app_logger.error("No valid columns selected")
+        new_df = build_output_frame(file_path, selected_columns, output_option, outlier_options, metadata_filter)
+        if new_df is None:
             return jsonify({'error': 'None of the selected columns were found in the data'}), 400
-        
-        if output_option in ['all_trials', 'detailed']:
-            calculate_pi_averages(df, selected_columns)
-            unselected_pot = calculate_pointing_averages(df, selected_columns, num_pot)
-            calculate_pet_averages(df, selected_columns)
-            
-            # Drop unselected averages if needed
-            columns_to_drop = [f'Avg_PointingJudgement_AbsoluteError_{trial}' for trial in unselected_pot]
-            app_logger.info(f"UnSelected_trials_Pointing: {columns_to_drop}")
-            existing_columns = [item for item in existing_columns if item not in columns_to_drop]
-
-            new_df = df[existing_columns]
-        else:
-            new_df = df[expanded_columns]
         app_logger.info(f"Final DataFrame shape: {new_df.shape}")
         app_logger.info(f"Final DataFrame columns: {new_df.columns.tolist()}")
-        csv_filename = 'combined_output.csv'
+        csv_filename = output_filename('combined_output', output_format)
         csv_path = os.path.join(download_folder, csv_filename)
-        app_logger.info(f"Attempting to save CSV to: {csv_path}")
-        new_df.to_csv(csv_path, index=False)
-        app_logger.info(f"CSV saved to: {csv_path}")
+        app_logger.info(f"Attempting to save {output_format} to: {csv_path}")
+        tmp_path = f"{csv_path}.{uuid.uuid4().hex}.tmp"
+        write_frame(new_df, tmp_path, output_format, compression, float_precision)
         # Check if the file was actually created
-        if not os.path.exists(csv_path):
-            app_logger.error(f"Failed to create CSV file at {csv_path}")
-            return jsonify({'error': 'Failed to create CSV file'}), 500
+        if not os.path.exists(tmp_path):
+            app_logger.error(f"Failed to create output file at {tmp_path}")
+            return jsonify({'error': 'Failed to create output file'}), 500
 
         app_logger.info(f"Attempting to send file from: {csv_path}")
         try:
-            return send_from_directory(directory=download_folder, path=csv_filename, as_attachment=True, mimetype='text/csv')
+            # Opened before it replaces the previous output, so a concurrent export cannot change what is streamed
+            csv_file = open(tmp_path, 'rb')
+            _, mimetype, compressible = OUTPUT_FORMATS[output_format]
+            # Parquet and Feather are compressed already
+            encoding = choose_encoding(os.path.getsize(tmp_path)) if compressible else None
+            os.replace(tmp_path, csv_path)
+            app_logger.info(f"Output saved to: {csv_path}")
+            return cached_response(iter_file(csv_file), mimetype, process_etag(), encoding,
+                                   headers={'Content-Disposition': f'attachment; filename={csv_filename}'})
         except Exception as e:
             app_logger.error(f"Failed to send file: {str(e)}")
             return jsonify({'error': 'Failed to send file'}), 500
+    except DuplicateSessionError as e:
+        app_logger.error(f'Duplicate sessions in {file_path}: {e.duplicates}')
+        return jsonify({'error': str(e), 'duplicates': e.duplicates}), 409
+    except ResourceLimitError as e:
+        return resource_limit_response(e)
+    except (OutputFormatError, OutlierOptionError, MetadataFilterError) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         app_logger.error(f'Error in process_columns: {str(e)}')
         import traceback
         app_logger.error(traceback.format_exc())
         return jsonify({'error': 'An error occurred while processing the file. Please try again.'}), 500
 
+@app.route('/api/preview', methods=['POST'])
+@admission.heavy
+def preview_columns():
+    """Returns one page of rows for a column selection as JSON, extracting only the session files of that page.
+
+    When the upload's wide table is already cached the page is cut from it instead. Pages follow the validated,
+    deduplicated files of the participants a filter selects, and outlier flags are scored against the stored
+    outlier reference of that cohort, so the page has the rows /api/process would output."""
+    data = request.json
+    selected_columns = data.get('columns', [])
+    output_option = data.get('option', 'all_trials')
+    file_path = data.get('file_path')
+    if not file_path or not os.path.exists(file_path):
+        app_logger.error(f"File not found at path: {file_path}")
+        return jsonify({'error': 'File not found'}), 400
+    try:
+        offset = int(data.get('offset', 0))
+        limit = int(data.get('limit', PREVIEW_DEFAULT_LIMIT))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'offset and limit must be integers'}), 400
+    if offset < 0 or not 0 < limit <= PREVIEW_MAX_LIMIT:
+        return jsonify({'error': f'offset must be at least 0 and limit between 1 and {PREVIEW_MAX_LIMIT}'}), 400
+    try:
+        outlier_options = parse_outlier_options(data.get('outliers'))
+        metadata_filter = parse_filter(data.get('filter'))
+        if outlier_options and output_option == 'summary':
+            raise OutlierOptionError("Outlier flags need the trial columns and are not available for the summary output")
+    except (OutlierOptionError, MetadataFilterError) as e:
+        return jsonify({'error': str(e)}), 400
+    app_logger.info(f"Preview of {output_option} rows {offset} to {offset + limit} from: {file_path}")
+    admission.start_job()
+
+    try:
+        options = dataset_options()
+        dataset = get_cached_dataset(file_path, options['duplicate_policy'], metadata_filter)
+        summary_path = get_summary_path(file_path, metadata_filter)
+        if output_option == 'summary' and (metadata_filter is not None or
+                                           (os.path.exists(summary_path) and os.path.getmtime(summary_path) >= os.path.getmtime(file_path))):
+            df = load_summary(file_path, app.config['UPLOAD_FOLDER'], metadata_filter=metadata_filter, **options)
+            total = len(df)
+            new_df = select_summary_frame(df.iloc[offset:offset + limit], selected_columns)
+        elif dataset is not None and dataset.df is not None:
+            total = len(dataset.df)
+            with dataset.lock:
+                if output_option == 'summary':
+                    # The Avg_* columns of the wide table follow the last selection, the summary needs all trials
+                    dataset.averages.reset()
+                    page_df = dataset.df.iloc[offset:offset + limit].copy()
+                else:
+                    outliers, exclude = None, False
+                    if outlier_options:
+                        method, threshold, exclude = outlier_options
+                        outliers = dataset.get_outlier_flags(method, threshold)
+                    new_df = select_output_frame(dataset.df, dataset.trial_counts, dataset.averages, selected_columns, output_option,
+                                                 outliers, exclude)
+            if output_option == 'summary':
+                new_df = select_summary_frame(build_summary_table(page_df.values.tolist(), page_df.columns.tolist()), selected_columns)
+            elif new_df is not None:
+                # Long rows belong to the participants of the page
+                new_df = new_df[new_df['Participant'].between(offset, offset + limit - 1)] if output_option == 'long' else new_df.iloc[offset:offset + limit]
+        else:
+            page_df, trial_counts, total = load_page(file_path, app.config['UPLOAD_FOLDER'], offset, limit, metadata_filter=metadata_filter, **options)
+            if page_df is None:
+                return jsonify({'error': 'Failed to extract the requested rows'}), 500
+            if output_option == 'summary':
+                new_df = select_summary_frame(build_summary_table(page_df.values.tolist(), page_df.columns.tolist()), selected_columns)
+            else:
+                outliers, exclude = None, False
+                if outlier_options:
+                    # Scored against the whole cohort through its stored outlier reference
+                    method, threshold, exclude = outlier_options
+                    reference = load_outlier_reference(file_path, app.config['UPLOAD_FOLDER'], metadata_filter=metadata_filter, **options)
+                    outliers = OutlierFlags(page_df, method, threshold, reference=reference)
+                new_df = select_output_frame(page_df, trial_counts, IncrementalAverages(page_df, trial_counts[2]), selected_columns, output_option,
+                                             outliers, exclude)
+                if new_df is not None and output_option == 'long':
+                    new_df = new_df.assign(Participant=new_df['Participant'] + offset)
+        if new_df is None:
+            return jsonify({'error': 'None of the selected columns were found in the data'}), 400
+
+        page = json.loads(new_df.to_json(orient='split', index=False))
+        return jsonify({'offset': offset, 'limit': limit, 'total': total, 'columns': page['columns'], 'rows': page['data']}), 200
+    except DuplicateSessionError as e:
+        app_logger.error(f'Duplicate sessions in {file_path}: {e.duplicates}')
+        return jsonify({'error': str(e), 'duplicates': e.duplicates}), 409
+    except ResourceLimitError as e:
+        return resource_limit_response(e)
+    except MetadataFilterError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app_logger.error(f'Error in preview_columns: {str(e)}')
+        import traceback
+        app_logger.error(traceback.format_exc())
+        return jsonify({'error': 'An error occurred while building the preview. Please try again.'}), 500
+
+@app.route('/api/statistics', methods=['POST'])
+@admission.heavy
+def cohort_statistics():
+    """Count, mean, variance, min/max and approximate quantiles per column over all participants of an upload, or
+    over those a participant filter selects."""
+    data = request.json
+    file_path = data.get('file_path')
+    columns = data.get('columns') or None
+    quantiles = data.get('quantiles') or list(DEFAULT_QUANTILES)
+    if not file_path or not os.path.exists(file_path):
+        app_logger.error(f"File not found at path: {file_path}")
+        return jsonify({'error': 'File not found'}), 400
+    if not all(isinstance(q, (int, float)) and 0 <= q <= 1 for q in quantiles):
+        return jsonify({'error': 'quantiles must be numbers between 0 and 1'}), 400
+    try:
+        metadata_filter = parse_filter(data.get('filter'))
+    except MetadataFilterError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def statistics_etag():
+        return upload_etag(file_path, 'statistics', metadata_filter, columns, quantiles)
+
+    etag = statistics_etag()
+    matched_etag = matching_etag(etag)
+    if matched_etag:
+        return not_modified_response(matched_etag)
+    admission.start_job()
+
+    try:
+        options = dataset_options()
+        dataset = get_cached_dataset(file_path, options['duplicate_policy'], metadata_filter)
+        if dataset is not None and dataset.df is not None:
+            stats = CohortStatistics(columns)
+            with dataset.lock:
+                dataset.averages.reset()
+                stats.update(dataset.df)
+        else:
+            # One streaming pass over the participant files, without building the wide table
+            validation, json_files = get_valid_json_files(file_path, app.config['UPLOAD_FOLDER'], metadata_filter=metadata_filter, **options)
+            stats = stream_statistics(json_files, get_trial_counts(file_path, validation), columns, app.config['STATISTICS_WORKERS'])
+        body = app.json.dumps(stats.to_dict(quantiles)).encode()
+        return cached_response([body], 'application/json', statistics_etag(), choose_encoding(len(body)))
+    except DuplicateSessionError as e:
+        app_logger.error(f'Duplicate sessions in {file_path}: {e.duplicates}')
+        return jsonify({'error': str(e), 'duplicates': e.duplicates}), 409
+    except ResourceLimitError as e:
+        return resource_limit_response(e)
+    except MetadataFilterError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app_logger.error(f'Error in cohort_statistics: {str(e)}')
+        import traceback
+        app_logger.error(traceback.format_exc())
+        return jsonify({'error': 'An error occurred while computing statistics. Please try again.'}), 500
+
+@app.route('/api/export', methods=['POST'])
+@admission.heavy
+def export_batch():
+    """Builds several exports from one parsed dataset and returns them as a single zip."""
+    data = request.json
+    download_folder = app.config['DOWNLOAD_FOLDER']
+    os.makedirs(download_folder, exist_ok=True)
+
+    exports = data.get('exports', [])
+    file_path = data.get('file_path')
+    output_format = data.get('format', DEFAULT_FORMAT)
+    app_logger.info(f"Batch export of {len(exports)} selections as {output_format} from: {file_path}")
+    if not file_path or not os.path.exists(file_path):
+        app_logger.error(f"File not found at path: {file_path}")
+        return jsonify({'error': 'File not found'}), 400
+    if not exports:
+        return jsonify({'error': 'No exports requested'}), 400
+    try:
+        check_format(output_format)
+        outlier_options = parse_outlier_options(data.get('outliers'))
+        metadata_filter = parse_filter(data.get('filter'))
+    except (OutputFormatError, OutlierOptionError, MetadataFilterError) as e:
+        return jsonify({'error': str(e)}), 400
+    admission.start_job()
+
+    zip_filename = 'combined_export.zip'
+    zip_path = os.path.join(download_folder, zip_filename)
+    # Every request builds its own archive, a concurrent export never writes to or replaces one being built
+    tmp_path = f"{zip_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        used_names = set()
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+            for i, export in enumerate(exports):
+                name = secure_filename(export.get('name') or '') or f'export_{i}'
+                if name in used_names:
+                    name = f'{name}_{i}'
+                used_names.add(name)
+
+                # Every selection after the first reuses the cached dataset and averaging state
+                new_df = build_output_frame(file_path, export.get('columns', []), export.get('option', 'all_trials'), outlier_options,
+                                            metadata_filter)
+                if new_df is None:
+                    return jsonify({'error': f"None of the selected columns were found in the data for export '{name}'"}), 400
+                zip_ref.writestr(output_filename(name, output_format),
+                                 frame_to_bytes(new_df, output_format, data.get('compression'), data.get('float_precision')))
+                app_logger.info(f"Added export {name} with shape {new_df.shape}")
+
+        # Opened before it replaces the previous archive, so a concurrent export cannot change what is streamed
+        zip_file = open(tmp_path, 'rb')
+        os.replace(tmp_path, zip_path)
+        return Response(iter_file(zip_file), mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename={zip_filename}'})
+    except DuplicateSessionError as e:
+        app_logger.error(f'Duplicate sessions in {file_path}: {e.duplicates}')
+        return jsonify({'error': str(e), 'duplicates': e.duplicates}), 409
+    except ResourceLimitError as e:
+        return resource_limit_response(e)
+    except (OutlierOptionError, MetadataFilterError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app_logger.error(f'Error in export_batch: {str(e)}')
+        import traceback
+        app_logger.error(traceback.format_exc())
+        return jsonify({'error': 'An error occurred while exporting the file. Please try again.'}), 500
+    finally:
+        # Left behind only when the export failed
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 @app.route('/static/<path:path>')
 def send_static(path):
     return send_from_directory('static', path)
@@ -306,5 +816,30 @@ def send_static(path):
 def download_file(filename):
     return send_file(os.path.join(app.config['DOWNLOAD_FOLDER'], filename), as_attachment=True)
 
+def warm_up_app():
+    """Warms up extraction, output selection and the /api/columns request path without touching uploads or sessions."""
+    df, trial_counts = warm_up_extraction()
+    select_output_frame(df, trial_counts, IncrementalAverages(df, trial_counts[2]), list(df.columns), 'all_trials')
+    with app.test_client() as client:
+        client.get('/api/columns')
+
+# Reported by /api/health; pid is the process that imported the app, the gunicorn master when preloaded
+startup = {'pid': os.getpid(), 'warm_up_seconds': None}
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    return jsonify({**startup, 'worker_pid': os.getpid(), 'preloaded': startup['pid'] != os.getpid()}), 200
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Admission queue depth, running jobs, rejections and aborts of this worker process."""
+    return jsonify({'worker_pid': os.getpid(), 'admission': admission.metrics()}), 200
+
+# The warm-up sends a request, after which Flask accepts no new routes, so it runs after all of them are registered
+if app.config['WARM_UP']:
+    startup['warm_up_seconds'] = timed_warm_up(warm_up_app)
+startup['startup_seconds'] = time.perf_counter() - SETUP_STARTED
+app_logger.info(f"App set up in {startup['startup_seconds']:.3f}s (warm-up: {startup['warm_up_seconds']})")
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=7069, debug=True)
\ No newline at end of file
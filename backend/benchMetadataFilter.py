@@ -0,0 +1,92 @@
+"""Extraction time of a filtered cohort against extracting the whole upload.
+
+Builds a synthetic zip in which a given fraction of the sessions has the Settings_file the filter selects, then
+times the MetaData scan alone and the full path from the upload to the wide table (extraction, validation,
+trial counts and processing) with and without the filter.
+
+Example:
+    python benchMetadataFilter.py --participants 500 --selected 0.1 --repeats 3 --report metadata_filter_report.json
+"""
+import os
+import json
+import time
+import random
+import shutil
+import zipfile
+import argparse
+import logging
+import statistics
+import tempfile
+from syntheticSession import make_synthetic_session
+from datasetCache import Dataset, get_json_members, select_members
+from metadataFilter import MetadataFilter
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SELECTED_SETTINGS = 'uSPACE'
+OTHER_SETTINGS = 'uSPACE_pilot'
+
+
+def build_zip(path, participants, selected, seed):
+    rng = random.Random(seed)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for i in range(participants):
+            session = make_synthetic_session(rng, f'P{i:04d}')
+            session['MetaData']['Settings_file'] = SELECTED_SETTINGS if rng.random() < selected else OTHER_SETTINGS
+            zip_ref.writestr(f'P{i:04d}.json', json.dumps(session))
+
+
+def time_build(zip_path, workdir, metadata_filter, repeats):
+    """Median seconds from the upload to the wide table and the shape of the table. Every repeat starts from a
+    fresh upload folder holding only the zip."""
+    timings = []
+    for i in range(repeats):
+        upload_folder = os.path.join(workdir, f'upload_{i}')
+        os.makedirs(upload_folder)
+        upload = shutil.copy(zip_path, upload_folder)
+        start = time.perf_counter()
+        dataset = Dataset(upload, upload_folder, metadata_filter=metadata_filter)
+        timings.append(time.perf_counter() - start)
+        shutil.rmtree(upload_folder)
+    return {'seconds': statistics.median(timings), 'shape': list(dataset.df.shape), 'trial_counts': list(dataset.trial_counts)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare extraction time with and without a metadata filter.')
+    parser.add_argument('--participants', type=int, default=200, help='sessions in the synthetic zip')
+    parser.add_argument('--selected', type=float, default=0.1, help='fraction of the sessions the filter selects')
+    parser.add_argument('--repeats', type=int, default=3, help='builds per variant, the median is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', default='metadata_filter_report.json')
+    args = parser.parse_args(argv)
+
+    metadata_filter = MetadataFilter(settings_files=[SELECTED_SETTINGS])
+    workdir = tempfile.mkdtemp(prefix='bench_filter_')
+    try:
+        zip_path = os.path.join(workdir, 'cohort.zip')
+        build_zip(zip_path, args.participants, args.selected, args.seed)
+        start = time.perf_counter()
+        selected = select_members(zip_path, get_json_members(zip_path), metadata_filter)
+        scan_seconds = time.perf_counter() - start
+
+        report = {'participants': args.participants, 'selected': len(selected), 'zip_bytes': os.path.getsize(zip_path),
+                  'scan_seconds': scan_seconds,
+                  'unfiltered': time_build(zip_path, workdir, None, args.repeats),
+                  'filtered': time_build(zip_path, workdir, metadata_filter, args.repeats)}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    unfiltered, filtered = report['unfiltered'], report['filtered']
+    logger.info(f"MetaData scan of {args.participants} sessions: {scan_seconds:.3f}s, {len(selected)} selected")
+    logger.info(f"Unfiltered: {unfiltered['seconds']:.3f}s for {unfiltered['shape'][0]} x {unfiltered['shape'][1]}; "
+                f"filtered: {filtered['seconds']:.3f}s for {filtered['shape'][0]} x {filtered['shape'][1]} "
+                f"({unfiltered['seconds'] / filtered['seconds']:.1f}x faster)")
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Report written to: {args.report}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Write time and file size of the output formats against the original DataFrame.to_csv path.
+
+Extracts a synthetic cohort once, then writes its wide and long tables with plain to_csv and with every
+available output format, and reports the median write time and the file size of each.
+
+Example:
+    python benchOutputFormats.py --participants 500 --repeats 5 --report output_formats_report.json
+"""
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import logging
+import statistics
+import tempfile
+from syntheticSession import make_synthetic_session
+from finalJSONtoCSV import JSONProcessor, get_column_headers, process_json_files, build_wide_table
+from sessionValidation import validate_sessions, mark_short_sections
+from longFormat import to_long_format
+from outputFormats import available_formats, output_filename, prepare_frame, write_frame
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def build_cohort(participants, seed, workdir):
+    rng = random.Random(seed)
+    session_paths = []
+    for i in range(participants):
+        path = os.path.join(workdir, f'P{i:04d}.json')
+        with open(path, 'w') as f:
+            json.dump(make_synthetic_session(rng, f'P{i:04d}'), f)
+        session_paths.append(path)
+    trial_counts = tuple(mark_short_sections(validate_sessions(session_paths)).values())
+    data = process_json_files(session_paths, JSONProcessor(*trial_counts))
+    return build_wide_table(data, get_column_headers(*trial_counts))
+
+
+def time_write(write, path, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        write(path)
+        timings.append(time.perf_counter() - start)
+    return {'seconds': statistics.median(timings), 'bytes': os.path.getsize(path)}
+
+
+def bench_table(df, formats, repeats, workdir, compression, float_precision):
+    results = {'to_csv': time_write(lambda path: df.to_csv(path, index=False), os.path.join(workdir, 'to_csv.csv'), repeats)}
+    start = time.perf_counter()
+    prepare_frame(df, float_precision)
+    results['prepare_seconds'] = time.perf_counter() - start
+    for fmt in formats:
+        path = os.path.join(workdir, output_filename(f'out_{fmt}', fmt))
+        results[fmt] = time_write(lambda path: write_frame(df, path, fmt, compression, float_precision), path, repeats)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare write time and file size of the output formats.')
+    parser.add_argument('--participants', type=int, default=200, help='sessions in the synthetic cohort')
+    parser.add_argument('--repeats', type=int, default=3, help='writes per format, the median is reported')
+    parser.add_argument('--formats', nargs='+', default=available_formats())
+    parser.add_argument('--compression', help='Parquet/Feather codec, the format default if not given')
+    parser.add_argument('--float-precision', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', default='output_formats_report.json')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='bench_formats_')
+    try:
+        wide = build_cohort(args.participants, args.seed, workdir)
+        tables = {'wide': wide, 'long': to_long_format(wide)}
+        report = {'participants': args.participants, 'compression': args.compression, 'float_precision': args.float_precision, 'tables': {}}
+        for name, df in tables.items():
+            results = bench_table(df, args.formats, args.repeats, workdir, args.compression, args.float_precision)
+            report['tables'][name] = {'shape': list(df.shape), **results}
+            baseline = results['to_csv']
+            logger.info(f"{name} table {df.shape[0]} x {df.shape[1]}: to_csv {baseline['seconds']:.3f}s, {baseline['bytes']} bytes; "
+                        f"typing {results['prepare_seconds']:.3f}s")
+            for fmt in args.formats:
+                result = results[fmt]
+                logger.info(f"  {fmt}: {result['seconds']:.3f}s ({result['seconds'] / baseline['seconds']:.2f}x), "
+                            f"{result['bytes']} bytes ({result['bytes'] / baseline['bytes']:.2f}x)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Report written to: {args.report}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Per-request session overhead of the session backends.
+
+Runs a read-only and a writing request through a minimal Flask app for each backend and reports the
+mean time per request above a baseline app without session access.
+
+Example:
+    python benchSessions.py --requests 2000
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import logging
+from datetime import timedelta
+from flask import Flask, session
+from sessionBackends import create_session_interface
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def make_app(backend, workdir):
+    app = Flask(__name__)
+    app.secret_key = "benchmark"
+    app.config['SESSION_PERMANENT'] = True
+    app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
+    if backend == 'filesystem':
+        from flask_session import Session
+        app.config['SESSION_TYPE'] = 'filesystem'
+        app.config['SESSION_FILE_DIR'] = os.path.join(workdir, 'flask_session')
+        Session(app)
+    elif backend != 'none':
+        app.config['SESSION_BACKEND'] = backend
+        app.config['SESSION_SQLITE_PATH'] = os.path.join(workdir, 'sessions.sqlite3')
+        app.session_interface = create_session_interface(app)
+
+    @app.route('/write')
+    def write():
+        if backend != 'none':
+            session['upload_id'] = 'cohort.zip'
+        return 'ok'
+
+    @app.route('/read')
+    def read():
+        return session.get('upload_id', '') if backend != 'none' else 'ok'
+
+    return app
+
+
+def time_requests(client, path, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get(path)
+    return (time.perf_counter() - start) / requests
+
+
+def run(backends, requests):
+    results = {}
+    workdir = tempfile.mkdtemp(prefix='bench_sessions_')
+    try:
+        for backend in ['none'] + backends:
+            client = make_app(backend, workdir).test_client()
+            client.get('/write')
+            results[backend] = {
+                'write_seconds': time_requests(client, '/write', requests),
+                'read_seconds': time_requests(client, '/read', requests),
+            }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = results.pop('none')
+    for backend, timings in results.items():
+        timings['write_overhead_us'] = (timings['write_seconds'] - baseline['write_seconds']) * 1e6
+        timings['read_overhead_us'] = (timings['read_seconds'] - baseline['read_seconds']) * 1e6
+        logger.info(f"{backend}: read overhead {timings['read_overhead_us']:.1f} us, write overhead {timings['write_overhead_us']:.1f} us per request")
+    return {'baseline': baseline, 'backends': results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark per-request session overhead.')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--backends', nargs='+', default=['filesystem', 'memory', 'sqlite'])
+    parser.add_argument('--report', help='optional JSON output path')
+    args = parser.parse_args()
+    report = run(args.backends, args.requests)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
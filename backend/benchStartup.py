@@ -0,0 +1,129 @@
+"""Cold-start time of the backend, from process start to the first /api/columns response.
+
+Every run starts a fresh server in an empty working directory, waits for /api/health, uploads a synthetic zip
+and requests /api/columns. Modes:
+    flask             Flask development server, no warm-up
+    gunicorn          gunicorn, app imported in every worker, no warm-up
+    gunicorn-preload  gunicorn, app preloaded and warmed up in the master before forking
+
+Example:
+    python benchStartup.py --modes gunicorn gunicorn-preload --runs 5 --participants 20 --report startup_report.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import logging
+import statistics
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+from http.cookiejar import CookieJar
+from syntheticSession import make_synthetic_zip
+from loadTest import multipart_body
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+MODES = ['flask', 'gunicorn', 'gunicorn-preload']
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_command(mode, port, workers):
+    if mode == 'flask':
+        return ([sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port), '--with-threads', '--no-reload'],
+                {'WARM_UP': '0'})
+    command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(BACKEND_DIR, 'gunicorn.conf.py'), '--pythonpath', BACKEND_DIR, 'app:app']
+    env = {'GUNICORN_BIND': f'127.0.0.1:{port}', 'GUNICORN_WORKERS': str(workers)}
+    if mode == 'gunicorn':
+        env.update({'PRELOAD_APP': '0', 'WARM_UP': '0'})
+    else:
+        env.update({'PRELOAD_APP': '1', 'WARM_UP': '1'})
+    return command, env
+
+
+def run_once(mode, payload, workers, timeout):
+    """Starts a server and returns the seconds until it is healthy, until the upload is stored and until the
+    first /api/columns response, all measured from process start."""
+    workdir = tempfile.mkdtemp(prefix='bench_startup_')
+    port = free_port()
+    command, env = server_command(mode, port, workers)
+    env = {**os.environ, **env, 'PYTHONPATH': BACKEND_DIR, 'SESSION_INDEX_PATH': os.path.join(workdir, 'session_index.sqlite3'),
+           # Workers only share sessions through SQLite
+           'SESSION_BACKEND': 'sqlite', 'SESSION_SQLITE_PATH': os.path.join(workdir, 'sessions.sqlite3')}
+    base_url = f'http://127.0.0.1:{port}'
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        health = None
+        while health is None:
+            if time.perf_counter() - start > timeout or process.poll() is not None:
+                raise RuntimeError(f"Server in mode {mode} did not become healthy")
+            try:
+                # Once the port accepts connections the request waits in the backlog until a worker is ready
+                with urllib.request.urlopen(f'{base_url}/api/health', timeout=timeout) as response:
+                    health = json.load(response)
+            except (urllib.error.URLError, OSError):
+                time.sleep(0.02)
+        healthy = time.perf_counter() - start
+
+        body, content_type = multipart_body('file', 'cohort.zip', payload)
+        opener.open(urllib.request.Request(f'{base_url}/api/upload', data=body, headers={'Content-Type': content_type}), timeout=timeout).read()
+        uploaded = time.perf_counter() - start
+        opener.open(f'{base_url}/api/columns?option=all_trials', timeout=timeout).read()
+        first_columns = time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'healthy_seconds': healthy, 'upload_seconds': uploaded - healthy, 'first_columns_seconds': first_columns,
+            'columns_latency_seconds': first_columns - uploaded, 'preloaded': health.get('preloaded'),
+            'warm_up_seconds': health.get('warm_up_seconds')}
+
+
+def summarize(runs):
+    keys = ['healthy_seconds', 'upload_seconds', 'columns_latency_seconds', 'first_columns_seconds']
+    return {key: {'median': statistics.median(r[key] for r in runs), 'min': min(r[key] for r in runs), 'max': max(r[key] for r in runs)}
+            for key in keys}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure cold-start time to the first /api/columns response.')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=['gunicorn', 'gunicorn-preload'])
+    parser.add_argument('--runs', type=int, default=3, help='fresh server starts per mode')
+    parser.add_argument('--participants', type=int, default=20, help='sessions in the synthetic zip')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', default='startup_report.json')
+    args = parser.parse_args(argv)
+
+    payload = make_synthetic_zip(args.participants, seed=args.seed)
+    report = {'participants': args.participants, 'workers': args.workers, 'modes': {}}
+    for mode in args.modes:
+        runs = [run_once(mode, payload, args.workers, args.timeout) for _ in range(args.runs)]
+        report['modes'][mode] = {'runs': runs, 'summary': summarize(runs)}
+        summary = report['modes'][mode]['summary']
+        logger.info(f"{mode}: healthy after {summary['healthy_seconds']['median']:.3f}s, first /api/columns after "
+                    f"{summary['first_columns_seconds']['median']:.3f}s (columns request {summary['columns_latency_seconds']['median']:.3f}s, median of {args.runs})")
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Report written to: {args.report}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Euclidean and affine bidimensional regression of the estimated landmark map on the true one.
+
+The fits follow the instrument's definition: the start position, the Rocket, is part of every map at the origin
+of both the estimated and the true coordinates, so with it the R² columns reproduce the instrument's
+Mapping.BidimensionalRegression R2 values. Scale, rotation and translation are those of estimated = A + M @ true
+in the units of Landmarks.Coordinates. The instrument reports its Alphas and Betas in other units, so they are
+not comparable.
+"""
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+EUCLIDEAN_COLUMNS = [
+    "MapEuclidean_RSq", "MapEuclidean_Scale", "MapEuclidean_Rotation",
+    "MapEuclidean_TranslationX", "MapEuclidean_TranslationY"
+]
+AFFINE_COLUMNS = [
+    "MapAffine_RSq", "MapAffine_ScaleX", "MapAffine_ScaleY", "MapAffine_Rotation",
+    "MapAffine_TranslationX", "MapAffine_TranslationY"
+]
+
+
+def stack_landmark_coordinates(df, landmarks):
+    """Stacks estimated ({landmark}_X/_Y) and true ({landmark}_TrueX/_TrueY) coordinates of every participant.
+
+    Returns (estimated, true, mask) where the coordinate arrays have shape (participants, landmarks, 2)
+    and mask is True where both the estimated and the true position of a landmark are numeric."""
+    estimated_cols = [f"{landmark}_{axis}" for landmark in landmarks for axis in ("X", "Y")]
+    true_cols = [f"{landmark}_True{axis}" for landmark in landmarks for axis in ("X", "Y")]
+    shape = (len(df), len(landmarks), 2)
+
+    def to_array(cols):
+        block = df.reindex(columns=cols).apply(lambda x: pd.to_numeric(x, errors='coerce'))
+        return block.to_numpy(dtype=float).reshape(shape)
+
+    estimated = to_array(estimated_cols)
+    true = to_array(true_cols)
+    mask = np.isfinite(estimated).all(axis=2) & np.isfinite(true).all(axis=2)
+    logger.debug(f"Stacked landmark coordinates for {shape[0]} participants, valid landmarks per participant: {mask.sum(axis=1).tolist()}")
+    return np.where(mask[..., None], estimated, 0.0), np.where(mask[..., None], true, 0.0), mask
+
+
+def add_start_position(estimated, true, mask):
+    """Appends the start position at the origin of both maps as an always present landmark."""
+    origin = np.zeros((len(mask), 1, 2))
+    return (np.concatenate([estimated, origin], axis=1), np.concatenate([true, origin], axis=1),
+            np.concatenate([mask, np.ones((len(mask), 1), dtype=bool)], axis=1))
+
+
+def fit_euclidean(estimated, true, mask):
+    """Fits the Euclidean bidimensional regression estimated = a + b * true (complex form) for all participants at once."""
+    m = mask.astype(float)
+    n = m.sum(axis=1)
+    w = (estimated[..., 0] + 1j * estimated[..., 1]) * m
+    z = (true[..., 0] + 1j * true[..., 1]) * m
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w_mean = w.sum(axis=1) / n
+        z_mean = z.sum(axis=1) / n
+        wc = (w - w_mean[:, None]) * m
+        zc = (z - z_mean[:, None]) * m
+        szz = (np.abs(zc) ** 2).sum(axis=1)
+        sww = (np.abs(wc) ** 2).sum(axis=1)
+        b = (np.conj(zc) * wc).sum(axis=1) / szz
+        a = w_mean - b * z_mean
+        ssr = (np.abs(wc - b[:, None] * zc) ** 2 * m).sum(axis=1)
+        r2 = 1 - ssr / sww
+
+    valid = (n >= 2) & (szz > 0) & (sww > 0)
+    results = {
+        "MapEuclidean_RSq": r2,
+        "MapEuclidean_Scale": np.abs(b),
+        "MapEuclidean_Rotation": np.degrees(np.angle(b)),
+        "MapEuclidean_TranslationX": a.real,
+        "MapEuclidean_TranslationY": a.imag,
+    }
+    return {k: np.where(valid, v, np.nan) for k, v in results.items()}
+
+
+def fit_affine(estimated, true, mask):
+    """Fits the affine bidimensional regression estimated = A + M @ true for all participants in one batched least-squares solve.
+
+    The rotation is that of the rotation matrix closest to M, its polar factor when M keeps orientation, and
+    the scales are the lengths M maps the X and Y unit vectors to."""
+    m = mask.astype(float)
+    n = m.sum(axis=1)
+    design = np.concatenate([m[..., None], true], axis=2) * m[..., None]  # (participants, landmarks, 3)
+    xtx = np.einsum('plk,plj->pkj', design, design)
+    xty = np.einsum('plk,plj->pkj', design, estimated)
+
+    # Participants with fewer than three usable (non-collinear) landmarks have no unique affine fit
+    solvable = (n >= 3) & (np.abs(np.linalg.det(xtx)) > 1e-12)
+    coef = np.full((len(n), 3, 2), np.nan)
+    if solvable.any():
+        coef[solvable] = np.linalg.solve(xtx[solvable], xty[solvable])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        residual = (estimated - np.einsum('plk,pkj->plj', design, coef)) * m[..., None]
+        centered = (estimated - (estimated.sum(axis=1) / n[:, None])[:, None, :]) * m[..., None]
+        sst = (centered ** 2).sum(axis=(1, 2))
+        r2 = 1 - (residual ** 2).sum(axis=(1, 2)) / sst
+
+    valid = solvable & (sst > 0)
+    results = {
+        "MapAffine_RSq": r2,
+        "MapAffine_ScaleX": np.hypot(coef[:, 1, 0], coef[:, 1, 1]),
+        "MapAffine_ScaleY": np.hypot(coef[:, 2, 0], coef[:, 2, 1]),
+        # coef[:, 1] and coef[:, 2] are the columns of M: m00, m10 = coef[:, 1] and m01, m11 = coef[:, 2]
+        "MapAffine_Rotation": np.degrees(np.arctan2(coef[:, 1, 1] - coef[:, 2, 0], coef[:, 1, 0] + coef[:, 2, 1])),
+        "MapAffine_TranslationX": coef[:, 0, 0],
+        "MapAffine_TranslationY": coef[:, 0, 1],
+    }
+    return {k: np.where(valid, v, np.nan) for k, v in results.items()}
+
+
+def add_bidimensional_regression(df, landmarks):
+    """Recomputes Euclidean and affine bidimensional regression for the whole cohort and adds the results as columns."""
+    logger.info(f"Fitting bidimensional regression for {len(df)} participants")
+    estimated, true, mask = add_start_position(*stack_landmark_coordinates(df, landmarks))
+    for fit in (fit_euclidean, fit_affine):
+        for col, values in fit(estimated, true, mask).items():
+            df[col] = values
+    return df
@@ -0,0 +1,280 @@
+import os
+import re
+import json
+import zlib
+import struct
+import hashlib
+import logging
+import zipfile
+import threading
+import uuid
+import fcntl
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from getTrialNumbers import findTrialCountsInData
+from datasetCache import get_trials_path
+from admissionControl import zip_limits, ZipReader
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+PARTIAL_FOLDER = '.chunked'
+
+LOCAL_FILE_HEADER = struct.Struct('<IHHHHHIIIHH')
+LOCAL_FILE_SIGNATURE = 0x04034b50
+
+# Per-process cache of ChunkedUpload objects, the state files in the workspace are what every worker reads
+_uploads = {}
+_uploads_lock = threading.Lock()
+_scan_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='trial-scan')
+
+
+def scan_member(name, payload):
+    """Trial-shape scan of one JSON member. Returns (0, 0, 0, 0) for members that cannot be parsed."""
+    try:
+        return findTrialCountsInData(json.loads(payload))
+    except Exception as e:
+        logger.error(f"Error scanning member {name}: {e}")
+        return 0, 0, 0, 0
+
+
+def is_session_member(name):
+    return name.endswith('.json') and "__MACOSX" not in name and not os.path.basename(name).startswith("._")
+
+
+class ZipMemberScanner:
+    """Follows the local file headers of a zip while it is being written and scans every member once its bytes are complete."""
+
+    def __init__(self, path):
+        self.path = path
+        self.next_header = 0
+        self.futures = []
+        self.streaming = True  # False once a member's size is not known up front (data descriptors, zip64)
+        self.finished = False
+        self.members = 0
+        self.declared_bytes = 0
+
+    def advance(self, available):
+        if not self.streaming or self.finished:
+            return
+        with open(self.path, 'rb') as f:
+            while available - self.next_header >= LOCAL_FILE_HEADER.size:
+                f.seek(self.next_header)
+                (signature, _, flags, method, _, _, _, compressed_size, uncompressed_size, name_length, extra_length) = LOCAL_FILE_HEADER.unpack(f.read(LOCAL_FILE_HEADER.size))
+                if signature != LOCAL_FILE_SIGNATURE:
+                    # Central directory reached, every member has been seen
+                    self.finished = True
+                    return
+                if flags & 0x08 or compressed_size == 0xFFFFFFFF or method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                    logger.info("Zip members cannot be scanned while streaming, scanning at finalize instead")
+                    self.streaming = False
+                    return
+                data_start = self.next_header + LOCAL_FILE_HEADER.size + name_length + extra_length
+                data_end = data_start + compressed_size
+                if available < data_end:
+                    return
+                if (self.members + 1 > zip_limits['max_members'] or self.declared_bytes + uncompressed_size > zip_limits['max_bytes']
+                        or uncompressed_size > zip_limits['max_member_bytes']):
+                    # Over the zip budget, finalize rejects the upload before anything is scanned
+                    logger.info("Zip exceeds the member or size budget, scanning stopped")
+                    self.streaming = False
+                    return
+                self.members += 1
+                self.declared_bytes += uncompressed_size
+                name = f.read(name_length).decode('utf-8', errors='replace')
+                if is_session_member(name):
+                    f.seek(data_start)
+                    data = f.read(compressed_size)
+                    # Never inflates beyond the declared size
+                    payload = zlib.decompressobj(-15).decompress(data, max(uncompressed_size, 1)) if method == zipfile.ZIP_DEFLATED else data
+                    self.futures.append(_scan_executor.submit(scan_member, name, payload))
+                    logger.debug(f"Scheduled trial scan for zip member {name}")
+                self.next_header = data_end
+
+    def results(self):
+        """Trial counts of all members, scanning the complete archive if streaming was not possible."""
+        if not self.streaming:
+            with zipfile.ZipFile(self.path, 'r') as zip_ref:
+                reader = ZipReader(zip_ref)
+                return [scan_member(name, reader.read(name)) for name in zip_ref.namelist() if is_session_member(name)]
+        return [future.result() for future in self.futures]
+
+
+class ChunkedUpload:
+    """One upload received as sequential chunks into the upload workspace, hashed as it arrives.
+
+    The partial file and the state file next to it are the upload: every worker process keeps its own
+    ChunkedUpload, which reads the state again under the file lock before each request, so the next chunk and
+    the checksum are right whichever worker received the previous chunks."""
+
+    def __init__(self, upload_id, filename, chunk_size, workspace):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.part_path = os.path.join(workspace, f'{upload_id}.part')
+        self.state_path = self.part_path + '.json'
+        self.next_chunk = 0
+        self.bytes_received = 0
+        self.complete = False  # set by a short final chunk
+        self.digest = hashlib.sha256()
+        self.hashed_bytes = 0
+        self.scanner = ZipMemberScanner(self.part_path) if filename.endswith('.zip') else None
+        self.lock = threading.Lock()
+
+    def status(self):
+        return {'upload_id': self.upload_id, 'filename': self.filename, 'chunk_size': self.chunk_size,
+                'next_chunk': self.next_chunk, 'bytes_received': self.bytes_received}
+
+    def save_state(self):
+        state = {'filename': self.filename, 'chunk_size': self.chunk_size, 'next_chunk': self.next_chunk,
+                 'bytes_received': self.bytes_received, 'complete': self.complete, 'sha256': self.digest.hexdigest()}
+        tmp_path = f'{self.state_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    @contextmanager
+    def locked(self):
+        """Holds the upload against other threads and worker processes and yields True once its state is read
+        from disk, or False if the upload was finalized in the meantime."""
+        with self.lock, open(self.part_path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield self.sync()
+
+    def sync(self):
+        """Reads the state file and hashes the bytes other workers appended since this one last saw the upload.
+        Returns False if the state file is gone."""
+        state = read_state(self.state_path)
+        if state is None:
+            return False
+        self.next_chunk = state.get('next_chunk', 0)
+        self.bytes_received = state.get('bytes_received', 0)
+        self.complete = state.get('complete', False)
+        if self.hashed_bytes > self.bytes_received:
+            self.digest, self.hashed_bytes = hashlib.sha256(), 0
+        self.hash_received()
+        if state.get('sha256', self.digest.hexdigest()) != self.digest.hexdigest():
+            # Only happens if the partial file was changed behind the state, hash it again from the start
+            self.digest, self.hashed_bytes = hashlib.sha256(), 0
+            self.hash_received()
+            if state['sha256'] != self.digest.hexdigest():
+                logger.error(f"Chunked upload {self.upload_id} does not match its state, restarting it")
+                self.next_chunk, self.bytes_received, self.complete = 0, 0, False
+                self.digest = hashlib.sha256()
+                if self.scanner is not None:
+                    self.scanner = ZipMemberScanner(self.part_path)
+                self.save_state()
+        return True
+
+    def hash_received(self):
+        if self.hashed_bytes == self.bytes_received:
+            return
+        with open(self.part_path, 'rb') as f:
+            f.seek(self.hashed_bytes)
+            remaining = self.bytes_received - self.hashed_bytes
+            while remaining:
+                chunk = f.read(min(remaining, self.chunk_size))
+                if not chunk:
+                    break
+                self.digest.update(chunk)
+                remaining -= len(chunk)
+        self.hashed_bytes = self.bytes_received - remaining
+
+    def write_chunk(self, index, data):
+        """Appends chunk number index. Returns an error message, or None when the chunk was accepted. Called
+        with the upload locked."""
+        if index < self.next_chunk:
+            return None  # already acknowledged, a retried request
+        if index > self.next_chunk:
+            return f'Expected chunk {self.next_chunk}'
+        if self.complete:
+            return 'Upload already received its last chunk'
+        if len(data) > self.chunk_size or not data:
+            return f'Chunks must contain between 1 and {self.chunk_size} bytes'
+
+        with open(self.part_path, 'r+b' if index else 'wb') as f:
+            f.seek(self.bytes_received)
+            f.write(data)
+            f.truncate()
+        self.digest.update(data)
+        self.next_chunk += 1
+        self.bytes_received += len(data)
+        self.hashed_bytes = self.bytes_received
+        self.complete = len(data) < self.chunk_size
+        # The chunk is acknowledged once the state file says so, bytes written after the last saved state are overwritten
+        self.save_state()
+        if self.scanner is not None:
+            self.scanner.advance(self.bytes_received)
+        return None
+
+    @classmethod
+    def restore(cls, upload_id, workspace):
+        """Rebuilds an upload from its state file, e.g. in another worker or after a restart."""
+        part_path = os.path.join(workspace, f'{upload_id}.part')
+        state = read_state(part_path + '.json')
+        if state is None:
+            return None
+        upload = cls(upload_id, state['filename'], state['chunk_size'], workspace)
+        logger.info(f"Restored chunked upload {upload_id} at chunk {state.get('next_chunk', 0)}")
+        return upload
+
+    def finalize(self, file_path):
+        """Moves the received file to file_path and stores the trial counts found while receiving it. Called
+        with the upload locked."""
+        with open(self.part_path, 'r+b') as f:
+            f.truncate(self.bytes_received)
+        if self.scanner is not None:
+            self.scanner.advance(self.bytes_received)
+            counts = self.scanner.results()
+        else:
+            with open(self.part_path, 'rb') as f:
+                counts = [scan_member(self.filename, f.read())]
+        os.replace(self.part_path, file_path)
+        os.remove(self.state_path)
+        os.remove(self.part_path + '.lock')
+        trial_counts = [max((c[i] for c in counts), default=0) for i in range(4)]
+        with open(get_trials_path(file_path), 'w') as f:
+            json.dump(trial_counts, f)
+        logger.info(f"Finalized chunked upload {self.upload_id} to {file_path}, trial counts: {trial_counts}")
+        return self.digest.hexdigest(), trial_counts
+
+
+def read_state(state_path):
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def get_workspace(upload_folder):
+    workspace = os.path.join(upload_folder, PARTIAL_FOLDER)
+    os.makedirs(workspace, exist_ok=True)
+    return workspace
+
+
+def create_upload(filename, chunk_size, upload_folder):
+    chunk_size = min(max(int(chunk_size or DEFAULT_CHUNK_SIZE), 1), MAX_CHUNK_SIZE)
+    upload = ChunkedUpload(uuid.uuid4().hex, filename, chunk_size, get_workspace(upload_folder))
+    upload.save_state()
+    with _uploads_lock:
+        _uploads[upload.upload_id] = upload
+    return upload
+
+
+def get_upload(upload_id, upload_folder):
+    if not re.fullmatch(r'[0-9a-f]{32}', upload_id or ''):
+        return None
+    with _uploads_lock:
+        upload = _uploads.get(upload_id)
+        if upload is None:
+            upload = ChunkedUpload.restore(upload_id, get_workspace(upload_folder))
+            if upload is not None:
+                _uploads[upload_id] = upload
+        return upload
+
+
+def discard_upload(upload_id):
+    with _uploads_lock:
+        _uploads.pop(upload_id, None)
@@ -0,0 +1,148 @@
+import re
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Per-trial angle columns summarised with circular statistics, by the prefix of their trial columns
+PI_ANGLE_METRICS = ["PI_FinalAngle", "PI_Corrected_PI_Angle"]
+PATTERN_POINTING_SIGNED_COLUMN = r'PointingJudgement_SignedError_(\d+)_Trial_\d+'
+CIRCULAR_SUFFIXES = ["Mean", "R", "SD"]
+
+
+def wrap_angle(degrees):
+    """Wraps angles in degrees into [-180, 180)."""
+    return (np.asarray(degrees, dtype=float) + 180.0) % 360.0 - 180.0
+
+
+def signed_error(estimated, correct):
+    """Signed angular error estimated - correct in degrees, the shortest way around the circle."""
+    return wrap_angle(np.asarray(estimated, dtype=float) - np.asarray(correct, dtype=float))
+
+
+def stack_angles(df, columns):
+    """Angle columns of every participant as a (participants, trials) array, NaN where a trial is missing."""
+    block = df.reindex(columns=columns).apply(lambda x: pd.to_numeric(x, errors='coerce'))
+    return block.to_numpy(dtype=float).reshape(len(df), len(columns))
+
+
+def circular_summary(angles):
+    """Circular mean, mean resultant length R and circular standard deviation sqrt(-2 ln R) of each row.
+
+    angles is a (participants, trials) array in degrees; NaN trials are left out. The mean is in [-180, 180)
+    and the SD in degrees. Rows without any angle are NaN, as is the mean of a row whose resultant is zero."""
+    mask = np.isfinite(angles)
+    n = mask.sum(axis=1)
+    radians = np.radians(np.where(mask, angles, 0.0))
+    c = np.where(mask, np.cos(radians), 0.0).sum(axis=1)
+    s = np.where(mask, np.sin(radians), 0.0).sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = np.hypot(c, s) / n
+        # Rounding can push R of identical angles slightly above one
+        sd = np.degrees(np.sqrt(np.maximum(-2.0 * np.log(r), 0.0)))
+    mean = wrap_angle(np.degrees(np.arctan2(s, c)))
+
+    has_data = n > 0
+    return {
+        "Mean": np.where(has_data & (r > 1e-12), mean, np.nan),
+        "R": np.where(has_data, r, np.nan),
+        "SD": np.where(has_data, sd, np.nan),
+    }
+
+
+def get_circular_columns(total_pi_trials, total_pointing_tasks, total_pt_trials):
+    """Names of the columns added by add_circular_statistics, grouped like the column groups show them."""
+    groups = {}
+    if total_pi_trials > 0:
+        for metric in PI_ANGLE_METRICS:
+            groups[metric] = [f"Circ_{metric}_{suffix}" for suffix in CIRCULAR_SUFFIXES]
+    if total_pointing_tasks > 0:
+        for i in range(total_pointing_tasks):
+            groups[f"PointingJudgement_SignedError_{i}"] = [f"Circ_PointingJudgement_SignedError_{i}_{suffix}" for suffix in CIRCULAR_SUFFIXES]
+        groups["PointingJudgement_SignedError_all"] = [f"Circ_PointingJudgement_SignedError_all_{suffix}" for suffix in CIRCULAR_SUFFIXES]
+    if total_pt_trials > 0:
+        groups["PerspectiveSignedError_trials"] = [f"PerspectiveSignedError_{i}" for i in range(total_pt_trials)]
+        groups["PerspectiveSignedError"] = [f"Circ_PerspectiveSignedError_{suffix}" for suffix in CIRCULAR_SUFFIXES]
+    return groups
+
+
+def get_circular_blocks(columns):
+    """The angle trial columns summarised into each Circ_* prefix. The perspective-taking block is only there
+    once the PerspectiveSignedError_{i} columns are."""
+    blocks = {}
+    for metric in PI_ANGLE_METRICS:
+        trials = [col for col in columns if col.startswith(f"{metric}_") and col.split('_')[-1].isdigit()]
+        if trials:
+            blocks[f"Circ_{metric}"] = trials
+
+    pointing = {}
+    for col in columns:
+        match = re.fullmatch(PATTERN_POINTING_SIGNED_COLUMN, col)
+        if match:
+            pointing.setdefault(int(match.group(1)), []).append(col)
+    for block, trials in sorted(pointing.items()):
+        blocks[f"Circ_PointingJudgement_SignedError_{block}"] = trials
+    if pointing:
+        blocks["Circ_PointingJudgement_SignedError_all"] = [col for _, trials in sorted(pointing.items()) for col in trials]
+
+    perspective = sorted((col for col in columns if re.fullmatch(r'PerspectiveSignedError_\d+', col)), key=lambda col: int(col.split('_')[-1]))
+    if perspective:
+        blocks["Circ_PerspectiveSignedError"] = perspective
+    return blocks
+
+
+def get_exclusion_column(col):
+    """The trial column whose outlier flag leaves an angle trial out: a signed pointing error goes with its
+    absolute error and a signed perspective error with its error measure, PI angles are flagged themselves."""
+    match = re.fullmatch(r'PointingJudgement_SignedError_(\d+_Trial_\d+)', col)
+    if match:
+        return f"PointingJudgement_AbsoluteError_{match.group(1)}"
+    if re.fullmatch(r'PerspectiveSignedError_\d+', col):
+        return col.replace("PerspectiveSignedError_", "PerspectiveErrorMeasure_")
+    return col
+
+
+def circular_statistics_without(df, excluded):
+    """The Circ_* columns of df computed again without the excluded trials, for the blocks that have any.
+
+    excluded maps trial columns to boolean masks over the participants, as OutlierFlags.excluded returns them.
+    Returns column -> values."""
+    result = {}
+    for prefix, columns in get_circular_blocks(df.columns).items():
+        masks = [excluded.get(get_exclusion_column(col)) for col in columns]
+        if not any(mask is not None and mask.any() for mask in masks):
+            continue
+        angles = stack_angles(df, columns).copy()
+        for position, mask in enumerate(masks):
+            if mask is not None:
+                angles[mask, position] = np.nan
+        for suffix, values in circular_summary(angles).items():
+            result[f"{prefix}_{suffix}"] = values
+    return result
+
+
+def _add_summary(df, prefix, angles):
+    for suffix, values in circular_summary(angles).items():
+        df[f"{prefix}_{suffix}"] = values
+
+
+def add_circular_statistics(df):
+    """Adds circular mean, resultant length and circular SD of the PI angles, of the signed pointing errors per
+    task block and overall, and of the signed perspective-taking errors, for the whole cohort at once.
+
+    The signed perspective-taking error of every trial is added as PerspectiveSignedError_{i}."""
+    logger.info(f"Calculating circular statistics for {len(df)} participants")
+    for prefix, columns in get_circular_blocks(df.columns).items():
+        _add_summary(df, prefix, stack_angles(df, columns))
+
+    trials = sorted(int(col.split('_')[-1]) for col in df.columns if re.fullmatch(r'PerpectiveFinalAngle_\d+', col))
+    if trials:
+        final = stack_angles(df, [f"PerpectiveFinalAngle_{i}" for i in trials])
+        correct = stack_angles(df, [f"PerpectiveCorrectAngle_{i}" for i in trials])
+        errors = signed_error(final, correct)
+        for position, i in enumerate(trials):
+            df[f"PerspectiveSignedError_{i}"] = errors[:, position]
+        _add_summary(df, "Circ_PerspectiveSignedError", errors)
+    return df
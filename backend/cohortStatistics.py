@@ -0,0 +1,216 @@
+"""Cohort descriptives computed in one streaming pass over participants.
+
+Every column has a mergeable accumulator: count, mean and variance by Chan's parallel update of Welford's
+algorithm, min/max, and a log-bucketed quantile sketch with bounded relative error. Partial results of
+separate workers merge into the same result as a single pass.
+
+Example:
+    python cohortStatistics.py cohort.zip --workers 4 --output cohort_stats.json
+"""
+import os
+import json
+import math
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from finalJSONtoCSV import JSONProcessor, get_column_headers, process_json_files, build_wide_table
+from admissionControl import check_job_budget
+from sessionValidation import get_pool_context, member_reader
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+DEFAULT_BATCH_SIZE = 64
+# Relative error of the quantile sketch
+SKETCH_ACCURACY = 0.01
+NON_NUMERIC_COLUMNS = {'Player_ID', 'SPACEStartTime', 'SPACEEndTime'}
+
+
+class QuantileSketch:
+    """Counts values in logarithmic buckets, so every quantile is returned within SKETCH_ACCURACY relative error.
+
+    Merging adds bucket counts, which makes the sketch independent of how participants are split across workers."""
+
+    def __init__(self, accuracy=SKETCH_ACCURACY):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+
+    def _add_buckets(self, store, values):
+        indices, counts = np.unique(np.ceil(np.log(values) / self.log_gamma).astype(np.int64), return_counts=True)
+        for index, count in zip(indices.tolist(), counts.tolist()):
+            store[index] = store.get(index, 0) + count
+
+    def update(self, values):
+        positive = values[values > 0]
+        negative = values[values < 0]
+        self.zeros += int(values.size - positive.size - negative.size)
+        if positive.size:
+            self._add_buckets(self.positive, positive)
+        if negative.size:
+            self._add_buckets(self.negative, -negative)
+
+    def merge(self, other):
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, count in other_store.items():
+                store[index] = store.get(index, 0) + count
+        self.zeros += other.zeros
+
+    def _value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantiles(self, qs, count):
+        # Buckets in ascending value order: the largest negative magnitudes first
+        buckets = [(-self._value(i), c) for i, c in sorted(self.negative.items(), reverse=True)]
+        if self.zeros:
+            buckets.append((0.0, self.zeros))
+        buckets.extend((self._value(i), c) for i, c in sorted(self.positive.items()))
+        values = np.array([value for value, _ in buckets])
+        cumulative = np.cumsum([c for _, c in buckets])
+        ranks = np.asarray(qs) * (count - 1)
+        return values[np.searchsorted(cumulative, ranks, side='right')].tolist()
+
+
+class ColumnAccumulator:
+    """Running count, mean, sum of squared deviations, min, max and quantile sketch of one column."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = QuantileSketch()
+
+    def _combine(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def update(self, values):
+        """Adds a batch of finite values."""
+        if not values.size:
+            return
+        batch_mean = values.mean()
+        self._combine(values.size, batch_mean, float(((values - batch_mean) ** 2).sum()))
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.sketch.update(values)
+
+    def merge(self, other):
+        if not other.count:
+            return
+        self._combine(other.count, other.mean, other.m2)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.sketch.merge(other.sketch)
+
+    def to_dict(self, quantiles=DEFAULT_QUANTILES):
+        if not self.count:
+            return {'count': 0, 'mean': None, 'variance': None, 'std': None, 'min': None, 'max': None, 'quantiles': {}}
+        variance = self.m2 / (self.count - 1) if self.count > 1 else None
+        # The sketch's bucket midpoints can fall just outside the observed range
+        estimates = [min(max(v, self.min), self.max) for v in self.sketch.quantiles(quantiles, self.count)]
+        return {'count': self.count, 'mean': self.mean, 'variance': variance, 'std': math.sqrt(variance) if variance is not None else None,
+                'min': self.min, 'max': self.max, 'quantiles': {str(q): v for q, v in zip(quantiles, estimates)}}
+
+
+class CohortStatistics:
+    """Accumulators for a set of columns, updated with batches of participant rows."""
+
+    def __init__(self, columns=None):
+        self.columns = list(columns) if columns else None
+        self.participants = 0
+        self.accumulators = {}
+
+    def update(self, df):
+        columns = self.columns or [col for col in df.columns if col not in NON_NUMERIC_COLUMNS]
+        self.participants += len(df)
+        for col in columns:
+            accumulator = self.accumulators.setdefault(col, ColumnAccumulator())
+            if col in df.columns:
+                values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+                accumulator.update(values[np.isfinite(values)])
+
+    def merge(self, other):
+        self.participants += other.participants
+        for col, accumulator in other.accumulators.items():
+            self.accumulators.setdefault(col, ColumnAccumulator()).merge(accumulator)
+        return self
+
+    def to_dict(self, quantiles=DEFAULT_QUANTILES):
+        return {'participants': self.participants,
+                'columns': {col: acc.to_dict(quantiles) for col, acc in self.accumulators.items() if acc.count or self.columns}}
+
+
+def accumulate_files(json_files, trial_counts, columns=None, batch_size=DEFAULT_BATCH_SIZE, upload=None):
+    """Extracts the files batch by batch and returns the partial statistics. Only one batch of rows is held at a time.
+
+    With a zip upload, json_files are its members and are read straight from it."""
+    stats = CohortStatistics(columns)
+    processor = JSONProcessor(*trial_counts)
+    headers = get_column_headers(*trial_counts)
+    with member_reader(upload) as read:
+        for start in range(0, len(json_files), batch_size):
+            df = build_wide_table(process_json_files(json_files[start:start + batch_size], processor, read), headers)
+            if df is not None:
+                stats.update(df)
+    return stats
+
+
+def stream_statistics(json_files, trial_counts, columns=None, workers=1, batch_size=DEFAULT_BATCH_SIZE, upload=None):
+    """Computes cohort statistics over the files, splitting them across worker processes when workers > 1."""
+    if workers <= 1 or len(json_files) < 2 * batch_size:
+        return accumulate_files(json_files, trial_counts, columns, batch_size, upload)
+    shards = [json_files[i::workers] for i in range(workers)]
+    stats = CohortStatistics(columns)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_pool_context()) as executor:
+        for partial in executor.map(accumulate_files, shards, [trial_counts] * workers, [columns] * workers, [batch_size] * workers,
+                                    [upload] * workers):
+            # Worker processes run outside the job, its budget is checked as their results arrive
+            check_job_budget()
+            stats.merge(partial)
+    return stats
+
+
+def main(argv=None):
+    from datasetCache import get_valid_members
+    from metadataFilter import add_filter_arguments, filter_from_args
+
+    parser = argparse.ArgumentParser(description='Compute cohort statistics of an upload in one streaming pass.')
+    parser.add_argument('file_path', help='zip or JSON session upload')
+    parser.add_argument('--columns', nargs='+', help='columns to describe, all numeric columns by default')
+    parser.add_argument('--quantiles', nargs='+', type=float, default=list(DEFAULT_QUANTILES))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--duplicate-policy', choices=['keep_first', 'keep_latest', 'error'], default='keep_first')
+    parser.add_argument('--output', help='JSON output path, printed to stdout when omitted')
+    add_filter_arguments(parser)
+    args = parser.parse_args(argv)
+    metadata_filter = filter_from_args(parser, args)
+
+    # Members are read straight from the upload, nothing is written next to it
+    members, trial_counts = get_valid_members(args.file_path, args.duplicate_policy, metadata_filter)
+    stats = stream_statistics(members, trial_counts, args.columns, args.workers, args.batch_size, args.file_path)
+
+    result = stats.to_dict(args.quantiles)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        logger.info(f"Statistics of {result['participants']} participants written to: {args.output}")
+    else:
+        print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == "__main__":
+    # Extraction logs every file at INFO, only this module's progress is shown
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+    main()
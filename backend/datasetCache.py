@@ -0,0 +1,294 @@
+import os
+import json
+import zipfile
+import logging
+import threading
+from collections import OrderedDict
+import pandas as pd
+from finalJSONtoCSV import JSONtoCSV, JSONProcessor, get_column_headers, process_json_files, build_wide_table, read_summary_table, save_summary_table
+from incrementalAverages import IncrementalAverages, get_trial_columns
+from outlierFlags import OutlierFlags, build_outlier_reference, write_outlier_reference, read_outlier_reference
+from sessionValidation import validate_upload, load_validation, validation_version, validate_members, mark_short_sections
+from sessionIndex import find_duplicates
+from httpCaching import get_upload_hash
+from admissionControl import extract_zip
+from metadataFilter import MetadataFilterError
+
+logger = logging.getLogger(__name__)
+
+DATASET_CACHE_SIZE = 4
+
+_datasets = OrderedDict()
+_datasets_lock = threading.Lock()
+
+
+def get_extract_folder(file_path, upload_folder):
+    """Zip members are extracted into a folder of their own, so no member can overwrite the upload or the
+    validation report, summary and trial counts stored next to it. A JSON upload is read where it is."""
+    if file_path.endswith('.zip'):
+        return os.path.join(upload_folder, os.path.basename(file_path) + '.files')
+    return upload_folder
+
+
+def get_json_files(file_path, upload_folder):
+    """Returns the session files of an upload, extracting them from zip archives. Other members are not extracted."""
+    return extract_members(file_path, get_json_members(file_path), upload_folder)
+
+
+def get_json_members(file_path):
+    """Session files of an upload in archive order, without extracting anything."""
+    if file_path.endswith('.zip'):
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            return [f for f in zip_ref.namelist() if f.endswith('.json') and "__MACOSX" not in f and not os.path.basename(f).startswith("._")]
+    return [file_path]
+
+
+def select_members(file_path, members, metadata_filter):
+    """The session files of an upload whose MetaData matches the filter. Only the head of every file is read,
+    zip members are not extracted."""
+    if not file_path.endswith('.zip'):
+        return metadata_filter.select(members, lambda member: open(member, 'rb'))
+    with zipfile.ZipFile(file_path, 'r') as zip_ref:
+        return metadata_filter.select(members, zip_ref.open)
+
+
+def extract_members(file_path, members, upload_folder):
+    """Extracts only the given members of a zip upload into its extract folder and returns their paths."""
+    if not file_path.endswith('.zip'):
+        return list(members)
+    with zipfile.ZipFile(file_path, 'r') as zip_ref:
+        return extract_zip(zip_ref, get_extract_folder(file_path, upload_folder), members)
+
+
+def get_member_times(file_path):
+    """Modification time of every member of a zip upload, by its path relative to the upload folder."""
+    if not file_path.endswith('.zip'):
+        return {}
+    with zipfile.ZipFile(file_path, 'r') as zip_ref:
+        return {os.path.normpath(info.filename): info.date_time for info in zip_ref.infolist()}
+
+
+def get_summary_path(file_path, metadata_filter=None):
+    """The summary table of an upload is stored next to it, one per MetadataFilter."""
+    return file_path + (f'.{metadata_filter.digest}' if metadata_filter is not None else '') + '.summary.json'
+
+
+def get_outlier_reference_path(file_path, metadata_filter=None):
+    """The outlier reference of an upload is stored next to its summary table, one per MetadataFilter."""
+    return file_path + (f'.{metadata_filter.digest}' if metadata_filter is not None else '') + '.outliers.json'
+
+
+def is_stored_table_current(path, file_path, validation, duplicate_policy):
+    """A table stored next to an upload is current when it is not older than the upload and its validation report
+    is stored under the same duplicate policy."""
+    return (validation is not None and validation.get('duplicate_policy') == duplicate_policy
+            and os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(file_path))
+
+
+def save_outlier_reference(columns, values, path):
+    try:
+        write_outlier_reference(build_outlier_reference(columns, values), path)
+        logger.info(f"Outlier reference saved to: {path}")
+    except Exception as e:
+        logger.error(f"Error saving outlier reference: {e}")
+
+
+def save_stored_tables(json_files, file_path, trial_counts, metadata_filter=None):
+    """Extracts the files once and stores the summary table and the outlier reference of the cohort. Returns the
+    summary table."""
+    headers = get_column_headers(*trial_counts)
+    data = process_json_files(json_files, JSONProcessor(*trial_counts))
+    columns = get_trial_columns(headers)
+    positions = [headers.index(col) for col in columns]
+    values = {col: pd.to_numeric(pd.Series([row[i] if i < len(row) else None for row in data], dtype=object), errors='coerce').to_numpy(dtype=float)
+              for col, i in zip(columns, positions)}
+    save_outlier_reference(columns, values, get_outlier_reference_path(file_path, metadata_filter))
+    return save_summary_table(data, headers, get_summary_path(file_path, metadata_filter))
+
+
+def get_trials_path(file_path):
+    """Trial counts found while a chunked upload was received are stored next to it."""
+    return file_path + '.trials.json'
+
+
+def get_trial_counts(file_path, validation):
+    """Trial counts of an upload, read from the scan done during a chunked upload when it is still current,
+    otherwise taken from the trial array lengths found by validation. The scan covers every session file, so
+    a filtered cohort always takes them from validation."""
+    trials_path = get_trials_path(file_path)
+    if (not validation.get('metadata_filter') and os.path.exists(trials_path)
+            and os.path.getmtime(trials_path) >= os.path.getmtime(file_path)):
+        with open(trials_path) as f:
+            logger.info(f"Using trial counts scanned during upload: {trials_path}")
+            return tuple(json.load(f))
+    return tuple(validation['trial_counts'].values())
+
+
+def get_usable_members(validation):
+    """Files of a validation report that are neither quarantined nor duplicates, relative to the extract folder."""
+    return [r['file'] for r in validation['files'] if r['usable'] and 'duplicate_of' not in r]
+
+
+def extract_usable_members(file_path, members, upload_folder):
+    """Extracts members named as in a validation report and returns their paths."""
+    if not file_path.endswith('.zip'):
+        return [os.path.join(upload_folder, member) for member in members]
+    return extract_members(file_path, members, upload_folder)
+
+
+def get_valid_members(file_path, duplicate_policy='keep_first', metadata_filter=None):
+    """Validates the session files of an upload read straight from the zip or the JSON file, without extracting,
+    copying or storing anything next to it. Returns the usable, deduplicated members and their trial counts.
+
+    Raises MetadataFilterError if a MetadataFilter matches none of the files."""
+    members = get_json_members(file_path)
+    if metadata_filter is not None:
+        selected = select_members(file_path, members, metadata_filter)
+        if not selected:
+            raise MetadataFilterError(f"None of the {len(members)} session files match the filter {metadata_filter.key}")
+        members = selected
+    reports = validate_members(file_path, members)
+    member_times = get_member_times(file_path)
+    find_duplicates(reports, duplicate_policy, {r['file']: member_times.get(os.path.normpath(r['file']), ()) for r in reports})
+    usable = [r for r in reports if r['usable'] and 'duplicate_of' not in r]
+    return [r['file'] for r in usable], tuple(mark_short_sections(usable).values())
+
+
+def get_valid_json_files(file_path, upload_folder, duplicate_policy='keep_first', session_index=None, metadata_filter=None):
+    """Extracts an upload and validates its files. Unusable files are quarantined and duplicate sessions are skipped,
+    neither is returned.
+
+    An upload is validated once per duplicate policy and filter: when its stored report is current only the
+    usable files it lists are extracted, without reading them twice. With a MetadataFilter only the matching
+    session files are extracted and validated. Raises MetadataFilterError if none of them match."""
+    validation = load_validation(file_path, metadata_filter)
+    if validation is not None and validation.get('duplicate_policy') == duplicate_policy:
+        logger.info(f"Using stored validation report of {file_path}")
+        return validation, extract_usable_members(file_path, get_usable_members(validation), upload_folder)
+    if metadata_filter is None:
+        json_files, filtered_files = get_json_files(file_path, upload_folder), 0
+    else:
+        members = get_json_members(file_path)
+        selected = select_members(file_path, members, metadata_filter)
+        if not selected:
+            raise MetadataFilterError(f"None of the {len(members)} session files match the filter {metadata_filter.key}")
+        json_files, filtered_files = extract_members(file_path, selected, upload_folder), len(members) - len(selected)
+    return validate_upload(file_path, json_files, get_extract_folder(file_path, upload_folder), duplicate_policy,
+                           member_times=get_member_times(file_path), session_index=session_index,
+                           upload_hash=get_upload_hash(file_path), metadata_filter=metadata_filter, filtered_files=filtered_files)
+
+
+class Dataset:
+    """The extracted wide table of one upload, or of the participants a MetadataFilter selects from it, together
+    with the state needed to serve repeated requests on it."""
+
+    def __init__(self, file_path, upload_folder, duplicate_policy='keep_first', session_index=None, metadata_filter=None):
+        self.file_path = file_path
+        self.metadata_filter = metadata_filter
+        self.validation, self.json_files = get_valid_json_files(file_path, upload_folder, duplicate_policy, session_index, metadata_filter)
+        self.num_pi, self.num_pj, self.num_pot, self.num_pet = get_trial_counts(file_path, self.validation)
+        logger.info(f"Number of PI: {self.num_pi}, Number of PJ: {self.num_pj}, Number of POT: {self.num_pot}, Number of PET: {self.num_pet}")
+        self.df = JSONtoCSV(self.json_files, None, self.num_pi, self.num_pj, self.num_pot, self.num_pet,
+                            summary_path=get_summary_path(file_path, metadata_filter))
+        self.averages = IncrementalAverages(self.df, self.num_pot) if self.df is not None else None
+        if self.averages is not None:
+            save_outlier_reference(list(self.averages.raw_values), self.averages.raw_values, get_outlier_reference_path(file_path, metadata_filter))
+        self.outlier_flags = {}
+        # Held while a request reads or updates df
+        self.lock = threading.Lock()
+
+    @property
+    def trial_counts(self):
+        return self.num_pi, self.num_pj, self.num_pot, self.num_pet
+
+    def get_outlier_flags(self, method, threshold):
+        """OutlierFlags of the trial columns, computed once per method and threshold. Called with lock held."""
+        key = (method, threshold)
+        if key not in self.outlier_flags:
+            self.outlier_flags[key] = OutlierFlags(self.df, method, threshold, values=self.averages.raw_values)
+        return self.outlier_flags[key]
+
+
+def _cache_key(file_path, duplicate_policy, metadata_filter=None):
+    # The validation report changes when another upload supersedes sessions of this one
+    stat = os.stat(file_path)
+    return (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size, duplicate_policy, metadata_filter.key if metadata_filter is not None else None,
+            validation_version(file_path, metadata_filter))
+
+
+def load_dataset(file_path, upload_folder, duplicate_policy='keep_first', session_index=None, metadata_filter=None):
+    """Returns the cached Dataset for an upload and filter, extracting it on first use or when the file or its
+    validation report has changed."""
+    key = _cache_key(file_path, duplicate_policy, metadata_filter)
+    with _datasets_lock:
+        dataset = _datasets.get(key)
+        if dataset is not None:
+            _datasets.move_to_end(key)
+            logger.info(f"Using cached dataset for {file_path}")
+            return dataset
+
+    dataset = Dataset(file_path, upload_folder, duplicate_policy, session_index, metadata_filter)
+    with _datasets_lock:
+        # Under the version of the report the build used or wrote
+        _datasets[_cache_key(file_path, duplicate_policy, metadata_filter)] = dataset
+        while len(_datasets) > DATASET_CACHE_SIZE:
+            _datasets.popitem(last=False)
+    return dataset
+
+
+def get_cached_dataset(file_path, duplicate_policy='keep_first', metadata_filter=None):
+    """Returns the Dataset of an upload, or of the participants a MetadataFilter selects, if it is already
+    cached, without building it."""
+    with _datasets_lock:
+        return _datasets.get(_cache_key(file_path, duplicate_policy, metadata_filter))
+
+
+def load_page(file_path, upload_folder, offset, limit, duplicate_policy='keep_first', session_index=None, metadata_filter=None):
+    """Extracts and processes only the session files of one page of an upload, or of the participants a
+    MetadataFilter selects from it.
+
+    Pages follow the usable, deduplicated files of the stored validation report, validating the upload first
+    if it has none. Returns the page DataFrame, its trial counts and the number of files in the cohort."""
+    validation = load_validation(file_path, metadata_filter)
+    if validation is None or validation.get('duplicate_policy') != duplicate_policy:
+        validation, _ = get_valid_json_files(file_path, upload_folder, duplicate_policy, session_index, metadata_filter)
+    members = get_usable_members(validation)
+    page_files = extract_usable_members(file_path, members[offset:offset + limit], upload_folder)
+    trial_counts = get_trial_counts(file_path, validation)
+    logger.info(f"Building preview page of {len(page_files)} files at offset {offset} out of {len(members)}")
+
+    processor = JSONProcessor(*trial_counts)
+    headers = get_column_headers(*trial_counts)
+    df = build_wide_table(process_json_files(page_files, processor), headers)
+    return df, trial_counts, len(members)
+
+
+def load_summary(file_path, upload_folder, duplicate_policy='keep_first', session_index=None, metadata_filter=None):
+    """Returns the summary table of an upload or of the participants a MetadataFilter selects, materializing it
+    if it is missing, older than the upload or built under another duplicate policy."""
+    summary_path = get_summary_path(file_path, metadata_filter)
+    if is_stored_table_current(summary_path, file_path, load_validation(file_path, metadata_filter), duplicate_policy):
+        try:
+            summary = read_summary_table(summary_path)
+            logger.info(f"Using materialized summary table: {summary_path}")
+            return summary
+        except (OSError, ValueError) as e:
+            logger.warning(f"Rebuilding unreadable summary table {summary_path}: {e}")
+
+    validation, json_files = get_valid_json_files(file_path, upload_folder, duplicate_policy, session_index, metadata_filter)
+    return save_stored_tables(json_files, file_path, get_trial_counts(file_path, validation), metadata_filter)
+
+
+def load_outlier_reference(file_path, upload_folder, duplicate_policy='keep_first', session_index=None, metadata_filter=None):
+    """Returns the outlier reference of an upload or of the participants a MetadataFilter selects, materializing
+    it with the summary table if it is missing or stale."""
+    reference_path = get_outlier_reference_path(file_path, metadata_filter)
+    if is_stored_table_current(reference_path, file_path, load_validation(file_path, metadata_filter), duplicate_policy):
+        try:
+            return read_outlier_reference(reference_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Rebuilding unreadable outlier reference {reference_path}: {e}")
+
+    validation, json_files = get_valid_json_files(file_path, upload_folder, duplicate_policy, session_index, metadata_filter)
+    save_stored_tables(json_files, file_path, get_trial_counts(file_path, validation), metadata_filter)
+    return read_outlier_reference(reference_path)
@@ -9,10 +9,31 @@ from datetime import datetime
 from dateutil import parser
 import logging
 import re
+from bidimensionalRegression import add_bidimensional_regression, EUCLIDEAN_COLUMNS, AFFINE_COLUMNS
+from circularStatistics import add_circular_statistics, get_circular_columns, signed_error
+from admissionControl import check_job_budget, ResourceLimitError
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+LANDMARKS = ["Nest", "Cave", "Arch", "Tree", "Volcano", "Waterfall"]
+
+# Columns of the "summary" output option and the dtypes they are stored with
+SUMMARY_COLUMN_TYPES = {
+    "Player_ID": "string",
+    "TotalTrainingTime": "float64",
+    "Avg_PI_TotalTime": "float64",
+    "Avg_PI_Distance": "float64",
+    "Avg_PI_FinalAngle": "float64",
+    "Average_PointingJudgementError_all": "float64",
+    "MapRSq": "float64",
+    "MemoryPercentCorrect": "float64",
+    "Avg_PerspectiveErrorMeasure": "float64",
+    "SPACEStartTime": "string",
+    "SPACEEndTime": "string",
+    "SPACETotalTime": "float64",
+}
+
 class DataExtractor:
     @staticmethod
     def get_value(data, *keys):
@@ -50,23 +71,26 @@ class DataExtractor:
         """Retrieves the estimated map coordinates. Returns a list of empty strings if data is missing."""
         logger.debug("Attempting to retrieve map coordinates.")
         mapping_data = DataExtractor.get_value(data, "Sessions", "Mapping")
-        logger.info(f"OMG ！！！What happended to mapping_data: {mapping_data}")
         if not mapping_data:
             logger.debug("Mapping data missing or empty.")
             return [""] * 12  # Return a list of 12 empty strings if data is missing
 
         xy_data = mapping_data[0].get("EstimatedCoordinates", {})
-        logger.info(f"OMG ！！！What happended to xy_data: {xy_data}")
         return [coord for location in xy_data if isinstance(xy_data[location], dict) for coord in xy_data[location].values()]
 
     @staticmethod
     def get_map_coordinate_xy(data):
         """Retrieves X and Y coordinates for specific landmarks. Returns a list of empty strings if data is missing."""
         xy_data = DataExtractor.get_map_coordinate(data)
-        logger.debug(f"OMG,Map coordinate XY data: {xy_data}")
         if not xy_data:
             return [""] * 12  # Return a list of empty strings for each coordinate pair
         return xy_data
+
+    @staticmethod
+    def get_true_coordinate_xy(data):
+        """Retrieves the true X and Y coordinates of each landmark. Returns empty strings for missing landmarks."""
+        coordinates = DataExtractor.get_value(data, "Landmarks", "Coordinates")
+        return [DataExtractor.get_value(coordinates, landmark, axis) for landmark in LANDMARKS for axis in ("X", "Y")]
     
     @staticmethod
     def get_pointing_judgement_data(data):
@@ -100,16 +124,23 @@ class JSONProcessor:
         self.total_pointing_tasks = total_pointing_tasks
         self.total_pt_trials = total_pt_trials
 
-    def process_file(self, file_path):
+    def process_file(self, file_path, read=None):
+        """Extracts the row of one session file, read from disk or with read, e.g. straight from a zip upload."""
         try:
             logger.info(f"Processing file: {file_path}")
-            with open(file_path, 'r') as file:
-                data = json.load(file)
+            if read is not None:
+                data = json.loads(read(file_path))
+            else:
+                with open(file_path, 'r') as file:
+                    data = json.load(file)
             logger.debug(f"Loaded JSON data: {data}")
             
             output = self.extract_data(data)
             logger.info(f"Processed file: {file_path}, output length: {len(output)}")
             return output
+        except ResourceLimitError:
+            # Aborts the job instead of skipping the file
+            raise
         except Exception as e:
             logger.error(f"Error processing file {file_path}: {str(e)}")
             return None
@@ -186,6 +217,7 @@ class JSONProcessor:
         except Exception as e:
             logger.error(f"Error extracting Path Integration data: {e}")
 
+        pointing_signed_errors = [""] * (self.total_pointing_tasks * self.total_pointing_judgements)
         try:
             pointing_data = extractor.get_value(data, "Sessions", "Egocentric", 0, "PointingTasks")
             logger.debug(f"Extracted Pointing Judgements data: {pointing_data}")
@@ -195,10 +227,20 @@ class JSONProcessor:
                 for i in range(self.total_pointing_tasks):
                     for j in range(self.total_pointing_judgements):
                         if i < len(pointing_data) and j < len(pointing_data[i]["PointingJudgements"]):
-                            error = pointing_data[i]["PointingJudgements"][j].get("Absolute_Error", "")
+                            judgement = pointing_data[i]["PointingJudgements"][j]
+                            error = judgement.get("Absolute_Error", "")
                             output.append(error)
+                            if judgement.get("Estimated_Angle", "") != "" and judgement.get("Correct_Angle", "") != "":
+                                # An angle that is not a number, e.g. "-", leaves only this judgement's signed error empty
+                                try:
+                                    pointing_signed_errors[i * self.total_pointing_judgements + j] = float(signed_error(judgement["Estimated_Angle"], judgement["Correct_Angle"]))
+                                except (ValueError, TypeError):
+                                    pointing_signed_errors[i * self.total_pointing_judgements + j] = float('nan')
                             if error != "":
-                                pointing_errors[i].append(float(error))
+                                try:
+                                    pointing_errors[i].append(float(error))
+                                except (ValueError, TypeError):
+                                    logger.warning(f"Absolute error of task {i}, judgement {j} is not a number: {error}")
                             logger.debug(f"Extracted error for task {i}, judgement {j}: {error}")
                         else:
                             output.append("")
@@ -242,12 +284,18 @@ class JSONProcessor:
         # Add map coordinate data
         try:
             map_data = extractor.get_map_coordinate_xy(data)
-            logger.info(f"OMG ！！！map_data: {map_data}")
             output.extend(map_data)
             logger.debug(f"Extracted map coordinate data: {map_data}")
         except Exception as e:
             logger.error(f"Error extracting map coordinate data: {e}")
 
+        try:
+            true_map_data = extractor.get_true_coordinate_xy(data)
+            output.extend(true_map_data)
+            logger.debug(f"Extracted true landmark coordinates: {true_map_data}")
+        except Exception as e:
+            logger.error(f"Error extracting true landmark coordinates: {e}")
+
         # Perspective Taking data
         try:
             pt_data = extractor.get_value(data, "Sessions", "PerspectiveTaking", 0, "Trials")
@@ -309,6 +357,9 @@ class JSONProcessor:
         except Exception as e:
             logger.error(f"Error calculating Perspective Taking average error: {e}")
 
+        # Signed pointing errors, kept at the end so the columns before them do not move
+        output.extend(pointing_signed_errors)
+
         logger.info("Data extraction completed.")
         return output
     
@@ -359,9 +410,10 @@ def get_column_headers(total_pi_trials, total_pointing_judgements, total_pointin
     logger.debug(f"Headers after adding Pointing Tasks and other data: {headers}")
 
     # Add headers for map coordinates
-    landmarks = ["Nest", "Cave", "Arch", "Tree", "Volcano", "Waterfall"]
-    for landmark in landmarks:
+    for landmark in LANDMARKS:
         headers.extend([f"{landmark}_X", f"{landmark}_Y"])
+    for landmark in LANDMARKS:
+        headers.extend([f"{landmark}_TrueX", f"{landmark}_TrueY"])
     logger.debug(f"Headers after adding map coordinates: {headers}")
 
     # Add headers for Perspective Taking trials if any
@@ -387,6 +439,10 @@ def get_column_headers(total_pi_trials, total_pointing_judgements, total_pointin
         headers.extend([f"Avg_PointingJudgement_AbsoluteError_{i}" for i in range(total_pointing_tasks)])
 
     headers.append("Avg_PerspectiveErrorMeasure")
+
+    # Add headers for signed pointing errors, summarised by circular statistics
+    for i in range(total_pointing_tasks):
+        headers.extend([f"PointingJudgement_SignedError_{i}_Trial_{j}" for j in range(total_pointing_judgements)])
     logger.debug(f"Final headers: {headers}")
 
     return headers
@@ -488,21 +544,13 @@ def calculate_pet_averages(df, select_columns, selected_trials=None):
     if columns:
         df["Avg_PerspectiveErrorMeasure"] = df[columns].apply(lambda x: pd.to_numeric(x, errors='coerce')).mean(axis=1)
        
-def JSONtoCSV(json_files, csv_filename, total_pi_trials, total_pointing_judgements, total_pointing_tasks, total_pt_trials):
-    logger.info(f"Processing {len(json_files)} JSON files")
-    
-    # Initialize JSON processor
-    processor = JSONProcessor(total_pi_trials, total_pointing_judgements, total_pointing_tasks, total_pt_trials)
-    
-    # Generate column headers
-    headers = get_column_headers(total_pi_trials, total_pointing_judgements, total_pointing_tasks, total_pt_trials)
-    logger.debug(f"Generated column headers: {headers}")
-
+def process_json_files(json_files, processor, read=None):
     data = []
     for file_path in json_files:
         if file_path is not None:
+            check_job_budget()
             logger.info(f"Processing file: {file_path}")
-            processed_data = processor.process_file(file_path)
+            processed_data = processor.process_file(file_path, read)
             if processed_data is not None:
                 data.append(processed_data)
                 logger.debug(f"Processed data for file {file_path}: {processed_data}")
@@ -513,7 +561,53 @@ def JSONtoCSV(json_files, csv_filename, total_pi_trials, total_pointing_judgemen
         logger.warning("No valid data processed from any files.")
     else:
         logger.debug(f"Final data collected from all files: {data}")
+    return data
+
+def build_summary_table(data, headers):
+    """Builds the typed summary table from extracted rows. Unparseable numbers become NaN."""
+    positions = [headers.index(col) for col in SUMMARY_COLUMN_TYPES]
+    rows = [[row[i] if i < len(row) else "" for i in positions] for row in data]
+    summary = type_summary_table(pd.DataFrame(rows, columns=list(SUMMARY_COLUMN_TYPES)))
+    logger.info(f"Summary table created with shape: {summary.shape}")
+    return summary
+
+def type_summary_table(summary):
+    for col, dtype in SUMMARY_COLUMN_TYPES.items():
+        if dtype == "float64":
+            summary[col] = pd.to_numeric(summary[col], errors='coerce')
+        else:
+            summary[col] = summary[col].astype(dtype)
+    return summary
+
+def write_summary_table(summary, summary_path):
+    """Stores the summary table as JSON rows. Columns and types are fixed by SUMMARY_COLUMN_TYPES, missing values
+    are stored as null. The file is written next to its target and moved into place."""
+    rows = summary.astype(object).where(summary.notna(), None).values.tolist()
+    tmp_path = f"{summary_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'columns': list(summary.columns), 'rows': rows}, f)
+    os.replace(tmp_path, summary_path)
+
+def read_summary_table(summary_path):
+    """Reads a summary table stored by write_summary_table. Raises ValueError if the file does not hold the summary columns."""
+    with open(summary_path) as f:
+        stored = json.load(f)
+    if not isinstance(stored, dict) or stored.get('columns') != list(SUMMARY_COLUMN_TYPES) or not isinstance(stored.get('rows'), list):
+        raise ValueError(f"Not a summary table: {summary_path}")
+    return type_summary_table(pd.DataFrame(stored['rows'], columns=list(SUMMARY_COLUMN_TYPES)))
+
+def save_summary_table(data, headers, summary_path):
+    try:
+        summary = build_summary_table(data, headers)
+        write_summary_table(summary, summary_path)
+        logger.info(f"Summary table saved to: {summary_path}")
+        return summary
+    except Exception as e:
+        logger.error(f"Error saving summary table: {e}")
+        return None
 
+def build_wide_table(data, headers):
+    """Builds the wide DataFrame from extracted rows and adds the bidimensional regression and circular statistics of every row."""
     # Create DataFrame with collected data and headers
     try:
         df = pd.DataFrame(data, columns=headers)
@@ -523,12 +617,46 @@ def JSONtoCSV(json_files, csv_filename, total_pi_trials, total_pointing_judgemen
         logger.error(f"Error creating DataFrame: {e}")
         return None
 
-    # Save DataFrame to CSV
+    # Recompute bidimensional regression for every participant
+    try:
+        add_bidimensional_regression(df, LANDMARKS)
+    except Exception as e:
+        logger.error(f"Error calculating bidimensional regression: {e}")
+
+    # Circular statistics of the angle and signed error columns
     try:
-        df.to_csv(csv_filename, index=False)
-        logger.info(f"Data saved to CSV file: {csv_filename}")
+        add_circular_statistics(df)
     except Exception as e:
-        logger.error(f"Error saving CSV file: {e}")
+        logger.error(f"Error calculating circular statistics: {e}")
+    return df
+
+def JSONtoCSV(json_files, csv_filename, total_pi_trials, total_pointing_judgements, total_pointing_tasks, total_pt_trials, summary_path=None):
+    logger.info(f"Processing {len(json_files)} JSON files")
+    
+    # Initialize JSON processor
+    processor = JSONProcessor(total_pi_trials, total_pointing_judgements, total_pointing_tasks, total_pt_trials)
+    
+    # Generate column headers
+    headers = get_column_headers(total_pi_trials, total_pointing_judgements, total_pointing_tasks, total_pt_trials)
+    logger.debug(f"Generated column headers: {headers}")
+
+    data = process_json_files(json_files, processor)
+
+    # Materialize the summary table from the same rows
+    if summary_path:
+        save_summary_table(data, headers, summary_path)
+
+    df = build_wide_table(data, headers)
+    if df is None:
+        return None
+
+    # Save DataFrame to CSV, the backend only keeps the DataFrame and passes no file name
+    if csv_filename:
+        try:
+            df.to_csv(csv_filename, index=False)
+            logger.info(f"Data saved to CSV file: {csv_filename}")
+        except Exception as e:
+            logger.error(f"Error saving CSV file: {e}")
 
     return df
 
@@ -540,6 +668,7 @@ def get_column_groups(df, total_pi_trials, total_pointing_judgements, total_poin
         return [landmark for landmark in landmarks if landmark in df.columns]
 
     estimated_landmarks = findEstimatedLandmarks(df)
+    circular_columns = get_circular_columns(total_pi_trials, total_pointing_tasks, total_pt_trials)
     column_groups = {
         
         "Player": ["Player_ID"],
@@ -554,6 +683,10 @@ def get_column_groups(df, total_pi_trials, total_pointing_judgements, total_poin
                 "PI DistanceRatio":["Avg_PI_DistRatio"],
                 "PI FinalAngle": ["Avg_PI_FinalAngle"],
                 "Corrected PI Angle": ["Avg_PI_Corrected_PI_Angle"]
+            },
+            "PI Circular statistics": {
+                "PI FinalAngle": circular_columns.get("PI_FinalAngle", []),
+                "Corrected PI Angle": circular_columns.get("PI_Corrected_PI_Angle", [])
             }
         },
         "Pointing error": {
@@ -564,11 +697,19 @@ def get_column_groups(df, total_pi_trials, total_pointing_judgements, total_poin
                     [
                         "Average_PointingJudgementError_all"
                     ]
+            },
+            "Pointing_error_circular_statistics": {
+                **{f"Signed error (task {i})": circular_columns.get(f"PointingJudgement_SignedError_{i}", []) for i in range(total_pointing_tasks)},
+                "Signed error (all)": circular_columns.get("PointingJudgement_SignedError_all", [])
             }
         },
         "Map": {
             "MapTotalTime": ["MapTotalTime"],
             "MapRSq": ["MapRSq"],
+            "Bidimensional regression": {
+                "Euclidean": EUCLIDEAN_COLUMNS,
+                "Affine": AFFINE_COLUMNS
+            },
             "EstimatedCoordinates": estimated_landmarks if estimated_landmarks else ["No landmarks found"]
         },
         "Memory": [
@@ -582,6 +723,10 @@ def get_column_groups(df, total_pi_trials, total_pointing_judgements, total_poin
                 "Perspective_Error_Average": [
                     "Avg_PerspectiveErrorMeasure"
                 ], 
+             },
+             "Perspective circular statistics": {
+                "Signed error (every trial)": circular_columns.get("PerspectiveSignedError_trials", []),
+                "Signed error": circular_columns.get("PerspectiveSignedError", [])
              }
         },
         "Overall Measures": [
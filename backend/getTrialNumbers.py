@@ -106,6 +106,19 @@ def findAllTrials(file_path):
 
     return max_values["num_pi"], max_values["num_pj"], max_values["num_pot"], max_values["num_pet"]
 
+# Find all trial counts of one already parsed session document
+def findTrialCountsInData(data):
+    flat_keys = flatten_json(data).keys()
+    counts = []
+    for pattern in (PATTERN_PATH_INTEGRATION, PATTERN_POINTING_JUDGEMENT, PATTERN_POINTING_TASK, PATTERN_PERSPECTIVE_TAKING):
+        max_j = -1
+        for key in flat_keys:
+            match = re.match(pattern, key)
+            if match:
+                max_j = max(max_j, int(match.group(1)))
+        counts.append(max_j + 1)
+    return tuple(counts)
+
 def findEstimatedLandmarks(path_file):
     df = process_single_json(path_file)
     csv_headers = df.columns
@@ -0,0 +1,40 @@
+"""Gunicorn settings for the backend.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+By default the app is imported and warmed up once in the master before the workers are forked, so every worker
+starts with pandas, numpy, the extraction modules and a filled regex cache already in memory, shared copy-on-write.
+PRELOAD_APP=0 imports the app in every worker instead (needed for --reload), WARM_UP=0 skips the warm-up extraction.
+Sessions are kept in the SQLite store all workers share, SESSION_BACKEND=memory is only for a single process.
+
+Everything else the app keeps in memory is per worker once forked: the dataset cache (DATASET_CACHE_SIZE datasets
+per worker), the chunked-upload objects in chunkedUpload._uploads (only a cache, the state file and lock next to
+each part are what the workers agree on) and the admission counters, so MAX_CONCURRENT_JOBS and MAX_QUEUED_JOBS
+apply to each worker and the whole server runs up to workers times as many heavy jobs.
+"""
+import gc
+import os
+import time
+
+CONFIG_LOADED = time.perf_counter()
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:7069')
+workers = int(os.environ.get('GUNICORN_WORKERS', '2'))
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '300'))
+preload_app = os.environ.get('PRELOAD_APP', '1') == '1'
+
+# Read by app.py when it is imported
+os.environ.setdefault('WARM_UP', '1')
+
+
+def when_ready(server):
+    if preload_app:
+        # Objects created while preloading are never collected again, so the workers' garbage collector
+        # does not write to (and un-share) the pages they live on
+        gc.freeze()
+    server.log.info(f"Master ready in {time.perf_counter() - CONFIG_LOADED:.3f}s (preload_app={preload_app})")
+
+
+def post_fork(server, worker):
+    server.log.info(f"Worker {worker.pid} forked {time.perf_counter() - CONFIG_LOADED:.3f}s after startup")
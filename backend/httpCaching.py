@@ -0,0 +1,125 @@
+import os
+import json
+import zlib
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from flask import Response, request
+
+try:
+    import zstandard
+except ImportError:  # zstd is offered only when the zstandard package is installed
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+MIN_COMPRESS_SIZE = 1024
+CHUNK_SIZE = 64 * 1024
+
+# Hashes of this many upload versions are kept, the least recently used is dropped first
+UPLOAD_HASH_CACHE_SIZE = 256
+
+_upload_hashes = OrderedDict()
+_upload_hashes_lock = threading.Lock()
+
+
+def _store_upload_hash(key, hexdigest):
+    with _upload_hashes_lock:
+        _upload_hashes[key] = hexdigest
+        _upload_hashes.move_to_end(key)
+        while len(_upload_hashes) > UPLOAD_HASH_CACHE_SIZE:
+            _upload_hashes.popitem(last=False)
+
+
+def get_upload_hash(file_path):
+    """SHA-256 of an upload's content, cached until the file changes."""
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+    with _upload_hashes_lock:
+        if key in _upload_hashes:
+            _upload_hashes.move_to_end(key)
+            return _upload_hashes[key]
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    _store_upload_hash(key, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def remember_upload_hash(file_path, hexdigest):
+    """Records a hash computed while the upload was received, so it is not read again."""
+    stat = os.stat(file_path)
+    _store_upload_hash((os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size), hexdigest)
+
+
+def make_etag(file_path, *parts):
+    """Strong validator for a response derived from an upload and the request parameters in parts."""
+    digest = hashlib.sha256(get_upload_hash(file_path).encode())
+    digest.update(json.dumps(parts, sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:32]
+
+
+def choose_encoding(size=None):
+    """Picks zstd or gzip from the request's Accept-Encoding, or None for an identity response."""
+    if size is not None and size < MIN_COMPRESS_SIZE:
+        return None
+    offered = ['zstd', 'gzip'] if zstandard is not None else ['gzip']
+    return request.accept_encodings.best_match(offered)
+
+
+def representation_etag(etag, encoding):
+    # Each content coding is a different representation and needs its own strong ETag
+    return f'{etag}-{encoding}' if encoding else etag
+
+
+def matching_etag(etag):
+    """Returns the representation ETag the client already holds, in any content coding, or None."""
+    for encoding in (None, 'gzip', 'zstd'):
+        candidate = representation_etag(etag, encoding)
+        if request.if_none_match.contains(candidate):
+            return candidate
+    return None
+
+
+def not_modified_response(matched_etag):
+    response = Response(status=304)
+    response.set_etag(matched_etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def compress_chunks(chunks, encoding):
+    """Compresses an iterable of byte chunks one chunk at a time."""
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_file(f):
+    try:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            yield chunk
+    finally:
+        f.close()
+
+
+def cached_response(chunks, mimetype, etag, encoding, headers=None):
+    """Streams chunks, compressed when an encoding was negotiated, with ETag and caching headers."""
+    body = compress_chunks(chunks, encoding) if encoding else chunks
+    response = Response(body, mimetype=mimetype, headers=headers or {})
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.set_etag(representation_etag(etag, encoding))
+    return response
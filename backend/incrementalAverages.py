@@ -0,0 +1,263 @@
+import logging
+import re
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+PI_METRICS = ["PI_TotalTime_", "PI_Distance_", "PI_DistRatio_", "PI_FinalAngle_", "PI_Corrected_PI_Angle_"]
+PATTERN_POINTING_COLUMN = r'PointingJudgement_AbsoluteError_(\d+)_Trial_\d+'
+# Incremental updates after which a running sum is recomputed exactly, so rounding error cannot build up
+RECOMPUTE_EVERY = 64
+
+
+def get_trial_columns(columns):
+    """The per-trial columns the Avg_* columns are computed from."""
+    return [col for col in columns if (any(col.startswith(m) for m in PI_METRICS) and col.split('_')[-1].isdigit())
+            or re.fullmatch(PATTERN_POINTING_COLUMN, col) or col.startswith("PerspectiveErrorMeasure_")]
+
+
+class RunningMean:
+    """Per-participant running sum and count over a changing set of trial columns."""
+
+    def __init__(self, size):
+        self.members = set()
+        self.sums = np.zeros(size)
+        self.counts = np.zeros(size)
+        self.updates = 0
+
+    def add(self, values):
+        self.sums += np.nan_to_num(values)
+        self.counts += np.isfinite(values)
+        self.updates += 1
+
+    def remove(self, values):
+        self.sums -= np.nan_to_num(values)
+        self.counts -= np.isfinite(values)
+        self.updates += 1
+        # Reset accumulated rounding error once a participant has no values left
+        self.sums[self.counts == 0] = 0.0
+
+    def recompute(self, arrays):
+        """Sums and counts computed from scratch over the current values of all members."""
+        self.sums = np.zeros_like(self.sums)
+        self.counts = np.zeros_like(self.counts)
+        for values in arrays:
+            self.sums += np.nan_to_num(values)
+            self.counts += np.isfinite(values)
+        self.updates = 0
+
+    def set_members(self, columns, values):
+        """Moves to a new set of columns by applying only the added and removed ones. Returns True if anything changed."""
+        columns = set(columns)
+        added = columns - self.members
+        removed = self.members - columns
+        for col in added:
+            self.add(values[col])
+        for col in removed:
+            self.remove(values[col])
+        self.members = columns
+        if self.updates >= RECOMPUTE_EVERY:
+            self.recompute(values[col] for col in columns)
+        return bool(added or removed)
+
+    def mean(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.counts > 0, self.sums / self.counts, np.nan)
+
+
+class IncrementalAverages:
+    """Keeps the Avg_* columns of one dataset in sync with the column selection.
+
+    Mirrors calculate_pi_averages, calculate_pointing_averages and calculate_pet_averages, but keeps running
+    sums and counts per trial block so a selection change only touches the trials that were added or removed.
+    Flagged trial values can be left out of all averages with set_exclusions."""
+
+    def __init__(self, df, total_pointing_tasks):
+        self.df = df
+        self.total_pointing_tasks = total_pointing_tasks
+        self.raw_values = {col: pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float) for col in get_trial_columns(df.columns)}
+        self.values = self.raw_values
+        self.perspective_columns = [col for col in df.columns if col.startswith("PerspectiveErrorMeasure_")]
+
+        # Averages computed at extraction time, restored whenever a block has nothing selected
+        average_columns = [col for col in df.columns if col.startswith("Avg_") or col == "Average_PointingJudgementError_all"]
+        self.extracted = {col: df[col].copy() for col in average_columns}
+        self.original = self.extracted
+        self.exclusion_key = None
+        # Cleaned column groups of df, kept by the app for the columns df had when they were cleaned
+        self.column_groups = None
+        self.column_groups_key = None
+        # Circular summaries without the excluded trials, kept by the app for the OutlierFlags key they were computed for
+        self.circular_columns = None
+        self.circular_key = None
+
+        self._init_state()
+        logger.info(f"IncrementalAverages initialised for {len(df)} participants and {len(self.values)} trial columns")
+
+    def _init_state(self):
+        size = len(self.df)
+        self.pi = {metric: RunningMean(size) for metric in PI_METRICS}
+        self.pointing = [RunningMean(size) for _ in range(self.total_pointing_tasks)]
+        self.pointing_all = RunningMean(size)
+        self.pet = RunningMean(size)
+        self.task_means = {}
+        self.pi_selected = {metric: False for metric in PI_METRICS}
+        self.pointing_mode = None
+        self.dirty = False
+
+    def reset(self):
+        """Restores the averages computed at extraction time and drops any exclusions."""
+        if self.exclusion_key is not None:
+            self.set_exclusions(None)
+            return
+        if not self.dirty:
+            return
+        for col in self.original:
+            self._restore(col)
+        self._init_state()
+
+    def set_exclusions(self, excluded, key=None):
+        """Leaves flagged trial values out of every average from now on, or uses all values again when excluded is None.
+
+        excluded maps trial columns to boolean masks of the participants whose value is left out. key identifies the
+        exclusions, the averages are only rebuilt when it differs from the key of the current ones."""
+        key = None if excluded is None else key
+        if excluded is not None and key is None:
+            raise ValueError("Exclusions need a key")
+        if key == self.exclusion_key:
+            return
+        if excluded is None:
+            self.values = self.raw_values
+            self.original = self.extracted
+        else:
+            self.values = dict(self.raw_values)
+            for col, mask in excluded.items():
+                if col in self.values and mask.any():
+                    self.values[col] = np.where(mask, np.nan, self.raw_values[col])
+            self.original = {**self.extracted, **self._all_trial_averages()}
+        for col in self.original:
+            self._restore(col)
+        self.exclusion_key = key
+        self._init_state()
+        logger.info(f"Averages rebuilt with exclusions: {key}")
+
+    def _all_trial_averages(self):
+        """Averages over all trials of every block, in place of the extraction-time ones when values are excluded."""
+        index = self.df.index
+        averages = {}
+        for metric in PI_METRICS:
+            target = f"Avg_{metric[:-1]}"
+            columns = [col for col in self.values if col.startswith(metric) and col.split('_')[-1].isdigit()]
+            if columns and target in self.extracted:
+                running = RunningMean(len(index))
+                running.set_members(columns, self.values)
+                averages[target] = pd.Series(running.mean(), index=index)
+
+        # The overall pointing error is the mean of the task means, as in apply_pointing
+        task_means = RunningMean(len(index))
+        task_blocks = 0
+        for trial in range(self.total_pointing_tasks):
+            target = f'Avg_PointingJudgement_AbsoluteError_{trial}'
+            columns = [col for col in self.values if f'PointingJudgement_AbsoluteError_{trial}_Trial_' in col]
+            if columns and target in self.extracted:
+                running = RunningMean(len(index))
+                running.set_members(columns, self.values)
+                averages[target] = pd.Series(running.mean(), index=index)
+                task_means.add(running.mean())
+                task_blocks += 1
+        if task_blocks and 'Average_PointingJudgementError_all' in self.extracted:
+            averages['Average_PointingJudgementError_all'] = pd.Series(task_means.mean(), index=index)
+
+        columns = [col for col in self.perspective_columns if col in self.values]
+        if columns and "Avg_PerspectiveErrorMeasure" in self.extracted:
+            running = RunningMean(len(index))
+            running.set_members(columns, self.values)
+            averages["Avg_PerspectiveErrorMeasure"] = pd.Series(running.mean(), index=index)
+        return averages
+
+    def _restore(self, col):
+        if col in self.original:
+            self.df[col] = self.original[col].copy()
+
+    def apply_pi(self, select_columns):
+        for metric in PI_METRICS:
+            columns = [col for col in select_columns if col.startswith(metric) and col.split('_')[-1].isdigit() and col in self.values]
+            target = f"Avg_{metric[:-1]}"
+            if columns:
+                if self.pi[metric].set_members(columns, self.values) or not self.pi_selected[metric]:
+                    self.df[target] = self.pi[metric].mean()
+                    logger.debug(f"Updated {target}")
+                self.pi_selected[metric] = True
+            elif self.pi_selected[metric]:
+                self.pi[metric].set_members([], self.values)
+                self._restore(target)
+                self.pi_selected[metric] = False
+
+    def apply_pointing(self, select_columns):
+        trial_columns_all = [[col for col in select_columns if f'PointingJudgement_AbsoluteError_{trial}_Trial_' in col and col in self.values]
+                             for trial in range(self.total_pointing_tasks)]
+
+        if not any(trial_columns_all):
+            # No individual trials selected: fall back to the pre-calculated averages, as calculate_pointing_averages does
+            if self.pointing_mode == 'trials':
+                for trial in range(self.total_pointing_tasks):
+                    self.pointing[trial].set_members([], self.values)
+                    self._restore(f'Avg_PointingJudgement_AbsoluteError_{trial}')
+                self.pointing_all = RunningMean(len(self.df))
+                self.task_means = {}
+            self.pointing_mode = 'averages'
+            valid_trial_averages = [col for col in select_columns if col.startswith('Avg_PointingJudgement_AbsoluteError_') and col.split('_')[-1].isdigit() and col in self.original]
+            if valid_trial_averages:
+                for col in valid_trial_averages:
+                    self.df[col] = pd.to_numeric(self.original[col], errors='coerce')
+                self.df['Average_PointingJudgementError_all'] = self.df[valid_trial_averages].mean(axis=1)
+            elif 'Average_PointingJudgementError_all' in select_columns and 'Average_PointingJudgementError_all' in self.original:
+                self.df['Average_PointingJudgementError_all'] = pd.to_numeric(self.original['Average_PointingJudgementError_all'], errors='coerce')
+            else:
+                self.df['Average_PointingJudgementError_all'] = np.nan
+            return []
+
+        entering = self.pointing_mode != 'trials'
+        changed = False
+        for trial, columns in enumerate(trial_columns_all):
+            if self.pointing[trial].set_members(columns, self.values) or entering:
+                task_mean = self.pointing[trial].mean()
+                self.df[f'Avg_PointingJudgement_AbsoluteError_{trial}'] = task_mean
+                # Swap this task's contribution to the overall average
+                if trial in self.task_means:
+                    self.pointing_all.remove(self.task_means[trial])
+                self.pointing_all.add(task_mean)
+                self.task_means[trial] = task_mean
+                changed = True
+        if changed:
+            if self.pointing_all.updates >= RECOMPUTE_EVERY:
+                self.pointing_all.recompute(self.task_means.values())
+            self.df['Average_PointingJudgementError_all'] = self.pointing_all.mean()
+        self.pointing_mode = 'trials'
+
+        selected_trials = {trial for trial, columns in enumerate(trial_columns_all) if columns}
+        return sorted(set(range(self.total_pointing_tasks)) - selected_trials)
+
+    def apply_pet(self, select_columns):
+        selected_trials = []
+        for item in select_columns:
+            if 'PerspectiveErrorMeasure_' in item:
+                trial_part = item.split('PerspectiveErrorMeasure_')[-1]
+                if '.' not in trial_part:
+                    selected_trials.append(int(trial_part))
+        if selected_trials:
+            columns = [f"PerspectiveErrorMeasure_{i}" for i in sorted(selected_trials)]
+        else:
+            columns = self.perspective_columns
+        columns = [col for col in columns if col in self.values]
+        if columns and self.pet.set_members(columns, self.values):
+            self.df["Avg_PerspectiveErrorMeasure"] = self.pet.mean()
+
+    def apply_selection(self, select_columns):
+        """Updates the Avg_* columns for a new selection and returns the unselected pointing tasks."""
+        self.dirty = True
+        self.apply_pi(select_columns)
+        unselected_pot = self.apply_pointing(select_columns)
+        self.apply_pet(select_columns)
+        return unselected_pot
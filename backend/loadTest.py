@@ -0,0 +1,223 @@
+"""Concurrent load test for the upload -> /api/columns -> /api/process flow.
+
+Example:
+    python loadTest.py --start-server --users 20 --ramp linear --ramp-seconds 10 --duration 60 --participants 50 --report load_report.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import argparse
+import logging
+import threading
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+from syntheticSession import make_synthetic_zip
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = ['upload', 'columns', 'process']
+
+
+class Results:
+    """Latencies and outcomes per endpoint, shared by all virtual users."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        self.errors = {endpoint: 0 for endpoint in ENDPOINTS}
+        self.status_codes = {endpoint: {} for endpoint in ENDPOINTS}
+
+    def record(self, endpoint, seconds, status):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            self.status_codes[endpoint][str(status)] = self.status_codes[endpoint].get(str(status), 0) + 1
+            if not (200 <= status < 300):
+                self.errors[endpoint] += 1
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def start_delays(users, ramp, ramp_seconds, steps):
+    """Start offset in seconds for every virtual user under a ramp profile."""
+    if ramp == 'constant' or users <= 1 or ramp_seconds <= 0:
+        return [0.0] * users
+    if ramp == 'linear':
+        return [ramp_seconds * i / (users - 1) for i in range(users)]
+    if ramp == 'step':
+        per_step = -(-users // steps)
+        return [ramp_seconds * (i // per_step) / max(steps - 1, 1) for i in range(users)]
+    raise ValueError(f"Unknown ramp profile: {ramp}")
+
+
+def multipart_body(field, filename, payload, content_type='application/zip'):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n').encode() + payload + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def leaf_columns(group):
+    """All column names in a column tree, as the UI selects them by default."""
+    if isinstance(group, dict):
+        return [col for value in group.values() for col in leaf_columns(value)]
+    if isinstance(group, list):
+        return list(group)
+    return [group]
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, index, args, payload, results, delay, deadline):
+        super().__init__(daemon=True)
+        self.index = index
+        self.args = args
+        self.payload = payload
+        self.results = results
+        self.delay = delay
+        self.deadline = deadline
+        self.rng = random.Random(args.seed + index)
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    def request(self, endpoint, url, data=None, headers=None, method='GET'):
+        req = urllib.request.Request(url, data=data, headers=headers or {}, method=method)
+        start = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=self.args.timeout) as response:
+                body = response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            body, status = e.read(), e.code
+        except Exception as e:
+            logger.debug(f"User {self.index} {endpoint} failed: {e}")
+            body, status = b'', 599
+        self.results.record(endpoint, time.perf_counter() - start, status)
+        return status, body
+
+    def iteration(self):
+        base = self.args.base_url.rstrip('/')
+        body, content_type = multipart_body('file', f'cohort_{self.index}.zip', self.payload)
+        status, response = self.request('upload', f'{base}/api/upload', body, {'Content-Type': content_type}, 'POST')
+        if status != 200:
+            return
+        file_path = json.loads(response)['file_path']
+
+        option = self.rng.choice(self.args.options)
+        query = urllib.parse.urlencode({'option': option, 'file_path': file_path})
+        status, response = self.request('columns', f'{base}/api/columns?{query}')
+        if status != 200:
+            return
+        columns = leaf_columns(json.loads(response).get('columns', {}))
+
+        # Like an analyst toggling checkboxes: the full selection first, then random subsets
+        for i in range(self.args.process_per_upload):
+            selection = columns if i == 0 else [col for col in columns if self.rng.random() < 0.5] or columns
+            body = json.dumps({'columns': selection, 'option': option, 'file_path': file_path}).encode()
+            self.request('process', f'{base}/api/process', body, {'Content-Type': 'application/json'}, 'POST')
+
+    def run(self):
+        time.sleep(self.delay)
+        iterations = 0
+        while time.monotonic() < self.deadline and (not self.args.iterations or iterations < self.args.iterations):
+            self.iteration()
+            iterations += 1
+
+
+def build_report(results, elapsed, args):
+    report = {'config': {k: v for k, v in vars(args).items()}, 'elapsed_seconds': elapsed, 'endpoints': {}}
+    for endpoint in ENDPOINTS:
+        latencies = sorted(results.latencies[endpoint])
+        count = len(latencies)
+        report['endpoints'][endpoint] = {
+            'requests': count,
+            'errors': results.errors[endpoint],
+            'error_rate': results.errors[endpoint] / count if count else 0.0,
+            'status_codes': results.status_codes[endpoint],
+            'throughput_rps': count / elapsed if elapsed else 0.0,
+            'latency_seconds': {
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'max': latencies[-1] if latencies else None,
+            },
+        }
+    return report
+
+
+def start_server(port):
+    """Starts app.py under the Flask development server (threaded, no reloader) and waits until it answers."""
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port), '--with-threads', '--no-reload'],
+                               cwd=backend_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/api/columns', timeout=1)
+        except urllib.error.HTTPError:
+            return process
+        except Exception:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Server did not start on port {port}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay concurrent upload/columns/process sequences against the backend.')
+    parser.add_argument('--base-url', default='http://127.0.0.1:7069')
+    parser.add_argument('--start-server', action='store_true', help='start a local server on the port of --base-url')
+    parser.add_argument('--users', type=int, default=10, help='number of concurrent virtual users')
+    parser.add_argument('--ramp', choices=['constant', 'linear', 'step'], default='constant')
+    parser.add_argument('--ramp-seconds', type=float, default=0.0)
+    parser.add_argument('--steps', type=int, default=4, help='number of steps for the step ramp')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds each virtual user keeps starting new iterations')
+    parser.add_argument('--iterations', type=int, default=0, help='iterations per user, 0 for unlimited within --duration')
+    parser.add_argument('--participants', type=int, default=20, help='sessions per synthetic zip')
+    parser.add_argument('--process-per-upload', type=int, default=2)
+    parser.add_argument('--options', nargs='+', default=['detailed', 'summary'])
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', default='load_report.json')
+    args = parser.parse_args(argv)
+
+    server = start_server(urllib.parse.urlparse(args.base_url).port or 80) if args.start_server else None
+    try:
+        payload = make_synthetic_zip(args.participants, seed=args.seed)
+        logger.info(f"Synthetic zip: {args.participants} participants, {len(payload)} bytes")
+        results = Results()
+        start = time.monotonic()
+        delays = start_delays(args.users, args.ramp, args.ramp_seconds, args.steps)
+        users = [VirtualUser(i, args, payload, results, delay, start + delay + args.duration) for i, delay in enumerate(delays)]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.monotonic() - start
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = build_report(results, elapsed, args)
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    for endpoint, stats in report['endpoints'].items():
+        latency = stats['latency_seconds']
+        logger.info(f"{endpoint}: {stats['requests']} requests, error rate {stats['error_rate']:.2%}, "
+                    f"p50 {latency['p50']}, p95 {latency['p95']}, p99 {latency['p99']}, {stats['throughput_rps']:.2f} req/s")
+    logger.info(f"Report written to: {args.report}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import re
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+TASKS = ["PathIntegration", "Pointing", "PerspectiveTaking"]
+
+# Wide column pattern -> (task, metric); groups are (block, trial) for pointing and (trial,) otherwise
+LONG_FORMAT_PATTERNS = [
+    (re.compile(r"PI_(TotalTime|Distance|DistRatio|FinalAngle|Angle|Corrected_PI_Angle)_(\d+)"), "PathIntegration"),
+    (re.compile(r"PointingJudgement_(AbsoluteError|SignedError)_(\d+)_Trial_(\d+)"), "Pointing"),
+    (re.compile(r"Pers?pective(TotalTime|IdleTime|FinalAngle|CorrectAngle|DifferenceAngle|ErrorMeasure|SignedError)_(\d+)"), "PerspectiveTaking"),
+]
+
+METRICS = [
+    "TotalTime", "Distance", "DistRatio", "FinalAngle", "Angle", "Corrected_PI_Angle",
+    "AbsoluteError", "SignedError",
+    "IdleTime", "CorrectAngle", "DifferenceAngle", "ErrorMeasure"
+]
+
+LONG_FORMAT_COLUMNS = ["Participant", "Player_ID", "Task", "Block", "Trial", "Metric", "Value"]
+
+
+def parse_trial_column(col):
+    """Returns (task, block, trial, metric) for a per-trial wide column, or None for any other column."""
+    for pattern, task in LONG_FORMAT_PATTERNS:
+        match = pattern.fullmatch(col)
+        if match:
+            if task == "Pointing":
+                metric, block, trial = match.groups()
+            else:
+                (metric, trial), block = match.groups(), 0
+            return task, int(block), int(trial), metric
+    return None
+
+
+def to_long_format(df, player_ids=None, outliers=None, participant_columns=None):
+    """Converts the per-trial columns of a wide table into one row per participant x task x trial x metric.
+
+    Participant, Block and Trial are integer-coded, Player_ID, Task and Metric are categorical and
+    trials without a numeric value are left out. With the OutlierFlags of the cohort, a boolean Outlier
+    column marks the flagged values. participant_columns are other columns of df, e.g. the Avg_* averages,
+    kept as they are on every row of their participant; a participant without any trial value has no rows."""
+    if player_ids is None:
+        player_ids = df["Player_ID"] if "Player_ID" in df.columns else pd.Series([""] * len(df))
+
+    specs = [(col, parse_trial_column(col)) for col in df.columns]
+    specs = [(col, spec) for col, spec in specs if spec is not None]
+    if not specs:
+        if participant_columns:
+            logger.warning(f"No per-trial columns to convert to long format, dropped participant columns: {list(participant_columns)}")
+        else:
+            logger.warning("No per-trial columns to convert to long format")
+        return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in zip(
+            LONG_FORMAT_COLUMNS, ["int32", "category", "category", "int16", "int16", "category", "float64"])})
+
+    columns = [col for col, _ in specs]
+    values = df[columns].apply(lambda x: pd.to_numeric(x, errors='coerce')).to_numpy(dtype=float)
+    task_codes = np.array([TASKS.index(spec[0]) for _, spec in specs], dtype=np.int8)
+    blocks = np.array([spec[1] for _, spec in specs], dtype=np.int16)
+    trials = np.array([spec[2] for _, spec in specs], dtype=np.int16)
+    metric_codes = np.array([METRICS.index(spec[3]) for _, spec in specs], dtype=np.int8)
+
+    # Row-major order keeps participants together and trials in their wide column order
+    participant_idx, column_idx = np.nonzero(np.isfinite(values))
+    player_ids = np.asarray(player_ids, dtype=object)
+
+    long_df = pd.DataFrame({
+        "Participant": participant_idx.astype(np.int32),
+        "Player_ID": pd.Categorical(player_ids.astype(str)[participant_idx]),
+        "Task": pd.Categorical.from_codes(task_codes[column_idx], categories=TASKS),
+        "Block": blocks[column_idx],
+        "Trial": trials[column_idx],
+        "Metric": pd.Categorical.from_codes(metric_codes[column_idx], categories=METRICS),
+        "Value": values[participant_idx, column_idx],
+    })
+    if outliers is not None:
+        long_df["Outlier"] = outliers.flag_matrix(columns)[participant_idx, column_idx]
+    for col in participant_columns or []:
+        long_df[col] = df[col].to_numpy()[participant_idx]
+    logger.info(f"Long format table created with shape: {long_df.shape} from {values.size} wide cells")
+    return long_df
+
@@ -0,0 +1,236 @@
+"""Participant filters evaluated on the MetaData block of each session file alone.
+
+MetaData is the first key of a session file, so it is decoded from the leading bytes of the file, or of the zip
+member, without reading the rest of the document. Files that do not match are skipped before they are extracted,
+validated or counted for the trial numbers, so the cohort and its cost are those of the selected participants.
+
+A filter combines, all of them optional:
+    settings_file   one or more MetaData.Settings_file values
+    start_from      earliest MetaData.Start_Timestamp, a date or a date and time, inclusive
+    start_to        latest MetaData.Start_Timestamp, a date or a date and time, inclusive
+    age_min         lowest MetaData.Player_Age, inclusive
+    age_max         highest MetaData.Player_Age, inclusive
+    player_ids      MetaData.Player_Name values, the Player_ID column of the output
+"""
+import re
+import json
+import zlib
+import codecs
+import hashlib
+import logging
+import zipfile
+from datetime import date, datetime
+from dateutil import parser as date_parser
+from admissionControl import check_job_budget
+
+logger = logging.getLogger(__name__)
+
+FILTER_KEYS = ['settings_file', 'start_from', 'start_to', 'age_min', 'age_max', 'player_ids']
+HEAD_CHUNK_SIZE = 4096
+# A MetaData block longer than this is read together with the rest of the file
+MAX_HEAD_SIZE = 1024 * 1024
+
+_METADATA_START = re.compile(r'\s*\{\s*"MetaData"\s*:\s*')
+
+
+class MetadataFilterError(ValueError):
+    """Raised for an invalid filter or one that no session file of the upload matches."""
+
+
+def read_metadata(f, chunk_size=HEAD_CHUNK_SIZE):
+    """MetaData block of a session file opened in binary mode.
+
+    Only the leading chunks up to the end of the block are read and decoded. Files where MetaData is not the
+    first key are parsed in full. Returns None if the file has no MetaData object."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    text = decoder.decode(f.read(chunk_size))
+    match = _METADATA_START.match(text)
+    while match:
+        try:
+            metadata = json.JSONDecoder().raw_decode(text, match.end())[0]
+            return metadata if isinstance(metadata, dict) else None
+        except json.JSONDecodeError:
+            # The block continues past what was read
+            chunk = f.read(chunk_size)
+            if not chunk or len(text) > MAX_HEAD_SIZE:
+                break
+            text += decoder.decode(chunk)
+    data = json.loads(text + decoder.decode(f.read(), final=True))
+    metadata = data.get('MetaData') if isinstance(data, dict) else None
+    return metadata if isinstance(metadata, dict) else None
+
+
+def _parse_bound(value, name):
+    """A date for values like 2023-03-06, a datetime for values with a time."""
+    if isinstance(value, str):
+        try:
+            return date.fromisoformat(value) if len(value) == 10 else date_parser.isoparse(value)
+        except ValueError:
+            pass
+    raise MetadataFilterError(f"{name} must be an ISO date or date and time, got {value!r}")
+
+
+def _parse_age(value, name):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise MetadataFilterError(f"{name} must be a number, got {value!r}")
+
+
+def _parse_list(value, name):
+    """A list of strings from a list or a comma-separated string."""
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list) or not value:
+        raise MetadataFilterError(f"{name} must be a non-empty list or comma-separated string")
+    return [str(item).strip() for item in value]
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class MetadataFilter:
+    """Selects session files by their MetaData. Criteria that are None are not checked."""
+
+    def __init__(self, settings_files=None, start_from=None, start_to=None, age_min=None, age_max=None, player_ids=None):
+        self.settings_files = frozenset(settings_files) if settings_files is not None else None
+        self.start_from = start_from
+        self.start_to = start_to
+        self.age_min = age_min
+        self.age_max = age_max
+        self.player_ids = frozenset(player_ids) if player_ids is not None else None
+
+    def to_dict(self):
+        criteria = {
+            'settings_file': sorted(self.settings_files) if self.settings_files is not None else None,
+            'start_from': self.start_from.isoformat() if self.start_from is not None else None,
+            'start_to': self.start_to.isoformat() if self.start_to is not None else None,
+            'age_min': self.age_min,
+            'age_max': self.age_max,
+            'player_ids': sorted(self.player_ids) if self.player_ids is not None else None,
+        }
+        return {k: v for k, v in criteria.items() if v is not None}
+
+    @property
+    def key(self):
+        """Canonical form of the filter, for cache keys and ETags."""
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    @property
+    def digest(self):
+        """Short name of the filter for the files stored next to an upload."""
+        return hashlib.sha256(self.key.encode()).hexdigest()[:12]
+
+    def _start_matches(self, value):
+        try:
+            timestamp = date_parser.isoparse(value) if isinstance(value, str) else None
+        except (ValueError, OverflowError):
+            timestamp = None
+        if timestamp is None:
+            return False
+        for bound, after in ((self.start_from, True), (self.start_to, False)):
+            if bound is None:
+                continue
+            if isinstance(bound, datetime):
+                compared = timestamp
+                # A bound without an offset compares with the session's local time, and so does a session without one
+                if (bound.tzinfo is None) != (timestamp.tzinfo is None):
+                    compared, bound = timestamp.replace(tzinfo=None), bound.replace(tzinfo=None)
+            else:
+                compared = timestamp.date()
+            if (compared < bound) if after else (compared > bound):
+                return False
+        return True
+
+    def matches(self, metadata):
+        if not isinstance(metadata, dict):
+            return False
+        if self.settings_files is not None and metadata.get('Settings_file') not in self.settings_files:
+            return False
+        if self.player_ids is not None:
+            name = metadata.get('Player_Name')
+            if name is None or str(name) not in self.player_ids:
+                return False
+        if self.age_min is not None or self.age_max is not None:
+            age = _as_float(metadata.get('Player_Age'))
+            if age is None or (self.age_min is not None and age < self.age_min) or (self.age_max is not None and age > self.age_max):
+                return False
+        if (self.start_from is not None or self.start_to is not None) and not self._start_matches(metadata.get('Start_Timestamp')):
+            return False
+        return True
+
+    def select(self, members, open_member):
+        """The members whose MetaData matches, reading each through open_member, which returns a binary file.
+        Members whose MetaData cannot be read do not match."""
+        selected = []
+        for member in members:
+            check_job_budget()
+            try:
+                with open_member(member) as f:
+                    metadata = read_metadata(f)
+            except (OSError, ValueError, zipfile.BadZipFile, zlib.error) as e:
+                logger.warning(f"Skipping {member}, its MetaData could not be read: {e}")
+                continue
+            if self.matches(metadata):
+                selected.append(member)
+        logger.info(f"Metadata filter {self.key} selected {len(selected)} of {len(members)} session files")
+        return selected
+
+
+def parse_filter(options):
+    """MetadataFilter from a request's filter option, or None if no filter was given.
+
+    options is a dict with any of FILTER_KEYS, or the same as a JSON string."""
+    if not options:
+        return None
+    if isinstance(options, str):
+        try:
+            options = json.loads(options)
+        except ValueError:
+            raise MetadataFilterError("filter must be a JSON object")
+    if not isinstance(options, dict):
+        raise MetadataFilterError(f"filter must be an object with any of: {', '.join(FILTER_KEYS)}")
+    unknown = [key for key in options if key not in FILTER_KEYS]
+    if unknown:
+        raise MetadataFilterError(f"Unknown filter keys: {', '.join(unknown)}, expected any of: {', '.join(FILTER_KEYS)}")
+    options = {k: v for k, v in options.items() if v not in (None, '', [])}
+    if not options:
+        return None
+
+    start_from = _parse_bound(options['start_from'], 'start_from') if 'start_from' in options else None
+    start_to = _parse_bound(options['start_to'], 'start_to') if 'start_to' in options else None
+    age_min = _parse_age(options['age_min'], 'age_min') if 'age_min' in options else None
+    age_max = _parse_age(options['age_max'], 'age_max') if 'age_max' in options else None
+    if age_min is not None and age_max is not None and age_min > age_max:
+        raise MetadataFilterError(f"age_min {age_min:g} is above age_max {age_max:g}")
+    if start_from is not None and start_to is not None and type(start_from) is type(start_to) and start_from > start_to:
+        raise MetadataFilterError(f"start_from {start_from.isoformat()} is after start_to {start_to.isoformat()}")
+    return MetadataFilter(
+        settings_files=_parse_list(options['settings_file'], 'settings_file') if 'settings_file' in options else None,
+        start_from=start_from, start_to=start_to, age_min=age_min, age_max=age_max,
+        player_ids=_parse_list(options['player_ids'], 'player_ids') if 'player_ids' in options else None,
+    )
+
+
+def add_filter_arguments(parser):
+    """Adds the filter options to a command line parser, see filter_from_args."""
+    group = parser.add_argument_group('participant filter', 'keep only the session files whose MetaData matches')
+    group.add_argument('--settings-file', nargs='+', help='MetaData.Settings_file values to keep')
+    group.add_argument('--start-from', help='earliest Start_Timestamp, ISO date or date and time')
+    group.add_argument('--start-to', help='latest Start_Timestamp, ISO date or date and time')
+    group.add_argument('--age-min', type=float, help='lowest Player_Age')
+    group.add_argument('--age-max', type=float, help='highest Player_Age')
+    group.add_argument('--player-ids', nargs='+', help='Player_Name values to keep')
+
+
+def filter_from_args(parser, args):
+    """MetadataFilter of the options added by add_filter_arguments, or None. Invalid filters exit with a usage error."""
+    try:
+        return parse_filter({'settings_file': args.settings_file, 'start_from': args.start_from, 'start_to': args.start_to,
+                             'age_min': args.age_min, 'age_max': args.age_max, 'player_ids': args.player_ids})
+    except MetadataFilterError as e:
+        parser.error(str(e))
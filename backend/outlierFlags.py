@@ -0,0 +1,183 @@
+"""Cohort-wide outlier flags of the per-trial measures.
+
+Every trial column the averages are computed from (PI_*_{i}, PointingJudgement_AbsoluteError_{i}_Trial_{j} and
+PerspectiveErrorMeasure_{i}) is scored across all participants at once, either as a robust z-score,
+0.6745 (x - median) / MAD, or as the distance beyond the quartiles in IQR units. Values whose absolute score
+exceeds the threshold are flagged.
+"""
+import os
+import json
+import logging
+import warnings
+import numpy as np
+import pandas as pd
+from incrementalAverages import get_trial_columns
+
+logger = logging.getLogger(__name__)
+
+OUTLIER_METHODS = ['robust_z', 'iqr']
+DEFAULT_THRESHOLDS = {'robust_z': 3.5, 'iqr': 1.5}
+# Trial columns with fewer values than this are never flagged
+MIN_PARTICIPANTS = 5
+OUTLIER_PARAMETERS = ['count', 'median', 'scale', 'q1', 'q3']
+
+
+class OutlierOptionError(ValueError):
+    """Raised for an unknown outlier method or an invalid threshold."""
+
+
+def parse_outlier_options(options):
+    """(method, threshold, exclude) from a request's outliers option, or None if outliers were not requested.
+
+    options is True for the defaults or a dict with optional method, threshold and exclude keys."""
+    if not options:
+        return None
+    if options is True:
+        options = {}
+    if not isinstance(options, dict):
+        raise OutlierOptionError("outliers must be true or an object with method, threshold and exclude")
+    method = options.get('method', 'robust_z')
+    if method not in OUTLIER_METHODS:
+        raise OutlierOptionError(f"Unknown outlier method '{method}', expected one of: {', '.join(OUTLIER_METHODS)}")
+    threshold = options.get('threshold', DEFAULT_THRESHOLDS[method])
+    try:
+        threshold = float(threshold)
+    except (TypeError, ValueError):
+        raise OutlierOptionError(f"Invalid outlier threshold: {threshold}")
+    if not threshold > 0:
+        raise OutlierOptionError(f"Outlier threshold must be positive, got {threshold}")
+    return method, threshold, bool(options.get('exclude', False))
+
+
+def fit_outlier_parameters(values):
+    """Parameters of both scorers for every column of a (participants, trials) array: the number of values, the
+    median and robust scale of robust_z and the quartiles of iqr.
+
+    Where more than half of a column shares one value the MAD is zero, and the mean absolute deviation scaled by
+    1.2533 takes its place."""
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        # All-NaN columns
+        warnings.simplefilter('ignore', RuntimeWarning)
+        median = np.nanmedian(values, axis=0)
+        deviation = np.abs(values - median)
+        mad = np.nanmedian(deviation, axis=0)
+        mean_ad = np.nanmean(deviation, axis=0)
+        q1, q3 = np.nanpercentile(values, [25, 75], axis=0)
+    return {'count': np.isfinite(values).sum(axis=0).astype(float), 'median': median,
+            'scale': np.where(mad > 0, mad / 0.6745, mean_ad * 1.2533), 'q1': q1, 'q3': q3}
+
+
+def robust_z_scores(values, parameters=None):
+    """Robust z-score of every value of a (participants, trials) array against its trial column, or against the
+    fit_outlier_parameters of another set of rows. Columns without any spread score 0, missing values NaN."""
+    parameters = fit_outlier_parameters(values) if parameters is None else parameters
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scores = np.where(parameters['scale'] > 0, (values - parameters['median']) / parameters['scale'], 0.0)
+    scores[~np.isfinite(values)] = np.nan
+    return scores
+
+
+def iqr_scores(values, parameters=None):
+    """Distance of every value below the first or above the third quartile of its trial column, in IQR units.
+
+    Values between the quartiles score 0, values below are negative. In a column whose IQR is zero every
+    value outside the quartiles scores infinity."""
+    parameters = fit_outlier_parameters(values) if parameters is None else parameters
+    q1, q3 = parameters['q1'], parameters['q3']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        distance = np.where(values < q1, values - q1, np.where(values > q3, values - q3, 0.0))
+        iqr = q3 - q1
+        scores = np.where(distance == 0, 0.0, np.where(iqr > 0, distance / iqr, np.copysign(np.inf, distance)))
+    scores[~np.isfinite(values)] = np.nan
+    return scores
+
+
+def build_outlier_reference(columns, values):
+    """The fit_outlier_parameters of the trial columns of a whole cohort, as column -> parameter -> value.
+
+    values maps every column to its numeric array. Stored next to the summary table, so the rows of one page
+    are scored as they would be within the cohort without extracting it."""
+    parameters = fit_outlier_parameters(np.column_stack([values[col] for col in columns]) if columns else np.empty((0, 0)))
+    return {col: {name: float(parameters[name][i]) for name in OUTLIER_PARAMETERS} for i, col in enumerate(columns)}
+
+
+def write_outlier_reference(reference, path):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(reference, f)
+    os.replace(tmp_path, path)
+
+
+def read_outlier_reference(path):
+    """Reads an outlier reference stored by write_outlier_reference. Raises ValueError if the file does not hold one."""
+    with open(path) as f:
+        reference = json.load(f)
+    if not isinstance(reference, dict) or not all(isinstance(p, dict) and set(p) == set(OUTLIER_PARAMETERS) for p in reference.values()):
+        raise ValueError(f"Not an outlier reference: {path}")
+    return reference
+
+
+SCORERS = {'robust_z': robust_z_scores, 'iqr': iqr_scores}
+
+
+class OutlierFlags:
+    """Outlier scores and flags of every trial column of a wide table, for the whole cohort at once.
+
+    values optionally maps the trial columns to their numeric arrays, e.g. IncrementalAverages.raw_values, so
+    they are not converted again. With a reference from build_outlier_reference the rows of df are scored
+    against the cohort it was built from instead of against each other."""
+
+    def __init__(self, df, method='robust_z', threshold=None, min_participants=MIN_PARTICIPANTS, values=None, reference=None):
+        if method not in SCORERS:
+            raise OutlierOptionError(f"Unknown outlier method '{method}', expected one of: {', '.join(OUTLIER_METHODS)}")
+        self.method = method
+        self.threshold = DEFAULT_THRESHOLDS[method] if threshold is None else float(threshold)
+        self.columns = get_trial_columns(df.columns)
+        self.index = {col: i for i, col in enumerate(self.columns)}
+
+        if values is not None:
+            values = np.column_stack([values[col] for col in self.columns]) if self.columns else np.empty((len(df), 0))
+        else:
+            values = df[self.columns].apply(lambda x: pd.to_numeric(x, errors='coerce')).to_numpy(dtype=float).reshape(len(df), len(self.columns))
+        if reference is None:
+            parameters = fit_outlier_parameters(values)
+        else:
+            parameters = {name: np.array([reference[col][name] if col in reference else np.nan for col in self.columns], dtype=float)
+                          for name in OUTLIER_PARAMETERS}
+        self.scores = SCORERS[method](values, parameters)
+        self.scores[:, ~(parameters['count'] >= min_participants)] = np.nan
+        # NaN scores compare False, so missing values are never flagged
+        self.flags = np.abs(self.scores) > self.threshold
+        logger.info(f"Flagged {int(self.flags.sum())} of {int(np.isfinite(values).sum())} trial values in {len(self.columns)} columns "
+                    f"({method}, threshold {self.threshold})")
+
+    @property
+    def key(self):
+        return self.method, self.threshold
+
+    def excluded(self):
+        """Flags of the columns with at least one flagged value, as column -> boolean mask, for IncrementalAverages.set_exclusions."""
+        flagged = self.flags.any(axis=0)
+        return {col: self.flags[:, i] for i, col in enumerate(self.columns) if flagged[i]}
+
+    def flag_matrix(self, columns):
+        """Flags of the given columns as a (participants, columns) array, False for columns that are not scored."""
+        matrix = np.zeros((self.flags.shape[0], len(columns)), dtype=bool)
+        for position, col in enumerate(columns):
+            i = self.index.get(col)
+            if i is not None:
+                matrix[:, position] = self.flags[:, i]
+        return matrix
+
+    def add_columns(self, df):
+        """Returns df with Outlier_Count and Outlier_Trials, the number and names of each participant's flagged
+        trials among the columns of df."""
+        columns = [col for col in df.columns if col in self.index]
+        matrix = self.flag_matrix(columns)
+        names = np.array(columns, dtype=object)
+        return df.assign(Outlier_Count=matrix.sum(axis=1), Outlier_Trials=[';'.join(names[row]) for row in matrix])
+
+    def summary(self):
+        """Number of flagged participants of every trial column that has any."""
+        counts = self.flags.sum(axis=0)
+        return {col: int(counts[i]) for i, col in enumerate(self.columns) if counts[i]}
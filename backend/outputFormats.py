@@ -0,0 +1,173 @@
+"""Output formats of processed tables: CSV written by pandas or by Arrow's multithreaded writer, Parquet and Feather.
+
+The default CSV is written from the table as it is, like the output has always been. The Arrow writers get a
+typed table instead: object columns holding only numbers and empty cells become Int64 or float64 columns and
+all other object columns strings, so each format stores the same values. Identifier and text columns such as
+Player_ID are never converted, an ID like 069 is written as 069. With a float precision, float columns are
+rounded before writing. The Arrow formats need the optional pyarrow package.
+
+Example:
+    python outputFormats.py cohort.zip --format parquet --option all_trials --output cohort.parquet
+    python outputFormats.py cohort.zip --settings-file uSPACE --age-min 60 --start-from 2023-03-01 --output older.csv
+"""
+import io
+import os
+import argparse
+import logging
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:  # only the pandas CSV writer is available without pyarrow
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# format -> (file extension, mimetype, compressible over HTTP)
+OUTPUT_FORMATS = {
+    'csv': ('csv', 'text/csv', True),
+    'csv_arrow': ('csv', 'text/csv', True),
+    'parquet': ('parquet', 'application/vnd.apache.parquet', False),
+    'feather': ('feather', 'application/vnd.apache.arrow.file', False),
+}
+DEFAULT_FORMAT = 'csv'
+DEFAULT_COMPRESSION = {'parquet': 'zstd', 'feather': 'lz4'}
+# Kept as strings by prepare_frame even when every value looks like a number
+STRING_COLUMNS = frozenset(['Player_ID', 'Settings_file', 'SPACEStartTime', 'SPACEEndTime'])
+
+
+class OutputFormatError(ValueError):
+    """Raised for an unknown output format or one whose writer is not installed."""
+
+
+def available_formats():
+    return [fmt for fmt in OUTPUT_FORMATS if fmt == 'csv' or pyarrow is not None]
+
+
+def check_format(fmt):
+    if fmt not in OUTPUT_FORMATS:
+        raise OutputFormatError(f"Unknown output format '{fmt}', expected one of: {', '.join(OUTPUT_FORMATS)}")
+    if fmt not in available_formats():
+        raise OutputFormatError(f"Output format '{fmt}' needs the pyarrow package")
+    return fmt
+
+
+def output_filename(stem, fmt):
+    return f'{stem}.{OUTPUT_FORMATS[fmt][0]}'
+
+
+def _typed_column(col):
+    """Numeric version of an object column if all its non-empty cells are numbers, otherwise its string version."""
+    present = col.notna() & (col != '')
+    values = col[present]
+    kind = pd.api.types.infer_dtype(values, skipna=True)
+    if kind != 'boolean':
+        numeric = pd.to_numeric(values, errors='coerce')
+        if numeric.notna().all():
+            # Integers, also integers stored as strings, stay integers so they are not written as 1.0
+            integral = kind == 'integer' or (kind == 'string' and pd.api.types.is_integer_dtype(numeric.dtype))
+            if not integral and kind == 'string':
+                # to_numeric's fast parser can be off in the last digit, float() round-trips exactly
+                numeric = values.astype(object).map(float)
+            return numeric.reindex(col.index).astype('Int64' if integral and len(values) else 'float64')
+    return values.astype(str).reindex(col.index).astype('string')
+
+
+def prepare_frame(df, float_precision=None, typed=True):
+    """The table a writer gets: with typed, object columns typed by _typed_column except the STRING_COLUMNS,
+    which become strings, and with float_precision, rounded float values."""
+    columns = {}
+    for name in df.columns:
+        col = df[name]
+        if typed and (col.dtype == object or isinstance(col.dtype, pd.StringDtype)):
+            col = col.astype('string') if name in STRING_COLUMNS else _typed_column(col)
+        if float_precision is not None and pd.api.types.is_float_dtype(col.dtype):
+            col = col.round(float_precision)
+        elif float_precision is not None and col.dtype == object:
+            # Untyped columns mix numbers with empty cells, only their float values are rounded
+            col = col.map(lambda value: round(value, float_precision) if isinstance(value, float) else value)
+        columns[name] = col
+    return pd.DataFrame(columns, index=df.index).reset_index(drop=True)
+
+
+def write_frame(df, target, fmt=DEFAULT_FORMAT, compression=None, float_precision=None):
+    """Writes df to a path or binary file object in the given format."""
+    check_format(fmt)
+    if fmt == 'csv':
+        prepare_frame(df, float_precision, typed=False).to_csv(target, index=False)
+        return
+    frame = prepare_frame(df, float_precision)
+    table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+    if fmt == 'csv_arrow':
+        # Conversion to text runs in batches on Arrow's thread pool. Numbers are never quoted, string values always
+        pyarrow.csv.write_csv(table, target, pyarrow.csv.WriteOptions(quoting_style='needed'))
+    elif fmt == 'parquet':
+        pyarrow.parquet.write_table(table, target, compression=compression or DEFAULT_COMPRESSION['parquet'])
+    else:
+        pyarrow.feather.write_feather(table, target, compression=compression or DEFAULT_COMPRESSION['feather'])
+
+
+def frame_to_bytes(df, fmt=DEFAULT_FORMAT, compression=None, float_precision=None):
+    buffer = io.BytesIO()
+    write_frame(df, buffer, fmt, compression, float_precision)
+    return buffer.getvalue()
+
+
+def main(argv=None):
+    from datasetCache import get_valid_members
+    from sessionValidation import member_reader
+    from metadataFilter import add_filter_arguments, filter_from_args
+    from finalJSONtoCSV import JSONProcessor, get_column_headers, process_json_files, build_wide_table, build_summary_table
+    from longFormat import to_long_format
+    from incrementalAverages import IncrementalAverages
+    from outlierFlags import OUTLIER_METHODS, OutlierFlags
+
+    parser = argparse.ArgumentParser(description='Export the wide, summary or long table of an upload.')
+    parser.add_argument('file_path', help='zip or JSON session upload')
+    parser.add_argument('--format', choices=list(OUTPUT_FORMATS), default=DEFAULT_FORMAT)
+    parser.add_argument('--option', choices=['all_trials', 'summary', 'long'], default='all_trials')
+    parser.add_argument('--compression', help='Parquet/Feather codec, e.g. zstd, snappy, lz4 or uncompressed')
+    parser.add_argument('--float-precision', type=int, help='decimals float columns are rounded to')
+    parser.add_argument('--duplicate-policy', choices=['keep_first', 'keep_latest', 'error'], default='keep_first')
+    parser.add_argument('--output', help='output path, combined_output.<extension> by default')
+    parser.add_argument('--outliers', choices=OUTLIER_METHODS, help='flag outlier trials across the cohort with this method')
+    parser.add_argument('--outlier-threshold', type=float, help='absolute score above which a trial is flagged')
+    parser.add_argument('--exclude-outliers', action='store_true', help='leave flagged trials out of the Avg_* columns')
+    add_filter_arguments(parser)
+    args = parser.parse_args(argv)
+    metadata_filter = filter_from_args(parser, args)
+    check_format(args.format)
+    if args.outliers and args.option == 'summary':
+        parser.error('outlier flags need the trial columns and are not available for the summary table')
+
+    # Members are read straight from the upload, nothing is written next to it
+    members, trial_counts = get_valid_members(args.file_path, args.duplicate_policy, metadata_filter)
+    headers = get_column_headers(*trial_counts)
+    with member_reader(args.file_path) as read:
+        data = process_json_files(members, JSONProcessor(*trial_counts), read)
+
+    if args.option == 'summary':
+        df = build_summary_table(data, headers)
+    else:
+        df = build_wide_table(data, headers)
+        outliers = OutlierFlags(df, args.outliers, args.outlier_threshold) if args.outliers else None
+        if outliers is not None and args.exclude_outliers:
+            IncrementalAverages(df, trial_counts[2]).set_exclusions(outliers.excluded(), outliers.key)
+        if args.option == 'long':
+            df = to_long_format(df, outliers=outliers)
+        elif outliers is not None:
+            df = outliers.add_columns(df)
+    output = args.output or output_filename('combined_output', args.format)
+    write_frame(df, output, args.format, args.compression, args.float_precision)
+    logger.info(f"Wrote {df.shape[0]} rows x {df.shape[1]} columns as {args.format} to: {output} ({os.path.getsize(output)} bytes)")
+    return output
+
+
+if __name__ == "__main__":
+    # Extraction logs every file at INFO, only this module's progress is shown
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+    main()
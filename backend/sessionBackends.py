@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import secrets
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+logger = logging.getLogger(__name__)
+
+
+class LRUSessionStore:
+    """In-process session store with a bounded number of entries and a sliding time-to-live."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid, ttl):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            data, expires = entry
+            if expires < now:
+                del self._entries[sid]
+                return None
+            self._entries[sid] = (data, now + ttl)
+            self._entries.move_to_end(sid)
+            return dict(data)
+
+    def set(self, sid, data, ttl):
+        with self._lock:
+            self._entries[sid] = (dict(data), time.monotonic() + ttl)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+
+class SQLiteSessionStore:
+    """Session store in a single SQLite database in WAL mode, shared by all workers on a host."""
+
+    PURGE_EVERY = 100
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # A connection inherited from the preloading master is never used after fork
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, sid, ttl):
+        conn = self._connect()
+        row = conn.execute("SELECT data, expires FROM sessions WHERE sid = ?", (sid,)).fetchone()
+        now = time.time()
+        if row is None or row[1] < now:
+            return None
+        # Slide the expiry, but write at most once per half lifetime
+        if row[1] - now < ttl / 2:
+            conn.execute("UPDATE sessions SET expires = ? WHERE sid = ?", (now + ttl, sid))
+        return json.loads(row[0])
+
+    def set(self, sid, data, ttl):
+        conn = self._connect()
+        conn.execute("INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)", (sid, json.dumps(data), time.time() + ttl))
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            # Expired sessions are removed here so the table does not grow without bound
+            conn.execute("DELETE FROM sessions WHERE expires < ?", (time.time(),))
+
+    def delete(self, sid):
+        self._connect().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class StoreSessionInterface(SessionInterface):
+    """Keeps only a random session id in the cookie and the session data in a store.
+
+    Nothing is read or written for requests that do not send a session cookie or do not modify the session."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def _ttl(self, app):
+        return app.permanent_session_lifetime.total_seconds()
+
+    def should_set_cookie(self, app, session):
+        return session.modified or app.config['SESSION_REFRESH_EACH_REQUEST']
+
+    def get_expiration_time(self, app, session):
+        if app.config.get('SESSION_PERMANENT', True):
+            return datetime.now(timezone.utc) + app.permanent_session_lifetime
+        return None
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.get(sid, self._ttl(app))
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified:
+            self.store.set(session.sid, dict(session), self._ttl(app))
+        elif not self.should_set_cookie(app, session):
+            return
+
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+
+def create_session_interface(app):
+    """Returns the session interface for app.config['SESSION_BACKEND'] ('sqlite' or 'memory')."""
+    backend = app.config.get('SESSION_BACKEND', 'sqlite')
+    if backend == 'memory':
+        store = LRUSessionStore(app.config.get('SESSION_MAX_ENTRIES', 10000))
+    elif backend == 'sqlite':
+        store = SQLiteSessionStore(app.config.get('SESSION_SQLITE_PATH', '/tmp/flask_session.sqlite3'))
+    else:
+        raise ValueError(f"Unknown session backend: {backend}")
+    logger.info(f"Using {backend} session backend")
+    return StoreSessionInterface(store)
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_POLICIES = ('keep_first', 'keep_latest', 'error')
+
+
+class DuplicateSessionError(Exception):
+    """Raised under the 'error' policy when an upload contains the same session more than once, or a session
+    of another upload."""
+
+    def __init__(self, duplicates):
+        self.duplicates = duplicates
+        super().__init__(f"Upload contains {len(duplicates)} duplicate session file(s)")
+
+
+def get_session_key(metadata):
+    """Identity of a recorded session, or None if the metadata is too sparse to tell sessions apart."""
+    session_id, player_name, start = (metadata.get(key) or '' for key in ('Session_ID', 'Player_Name', 'Start_Timestamp'))
+    if not start or not (session_id or player_name):
+        return None
+    return [str(session_id), str(player_name), str(start)]
+
+
+def find_duplicates(reports, policy='keep_first', member_times=None):
+    """Marks every usable report whose content hash or session key was already seen in the same upload.
+
+    Under 'keep_first' the first file in archive order is kept, under 'keep_latest' the one most recently
+    written into the archive. Under 'error' DuplicateSessionError is raised instead. Returns the dropped files."""
+    if policy not in DUPLICATE_POLICIES:
+        raise ValueError(f"Unknown duplicate policy: {policy}")
+    member_times = member_times or {}
+    groups = []
+    by_hash, by_key = {}, {}
+    for report in reports:
+        if not report['usable']:
+            continue
+        key = json.dumps(report['session_key']) if report['session_key'] else None
+        group = by_hash.get(report['content_hash'])
+        if group is None and key is not None:
+            group = by_key.get(key)
+        if group is None:
+            group = len(groups)
+            groups.append([])
+        groups[group].append(report)
+        by_hash.setdefault(report['content_hash'], group)
+        if key is not None:
+            by_key.setdefault(key, group)
+
+    dropped = []
+    for group in groups:
+        if len(group) < 2:
+            continue
+        if policy == 'keep_latest':
+            kept = max(enumerate(group), key=lambda item: (member_times.get(item[1]['file'], ()), item[0]))[1]
+        else:
+            kept = group[0]
+        for report in group:
+            if report is kept:
+                continue
+            report['duplicate_of'] = kept['file']
+            report['duplicate_reason'] = 'identical content' if report['content_hash'] == kept['content_hash'] else 'same session'
+            dropped.append({'file': report['file'], 'duplicate_of': kept['file'], 'reason': report['duplicate_reason']})
+
+    if dropped and policy == 'error':
+        raise DuplicateSessionError(dropped)
+    for entry in dropped:
+        logger.warning(f"Skipping duplicate session {entry['file']} ({entry['reason']} as {entry['duplicate_of']})")
+    return dropped
+
+
+class SessionIndex:
+    """Sessions of earlier uploads by content hash and session key, in a SQLite database shared by all workers."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions (upload_hash TEXT NOT NULL, upload_name TEXT NOT NULL, file TEXT NOT NULL, "
+                         "content_hash TEXT NOT NULL, session_key TEXT, seen REAL NOT NULL, PRIMARY KEY (upload_hash, file))")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_content_hash ON sessions (content_hash)")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_session_key ON sessions (session_key)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # A connection inherited from the preloading master is never used after fork
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def check_and_record(self, reports, upload_hash, upload_name, policy='keep_first'):
+        """Applies the duplicate policy to sessions that earlier or later uploads also contain, then records the upload.
+
+        Uploads are ordered by when they were first recorded. Under 'keep_first' a session of an earlier upload is
+        dropped from this one, under 'keep_latest' a session of a later upload is, and this upload supersedes the
+        earlier uploads that contain its sessions. Under 'error' DuplicateSessionError is raised and nothing is
+        recorded. Each usable report also lists the other uploads that contained it.
+
+        Returns the number of files that were seen before, the dropped files and the names of the superseded uploads."""
+        if policy not in DUPLICATE_POLICIES:
+            raise ValueError(f"Unknown duplicate policy: {policy}")
+        conn = self._connect()
+        first_seen = conn.execute("SELECT MIN(seen) FROM sessions WHERE upload_hash = ?", (upload_hash,)).fetchone()[0]
+        now = time.time()
+        order = first_seen if first_seen is not None else now
+        seen_before, dropped, superseded = 0, [], set()
+        for report in reports:
+            if not report['usable']:
+                continue
+            key = json.dumps(report['session_key']) if report['session_key'] else None
+            rows = conn.execute("SELECT DISTINCT upload_name, file, seen FROM sessions WHERE upload_hash != ? AND (content_hash = ? OR session_key = ?) "
+                                "ORDER BY seen", (upload_hash, report['content_hash'], key)).fetchall()
+            report['seen_in_uploads'] = [{'upload': upload, 'file': file} for upload, file, _ in rows]
+            seen_before += bool(rows)
+            if 'duplicate_of' in report or not rows:
+                continue
+            if policy == 'keep_latest':
+                later = [row for row in rows if row[2] > order]
+                kept = later[-1] if later else None
+                if first_seen is None:
+                    superseded.update(upload for upload, _, seen in rows if seen < order)
+            else:
+                earlier = [row for row in rows if row[2] < order]
+                kept = earlier[0] if earlier else None
+            if kept is not None:
+                report['duplicate_of'] = kept[1]
+                report['duplicate_upload'] = kept[0]
+                report['duplicate_reason'] = 'session of another upload'
+                dropped.append({'file': report['file'], 'duplicate_of': kept[1], 'upload': kept[0], 'reason': report['duplicate_reason']})
+
+        if dropped and policy == 'error':
+            raise DuplicateSessionError(dropped)
+        for entry in dropped:
+            logger.warning(f"Skipping session {entry['file']} of another upload ({entry['duplicate_of']} in {entry['upload']})")
+        # Every file of an upload is recorded with the time the upload was first recorded, validating it again
+        # or without a filter does not make it the latest
+        conn.execute("BEGIN")
+        conn.executemany("INSERT OR IGNORE INTO sessions (upload_hash, upload_name, file, content_hash, session_key, seen) VALUES (?, ?, ?, ?, ?, ?)",
+                         [(upload_hash, upload_name, r['file'], r['content_hash'], json.dumps(r['session_key']) if r['session_key'] else None, order)
+                          for r in reports if r['usable']])
+        conn.execute("COMMIT")
+        return seen_before, dropped, sorted(superseded)
+
+    def forget_upload(self, upload_name):
+        """Removes the sessions of an upload that was deleted or replaced, so they no longer count as seen.
+
+        Returns the names of the other uploads that share sessions with it, whose duplicates may have changed."""
+        conn = self._connect()
+        rows = conn.execute("SELECT DISTINCT other.upload_name FROM sessions AS forgotten JOIN sessions AS other "
+                            "ON other.upload_name != forgotten.upload_name AND (other.content_hash = forgotten.content_hash OR other.session_key = forgotten.session_key) "
+                            "WHERE forgotten.upload_name = ?", (upload_name,)).fetchall()
+        conn.execute("DELETE FROM sessions WHERE upload_name = ?", (upload_name,))
+        return [name for name, in rows]
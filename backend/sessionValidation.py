@@ -0,0 +1,286 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import zipfile
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from sessionIndex import find_duplicates, get_session_key
+from admissionControl import check_job_budget, ZipReader
+
+logger = logging.getLogger(__name__)
+
+QUARANTINE_FOLDER = 'quarantine'
+# Below this many files the process pool costs more than it saves
+MIN_PARALLEL_FILES = 8
+
+TRAINING_PHASES = ['phase1', 'phase2', 'phase3', 'phase5']
+SESSION_SECTIONS = ['PathIntegration', 'Egocentric', 'Mapping', 'Memory', 'PerspectiveTaking']
+TRIAL_COUNT_KEYS = ['PathIntegration', 'PointingJudgements', 'PointingTasks', 'PerspectiveTaking']
+
+_executor = None
+
+
+def get_validation_path(file_path, metadata_filter=None):
+    """The validation report of an upload is stored next to it, one per MetadataFilter."""
+    return file_path + (f'.{metadata_filter.digest}' if metadata_filter is not None else '') + '.validation.json'
+
+
+def _length(items):
+    """Number of entries up to the last non-empty one, like the trial-number regexes count them."""
+    if not isinstance(items, list):
+        return 0
+    for i in range(len(items), 0, -1):
+        if items[i - 1] not in ({}, []):
+            return i
+    return 0
+
+
+def _session_entries(sessions, name):
+    entries = sessions.get(name) if isinstance(sessions, dict) else None
+    return [entry for entry in entries if isinstance(entry, dict)] if isinstance(entries, list) else []
+
+
+def read_file(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+
+@contextmanager
+def member_reader(file_path):
+    """Yields a function returning the bytes of a session file of an upload by name: a member read straight from
+    a zip upload within the zip budget, see ZipReader, otherwise a file on disk."""
+    if file_path is not None and file_path.endswith('.zip'):
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            yield ZipReader(zip_ref).read
+    else:
+        yield read_file
+
+
+def validate_session(file_path, read=read_file):
+    """Checks the structure of one session file without extracting it, reading its bytes with read.
+
+    A file is unusable when it is not a JSON object or has neither MetaData.Player_Name nor any Sessions
+    section; missing phases, sections and trials only lower its completeness."""
+    report = {'file': file_path, 'player_name': None, 'usable': False, 'completeness': 0.0, 'missing': [], 'errors': [],
+              'trial_counts': dict.fromkeys(TRIAL_COUNT_KEYS, 0), 'content_hash': None, 'session_key': None}
+    try:
+        raw = read(file_path)
+        report['content_hash'] = hashlib.sha256(raw).hexdigest()
+        data = json.loads(raw)
+    except (OSError, zipfile.BadZipFile, UnicodeDecodeError, ValueError) as e:
+        report['errors'].append(f"Not a readable JSON file: {e}")
+        return report
+    if not isinstance(data, dict):
+        report['errors'].append("Top-level JSON value is not an object")
+        return report
+
+    checks = []
+
+    def check(name, present):
+        checks.append(present)
+        if not present:
+            report['missing'].append(name)
+
+    metadata = data.get('MetaData') if isinstance(data.get('MetaData'), dict) else {}
+    report['player_name'] = metadata.get('Player_Name')
+    report['session_key'] = get_session_key(metadata)
+    for key in ['Player_Name', 'Start_Timestamp', 'End_Timestamp']:
+        check(f'MetaData.{key}', metadata.get(key) not in (None, ''))
+
+    training = data.get('Training') if isinstance(data.get('Training'), dict) else {}
+    for phase in TRAINING_PHASES:
+        check(f'Training.{phase}', isinstance(training.get(phase), dict))
+    homing_trials = training.get('phase5', {}).get('Trials') if isinstance(training.get('phase5'), dict) else None
+    check('Training.phase5.Trials', _length(homing_trials) >= 2)
+
+    sessions = data.get('Sessions') if isinstance(data.get('Sessions'), dict) else {}
+    for section in SESSION_SECTIONS:
+        check(f'Sessions.{section}', bool(_session_entries(sessions, section)))
+
+    counts = report['trial_counts']
+    for entry in _session_entries(sessions, 'PathIntegration'):
+        counts['PathIntegration'] = max(counts['PathIntegration'], _length(entry.get('Trials')))
+    for entry in _session_entries(sessions, 'Egocentric'):
+        tasks = entry.get('PointingTasks')
+        counts['PointingTasks'] = max(counts['PointingTasks'], _length(tasks))
+        for task in tasks if isinstance(tasks, list) else []:
+            if isinstance(task, dict):
+                counts['PointingJudgements'] = max(counts['PointingJudgements'], _length(task.get('PointingJudgements')))
+    for entry in _session_entries(sessions, 'PerspectiveTaking'):
+        counts['PerspectiveTaking'] = max(counts['PerspectiveTaking'], _length(entry.get('Trials')))
+    for key in TRIAL_COUNT_KEYS:
+        check(f'{key} trials', counts[key] > 0)
+
+    report['usable'] = report['player_name'] not in (None, '') or bool(sessions)
+    if not report['usable']:
+        report['errors'].append("No MetaData.Player_Name and no Sessions")
+    report['completeness'] = round(sum(checks) / len(checks), 3)
+    return report
+
+
+def get_pool_context():
+    """Start method of the worker process pools. A child forked from a threaded gunicorn worker inherits the
+    locks other threads held at the fork (logging, imports, the allocator) and can hang on them, so pool
+    processes are started from a fork server, or spawned where there is none."""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=get_pool_context())
+    return _executor
+
+
+def validate_sessions(json_files):
+    """Validates files in parallel worker processes when there are enough of them to pay off."""
+    json_files = [f for f in json_files if "__MACOSX" not in f and not os.path.basename(f).startswith("._")]
+    if len(json_files) < MIN_PARALLEL_FILES or (os.cpu_count() or 1) < 2:
+        reports = map(validate_session, json_files)
+    else:
+        chunksize = max(1, len(json_files) // (4 * (os.cpu_count() or 1)))
+        reports = _get_executor().map(validate_session, json_files, chunksize=chunksize)
+    results = []
+    for report in reports:
+        check_job_budget()
+        results.append(report)
+    return results
+
+
+def validate_members(file_path, members):
+    """Validates session files read straight from an upload, see member_reader. Nothing is extracted or stored."""
+    with member_reader(file_path) as read:
+        results = []
+        for member in members:
+            check_job_budget()
+            results.append(validate_session(member, read))
+        return results
+
+
+def mark_short_sections(reports):
+    """Lists, per usable file, the trial arrays shorter than the longest one in the cohort."""
+    usable = [r for r in reports if r['usable']]
+    expected = {key: max((r['trial_counts'][key] for r in usable), default=0) for key in TRIAL_COUNT_KEYS}
+    for report in usable:
+        report['short_sections'] = [key for key in TRIAL_COUNT_KEYS if report['trial_counts'][key] < expected[key]]
+    return expected
+
+
+def quarantine_files(reports, file_path, upload_folder):
+    """Moves unusable files out of the upload folder into quarantine/<upload>/."""
+    quarantine_dir = os.path.join(upload_folder, QUARANTINE_FOLDER, os.path.basename(file_path))
+    shutil.rmtree(quarantine_dir, ignore_errors=True)
+    for report in reports:
+        if report['usable'] or report['file'] == file_path:
+            continue
+        target = os.path.join(quarantine_dir, os.path.relpath(report['file'], upload_folder))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.replace(report['file'], target)
+            report['quarantined_to'] = target
+        except OSError as e:
+            logger.error(f"Failed to quarantine {report['file']}: {e}")
+        logger.warning(f"Quarantined unusable file {report['file']}: {report['errors']}")
+
+
+def validate_upload(file_path, json_files, upload_folder, duplicate_policy='keep_first', member_times=None, session_index=None, upload_hash=None,
+                    metadata_filter=None, filtered_files=0):
+    """Validates the files of an upload, quarantines the unusable ones, skips duplicate sessions and stores the report.
+    Sessions of other uploads in the session index are skipped by the same duplicate policy.
+
+    Returns the report and the usable files, which are the only ones that should be extracted. With a
+    MetadataFilter, json_files are the files it selected and filtered_files the number it skipped."""
+    reports = validate_sessions(json_files)
+    quarantine_files(reports, file_path, upload_folder)
+    for report in reports:
+        report['file'] = os.path.relpath(report['file'], upload_folder)
+    duplicates = find_duplicates(reports, duplicate_policy, member_times)
+    seen_before = 0
+    if session_index is not None:
+        seen_before, other_duplicates, superseded = session_index.check_and_record(reports, upload_hash, os.path.basename(file_path), duplicate_policy)
+        duplicates += other_duplicates
+        for upload_name in superseded:
+            discard_validation(os.path.join(os.path.dirname(file_path), upload_name))
+    extracted = [r for r in reports if r['usable'] and 'duplicate_of' not in r]
+    expected = mark_short_sections(extracted)
+    validation = {
+        'total_files': len(reports),
+        'usable_files': sum(1 for r in reports if r['usable']),
+        'quarantined_files': sum(1 for r in reports if not r['usable']),
+        'duplicate_files': len(duplicates),
+        'previously_uploaded_files': seen_before,
+        'complete_files': sum(1 for r in extracted if r['completeness'] == 1.0 and not r['short_sections']),
+        'duplicate_policy': duplicate_policy,
+        'metadata_filter': metadata_filter.to_dict() if metadata_filter is not None else None,
+        'filtered_files': filtered_files,
+        'duplicates': duplicates,
+        'trial_counts': expected,
+        'files': reports,
+    }
+    try:
+        save_validation(file_path, metadata_filter, json.dumps(validation, indent=2))
+    except OSError as e:
+        logger.error(f"Error saving validation report: {e}")
+    logger.info(f"Validated {validation['total_files']} files ({filtered_files} filtered out): {validation['usable_files']} usable, "
+                f"{validation['quarantined_files']} quarantined, {validation['duplicate_files']} duplicates, {validation['complete_files']} complete")
+    return validation, [os.path.join(upload_folder, r['file']) for r in extracted]
+
+
+def save_validation(file_path, metadata_filter, report):
+    """Stores a validation report unless the current one is the same, so validation_version only changes
+    when the report does."""
+    validation_path = get_validation_path(file_path, metadata_filter)
+    if validation_version(file_path, metadata_filter) is not None:
+        with open(validation_path) as f:
+            if f.read() == report:
+                return
+    with open(validation_path, 'w') as f:
+        f.write(report)
+
+
+def discard_validation(file_path):
+    """Deletes the stored validation reports of an upload for every filter, so it is validated again."""
+    folder, filename = os.path.split(file_path)
+    for name in os.listdir(folder or '.'):
+        if name.startswith(filename + '.') and name.endswith('.validation.json'):
+            try:
+                os.remove(os.path.join(folder, name))
+                logger.info(f"Discarded validation report {name}")
+            except FileNotFoundError:
+                pass
+
+
+def load_validation(file_path, metadata_filter=None):
+    """Returns the stored validation report of an upload, or None if it is missing or older than the upload."""
+    validation_path = get_validation_path(file_path, metadata_filter)
+    if os.path.exists(validation_path) and os.path.getmtime(validation_path) >= os.path.getmtime(file_path):
+        with open(validation_path) as f:
+            return json.load(f)
+    return None
+
+
+def validation_version(file_path, metadata_filter=None):
+    """Modification time and size of the stored validation report, or None when load_validation would not use it.
+
+    The report changes when validation runs again, for another duplicate policy or with other sessions already
+    in the session index, so responses that embed it include this in their ETag."""
+    try:
+        stat = os.stat(get_validation_path(file_path, metadata_filter))
+    except OSError:
+        return None
+    if stat.st_mtime < os.path.getmtime(file_path):
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def validation_summary(validation):
+    """The counts of a validation report and the files that were quarantined, without the per-file details."""
+    if validation is None:
+        return None
+    summary = {k: v for k, v in validation.items() if k != 'files'}
+    summary['quarantined'] = [{'file': r['file'], 'errors': r['errors']} for r in validation['files'] if not r['usable']]
+    return summary
@@ -0,0 +1,87 @@
+import io
+import json
+import random
+import zipfile
+from datetime import datetime, timedelta, timezone
+
+LANDMARK_POSITIONS = {
+    "Nest": (0, 6), "Cave": (-6, 6), "Arch": (-6, 0), "Tree": (0, -3), "Volcano": (6, 0), "Waterfall": (6, 6)
+}
+
+
+def _timestamp(t):
+    return t.strftime("%Y-%m-%dT%H:%M:%S.%f0+00:00")
+
+
+def make_synthetic_session(rng=None, player_name="SYN000", num_pi=13, num_pointing_tasks=6, num_judgements=5, num_pt=13):
+    """Builds a session document with the structure of a SPACE export, filled with random but plausible values."""
+    rng = rng or random.Random(0)
+    start = datetime(2024, 1, 1, 9, 0, tzinfo=timezone.utc) + timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+
+    def pi_trial(i):
+        angle = rng.uniform(-180, 180)
+        return {"ID": f"T{i + 1}", "Data": {
+            "totalDistance": rng.uniform(300, 900), "totalTime": rng.uniform(20, 90),
+            "PIDistance": rng.uniform(0, 400), "PIAngle": angle, "PIDistanceRatio": rng.uniform(0, 2),
+            "CorrectedPIAngle": angle, "FinalPIAngle": abs(angle),
+        }}
+
+    def judgement(target):
+        correct = rng.choice([-135, -90, -45, 0, 45, 90, 135, 180])
+        error = rng.uniform(0, 180)
+        return {"Pointing_from_ID": "Rocket", "Pointing_to_ID": target, "Correct_Angle": correct,
+                "Estimated_Angle": correct + error, "Raw_Error": error, "Absolute_Error": error}
+
+    def pt_trial(i):
+        correct = rng.choice([-135, -90, -45, 0, 45, 90, 135, 180])
+        final = correct + rng.gauss(0, 30)
+        return {"TrialId": i, "TotalTime": rng.uniform(10, 60), "TotalIdleTime": rng.uniform(5, 40),
+                "FinalAngle": final, "CorrectAngle": correct, "DifferenceAngle": final - correct,
+                "ErrorMeasure": abs(final - correct)}
+
+    landmarks = list(LANDMARK_POSITIONS)
+    return {
+        "MetaData": {
+            "Player_Name": player_name, "Player_Age": str(rng.randint(18, 80)),
+            "Session_ID": "".join(rng.choice("0123456789ABCDEF") for _ in range(21)), "Settings_file": "uSPACE",
+            "Start_Timestamp": _timestamp(start), "End_Timestamp": _timestamp(start + timedelta(minutes=rng.randint(40, 90))),
+            "Scale_Coordinate_System": "1:50",
+        },
+        "Landmarks": {"Coordinates": {name: {"id": i, "X": str(x), "Y": str(y)} for i, (name, (x, y)) in enumerate(LANDMARK_POSITIONS.items())}},
+        "Training": {
+            "phase1": {"Phase": "Rotation", "totalTime": rng.uniform(20, 40)},
+            "phase2": {"Phase": "Movement", "totalTime": rng.uniform(30, 60)},
+            "phase3": {"Phase": "Circuit", "totalTime": rng.uniform(60, 120)},
+            "phase5": {"Trials": [{"Data": {"totalTime": rng.uniform(10, 40)}} for _ in range(2)]},
+        },
+        "Sessions": {
+            "PathIntegration": [{"Trials": [pi_trial(i) for i in range(num_pi)]}],
+            "Egocentric": [{"PointingTasks": [{"Sequence": "Rocket", "PointingJudgements": [judgement(rng.choice(landmarks)) for _ in range(num_judgements)]}
+                                              for _ in range(num_pointing_tasks)]}],
+            "Mapping": [{
+                "StartTimeStamp": _timestamp(start + timedelta(minutes=30)), "EndTimeStamp": _timestamp(start + timedelta(minutes=32)),
+                "TotalTime": rng.uniform(60, 120),
+                "EstimatedCoordinates": {name: {"X": str(x * 2 + rng.gauss(0, 3)), "Y": str(y * 2 + rng.gauss(0, 3))} for name, (x, y) in LANDMARK_POSITIONS.items()},
+                "BidimensionalRegression": {"Euclidean": {"R2": rng.uniform(0, 1)}},
+            }],
+            "Memory": [{
+                "StartTimeStamp": _timestamp(start + timedelta(minutes=33)), "EndTimeStamp": _timestamp(start + timedelta(minutes=35)),
+                "TotalTime": rng.uniform(60, 120), "PercentCorrect": rng.choice([0, 20, 40, 60, 80, 100]),
+            }],
+            "PerspectiveTaking": [{
+                "NumberOfTrials": num_pt, "TotalIdleTime": rng.uniform(100, 300), "TotalTime": rng.uniform(300, 600),
+                "AverageErrorMeasure": rng.uniform(0, 60), "Trials": [pt_trial(i) for i in range(num_pt)],
+            }],
+        },
+    }
+
+
+def make_synthetic_zip(num_participants, seed=0, **trial_counts):
+    """Returns the bytes of a cohort zip with one synthetic session file per participant."""
+    rng = random.Random(seed)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for i in range(num_participants):
+            session = make_synthetic_session(rng, player_name=f"SYN{i:03d}", **trial_counts)
+            zip_ref.writestr(f"SYN{i:03d}.json", json.dumps(session))
+    return buffer.getvalue()
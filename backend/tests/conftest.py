@@ -0,0 +1,38 @@
+import io
+import os
+import sys
+import importlib
+import pytest
+
+# The backend modules import each other by their flat names
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def flask_app(tmp_path_factory):
+    """The Flask app, imported once with in-memory sessions, its session index in a temporary folder and without warm-up."""
+    os.environ['SESSION_BACKEND'] = 'memory'
+    os.environ['SESSION_INDEX_PATH'] = str(tmp_path_factory.mktemp('index') / 'session_index.sqlite3')
+    os.environ['WARM_UP'] = '0'
+    os.chdir(tmp_path_factory.mktemp('app'))
+    return importlib.import_module('app').app
+
+
+@pytest.fixture
+def client(flask_app, tmp_path, monkeypatch):
+    """A test client working in a fresh folder: uploads/ relative to it and downloads/ inside it."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(flask_app.config['UPLOAD_FOLDER'])
+    monkeypatch.setitem(flask_app.config, 'DOWNLOAD_FOLDER', str(tmp_path / 'downloads'))
+    with flask_app.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def upload(client):
+    """Uploads a synthetic cohort of 8 participants and returns its path."""
+    from syntheticSession import make_synthetic_zip
+    response = client.post('/api/upload', data={'file': (io.BytesIO(make_synthetic_zip(8, seed=1)), 'cohort.zip')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    return response.get_json()['file_path']
@@ -0,0 +1,123 @@
+import io
+import sys
+import zipfile
+import pytest
+from flask import Flask, request
+import pickle
+import struct
+from admissionControl import AdmissionController, ResourceLimitError, ZipReader, check_zip_budget, extract_zip, zip_limits
+
+
+def make_app(controller):
+    app = Flask(__name__)
+
+    @app.route('/job')
+    @controller.heavy
+    def job():
+        if request.args.get('cached'):
+            return 'not modified'
+        controller.start_job()
+        return 'done'
+    return app
+
+
+def test_rejections_answer_503_with_retry_after():
+    controller = AdmissionController(max_concurrent=1, max_queued=0, queue_timeout=0.05)
+    client = make_app(controller).test_client()
+    with controller.admit('running'):
+        response = client.get('/job')
+        assert response.status_code == 503 and response.get_json()['limit'] == 'queue_full'
+        assert response.headers['Retry-After'] == '1'
+        # Answered before the view takes a slot
+        assert client.get('/job', query_string={'cached': 1}).data == b'not modified'
+
+        controller.max_queued = 1
+        response = client.get('/job')
+        assert response.status_code == 503 and response.get_json()['limit'] == 'queue_timeout'
+        assert response.headers['Retry-After'] == '1'
+    assert client.get('/job').data == b'done'
+    metrics = controller.metrics()
+    assert metrics['active'] == 0 and metrics['completed'] == 2
+
+
+def make_zip(members, size):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for i in range(members):
+            zip_ref.writestr(f'member_{i}.json', b'0' * size)
+    return zipfile.ZipFile(buffer)
+
+
+def test_zip_budget(monkeypatch):
+    monkeypatch.setitem(zip_limits, 'max_members', 3)
+    monkeypatch.setitem(zip_limits, 'max_bytes', 3000)
+    assert check_zip_budget(make_zip(3, 1000)) == 3000
+    for zip_ref, limit in ((make_zip(4, 10), 'zip_members'), (make_zip(2, 1501), 'zip_bytes')):
+        with pytest.raises(ResourceLimitError) as e:
+            check_zip_budget(zip_ref)
+        assert e.value.limit == limit and e.value.status == 413
+
+
+def understate_sizes(zip_ref):
+    """The zip with every member's decompressed size in the central directory set to 1."""
+    data = bytearray(zip_ref.fp.getvalue())
+    offset = data.find(b'PK\x01\x02')
+    while offset != -1:
+        data[offset + 24:offset + 28] = struct.pack('<I', 1)
+        offset = data.find(b'PK\x01\x02', offset + 4)
+    return zipfile.ZipFile(io.BytesIO(bytes(data)))
+
+
+def test_zip_budget_holds_while_decompressing(tmp_path, monkeypatch):
+    monkeypatch.setitem(zip_limits, 'max_member_bytes', 1500)
+    monkeypatch.setitem(zip_limits, 'max_bytes', 2500)
+    monkeypatch.setattr(sys.modules['admissionControl'], 'ZIP_READ_CHUNK', 100)
+    assert ZipReader(make_zip(1, 1500)).read('member_0.json') == b'0' * 1500
+    with pytest.raises(ResourceLimitError) as e:
+        ZipReader(make_zip(1, 1501)).read('member_0.json')
+    assert e.value.limit == 'zip_member_bytes'
+
+    reader = ZipReader(make_zip(2, 1300))
+    reader.read('member_0.json')
+    with pytest.raises(ResourceLimitError) as e:
+        reader.read('member_1.json')
+    assert e.value.limit == 'zip_bytes'
+
+    # Sizes the central directory understates do not get the members past the budget, and nothing is left behind
+    zip_ref = understate_sizes(make_zip(2, 1300))
+    assert check_zip_budget(zip_ref) == 2
+    with pytest.raises((ResourceLimitError, zipfile.BadZipFile)):
+        extract_zip(zip_ref, str(tmp_path))
+    assert sum(path.stat().st_size for path in tmp_path.rglob('*') if path.is_file()) <= 1300
+
+
+def test_limit_errors_survive_pickling():
+    error = pickle.loads(pickle.dumps(ResourceLimitError('zip_bytes', 'too big', 413)))
+    assert (error.limit, str(error), error.status) == ('zip_bytes', 'too big', 413)
+
+
+def test_over_budget_upload_is_rejected(client, monkeypatch):
+    from syntheticSession import make_synthetic_zip
+    monkeypatch.setitem(zip_limits, 'max_members', 4)
+    response = client.post('/api/upload', data={'file': (io.BytesIO(make_synthetic_zip(8, seed=1)), 'cohort.zip')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 413 and response.get_json()['limit'] == 'zip_members'
+
+
+def test_revalidation_does_not_wait_for_a_slot(client, upload, monkeypatch):
+    admission = sys.modules['app'].admission
+    etag = client.get('/api/columns', query_string={'file_path': upload}).headers['ETag']
+    monkeypatch.setattr(admission, 'max_queued', 0)
+    with admission.admit('first'), admission.admit('second'):
+        assert client.get('/api/columns', query_string={'file_path': upload}, headers={'If-None-Match': etag}).status_code == 304
+        assert client.get('/api/columns', query_string={'file_path': 'missing.zip'}).status_code == 400
+        assert client.get('/api/columns', query_string={'file_path': upload}).status_code == 503
+
+
+def test_members_read_from_an_upload_stay_within_the_budget(tmp_path, monkeypatch):
+    from sessionValidation import member_reader
+    monkeypatch.setitem(zip_limits, 'max_member_bytes', 1000)
+    upload = tmp_path / 'cohort.zip'
+    upload.write_bytes(make_zip(1, 1001).fp.getvalue())
+    with member_reader(str(upload)) as read, pytest.raises(ResourceLimitError):
+        read('member_0.json')
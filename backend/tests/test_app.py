@@ -0,0 +1,176 @@
+import io
+import os
+import sys
+import zipfile
+import threading
+import pandas as pd
+import pytest
+
+PI_COLUMNS = ['Player_ID', 'PI_Distance_0', 'PI_Distance_1', 'Avg_PI_Distance']
+
+
+def read_export(response):
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert response.mimetype == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zip_ref:
+        return {name: pd.read_csv(zip_ref.open(name), dtype={'Player_ID': str}) for name in zip_ref.namelist()}
+
+
+def test_export_builds_every_selection(client, upload):
+    response = client.post('/api/export', json={'file_path': upload, 'exports': [
+        {'name': 'pi', 'columns': PI_COLUMNS}, {'name': 'summary', 'option': 'summary', 'columns': ['Player_ID', 'MapRSq']},
+        {'name': 'pi', 'columns': ['Player_ID', 'PI_Distance_0']}]})
+    tables = read_export(response)
+    assert sorted(tables) == ['pi.csv', 'pi_2.csv', 'summary.csv']
+    assert tables['pi.csv'].shape == (8, 4) and list(tables['summary.csv'].columns) == ['Player_ID', 'MapRSq']
+    assert os.listdir(client.application.config['DOWNLOAD_FOLDER']) == ['combined_export.zip']
+
+
+def test_failed_export_leaves_no_archive_behind(client, upload):
+    response = client.post('/api/export', json={'file_path': upload, 'exports': [
+        {'name': 'ok', 'columns': PI_COLUMNS}, {'name': 'bad', 'columns': ['NoSuchColumn']}]})
+    assert response.status_code == 400 and 'bad' in response.get_json()['error']
+    assert os.listdir(client.application.config['DOWNLOAD_FOLDER']) == []
+
+
+def test_export_rejects_invalid_requests(client, upload):
+    assert client.post('/api/export', json={'file_path': upload, 'exports': []}).status_code == 400
+    assert client.post('/api/export', json={'file_path': upload, 'format': 'xlsx', 'exports': [{'columns': PI_COLUMNS}]}).status_code == 400
+    assert client.post('/api/export', json={'file_path': 'missing.zip', 'exports': [{'columns': PI_COLUMNS}]}).status_code == 400
+
+
+def test_concurrent_exports_get_their_own_archive(flask_app, client, upload):
+    selections = {f'sel{i}': PI_COLUMNS[:2 + i % 3] for i in range(4)}
+    results = {}
+
+    def export(name):
+        with flask_app.test_client() as own_client:
+            results[name] = read_export(own_client.post('/api/export', json={'file_path': upload, 'exports': [{'name': name, 'columns': selections[name]}]}))
+
+    threads = [threading.Thread(target=export, args=(name,)) for name in selections]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for name, columns in selections.items():
+        assert list(results[name]) == [f'{name}.csv']
+        assert list(results[name][f'{name}.csv'].columns) == columns
+    assert os.listdir(flask_app.config['DOWNLOAD_FOLDER']) == ['combined_export.zip']
+
+
+def test_long_output_keeps_the_selected_averages(client, upload):
+    columns = ['Player_ID', 'PI_Distance_0', 'PI_Distance_2', 'Avg_PI_Distance', 'MapRSq']
+    response = client.post('/api/process', json={'file_path': upload, 'option': 'long', 'columns': columns})
+    assert response.status_code == 200
+    long_df = pd.read_csv(io.BytesIO(response.data))
+    assert list(long_df.columns[-2:]) == ['Avg_PI_Distance', 'MapRSq']
+    # The averages are those of the selected trials, as in the wide output
+    by_participant = long_df.groupby('Participant')
+    assert (by_participant['Value'].mean() - by_participant['Avg_PI_Distance'].first()).abs().max() < 1e-9
+
+
+def test_columns_etag_follows_the_validation_report(flask_app, client, upload, monkeypatch):
+    first = client.get('/api/columns', query_string={'file_path': upload})
+    assert first.status_code == 200 and first.get_json()['validation']['duplicate_policy'] == 'keep_first'
+    etag = first.headers['ETag'].strip('"')
+    assert client.get('/api/columns', query_string={'file_path': upload}, headers={'If-None-Match': f'"{etag}"'}).status_code == 304
+
+    # Another duplicate policy validates again and writes another report, the cached body no longer applies
+    monkeypatch.setitem(flask_app.config, 'DUPLICATE_POLICY', 'keep_latest')
+    second = client.get('/api/columns', query_string={'file_path': upload}, headers={'If-None-Match': f'"{etag}"'})
+    assert second.status_code == 200 and second.get_json()['validation']['duplicate_policy'] == 'keep_latest'
+    assert second.headers['ETag'].strip('"') != etag
+
+
+
+def test_process_and_statistics_etags_follow_the_duplicate_policy(flask_app, client, upload, monkeypatch):
+    requests = [('/api/process', {'file_path': upload, 'columns': PI_COLUMNS}), ('/api/statistics', {'file_path': upload, 'columns': ['MapRSq']})]
+    etags = [client.post(url, json=body).headers['ETag'] for url, body in requests]
+    for (url, body), etag in zip(requests, etags):
+        assert client.post(url, json=body, headers={'If-None-Match': etag}).status_code == 304
+
+    monkeypatch.setitem(flask_app.config, 'DUPLICATE_POLICY', 'keep_latest')
+    for (url, body), etag in zip(requests, etags):
+        response = client.post(url, json=body, headers={'If-None-Match': etag})
+        assert response.status_code == 200 and response.headers['ETag'] != etag
+
+def preview(client, upload, **options):
+    response = client.post('/api/preview', json={'file_path': upload, 'offset': 0, 'limit': 50, **options})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    page = response.get_json()
+    return page['total'], pd.DataFrame(page['rows'], columns=page['columns'])
+
+
+def test_summary_preview_of_a_cached_dataset_averages_all_trials(client, upload):
+    summary_columns = ['Player_ID', 'Avg_PI_Distance', 'MapRSq']
+    _, expected = preview(client, upload, option='summary', columns=summary_columns)
+    # Caches the wide table with its Avg_* columns set to the average of trial 0 only
+    assert client.post('/api/process', json={'file_path': upload, 'columns': ['Player_ID', 'PI_Distance_0', 'Avg_PI_Distance']}).status_code == 200
+    # Without the stored summary the page is built from the cached wide table
+    os.remove(upload + '.summary.json')
+    total, page = preview(client, upload, option='summary', columns=summary_columns)
+    assert total == 8
+    pd.testing.assert_frame_equal(page, expected)
+
+
+def test_preview_applies_the_filter_and_the_outlier_options(client, upload):
+    total, page = preview(client, upload, columns=PI_COLUMNS, filter={'player_ids': ['SYN001', 'SYN003']})
+    assert total == 2 and sorted(page['Player_ID']) == ['SYN001', 'SYN003']
+
+    options = {'columns': PI_COLUMNS, 'outliers': {'method': 'robust_z', 'threshold': 1.0, 'exclude': True}}
+    processed = pd.read_csv(io.BytesIO(client.post('/api/process', json={'file_path': upload, **options}).data),
+                            dtype={'Player_ID': str}).fillna({'Outlier_Trials': ''})
+    total, page = preview(client, upload, **options)
+    assert total == 8 and page['Outlier_Count'].sum() > 0
+    pd.testing.assert_frame_equal(page, processed, check_dtype=False)
+
+
+
+def test_preview_pages_without_building_the_dataset(client, upload, monkeypatch):
+    app_module = sys.modules['app']
+    load_dataset = app_module.load_dataset
+    monkeypatch.setattr(app_module, 'load_dataset', lambda *args, **kwargs: pytest.fail('dataset built'))
+    total, page = preview(client, upload, columns=PI_COLUMNS, filter={'player_ids': ['SYN001', 'SYN003', 'SYN004']})
+    assert total == 3 and sorted(page['Player_ID']) == ['SYN001', 'SYN003', 'SYN004']
+    options = {'columns': PI_COLUMNS, 'outliers': {'method': 'robust_z', 'threshold': 1.0, 'exclude': True}}
+    total, paged = preview(client, upload, **options)
+    assert total == 8 and paged['Outlier_Count'].sum() > 0
+
+    monkeypatch.setattr(app_module, 'load_dataset', load_dataset)
+    processed = pd.read_csv(io.BytesIO(client.post('/api/process', json={'file_path': upload, **options}).data),
+                            dtype={'Player_ID': str}).fillna({'Outlier_Trials': ''})
+    pd.testing.assert_frame_equal(paged, processed, check_dtype=False)
+
+def test_preview_rejects_invalid_options(client, upload):
+    for options in ({'filter': {'age': 30}}, {'outliers': {'method': 'none'}}, {'option': 'summary', 'outliers': True},
+                    {'filter': {'player_ids': ['nobody']}}):
+        response = client.post('/api/preview', json={'file_path': upload, 'columns': PI_COLUMNS, **options})
+        assert response.status_code == 400, options
+
+
+def test_statistics_of_the_filtered_participants(client, upload):
+    request = {'file_path': upload, 'columns': ['MapRSq'], 'filter': {'player_ids': ['SYN001', 'SYN003', 'SYN005']}}
+    streamed = client.post('/api/statistics', json=request)
+    assert streamed.status_code == 200 and streamed.get_json()['participants'] == 3
+    assert client.post('/api/statistics', json={**request, 'filter': None}).get_json()['participants'] == 8
+    # From the cached dataset of the same filter
+    preview(client, upload, columns=PI_COLUMNS, filter=request['filter'])
+    cached = client.post('/api/statistics', json=request)
+    assert cached.get_json()['participants'] == 3 and cached.headers['ETag'] == streamed.headers['ETag']
+    assert client.post('/api/statistics', json={**request, 'filter': {'age': 3}}).status_code == 400
+
+
+def test_column_groups_are_cleaned_once_per_dataset(flask_app, client, upload, monkeypatch):
+    app_module = sys.modules['app']
+    calls = []
+    clean = app_module.clean_column_groups
+    monkeypatch.setattr(app_module, 'clean_column_groups', lambda group, df: calls.append(len(df)) or clean(group, df))
+    for columns in (PI_COLUMNS, ['Player_ID', 'PI_Distance_2', 'Avg_PI_Distance'], PI_COLUMNS):
+        assert client.post('/api/process', json={'file_path': upload, 'columns': columns}).status_code == 200
+    assert calls == [8, 8]
+
+
+def test_summary_is_built_at_upload_and_no_csv_is_written(client, upload):
+    assert os.path.exists(upload + '.summary.json')
+    assert client.post('/api/process', json={'file_path': upload, 'columns': PI_COLUMNS}).status_code == 200
+    assert not [name for name in os.listdir('.') if name.endswith(('.csv', '.zip'))]
@@ -0,0 +1,93 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from bidimensionalRegression import stack_landmark_coordinates, add_start_position, fit_euclidean, fit_affine, add_bidimensional_regression
+
+SESSION_069 = os.path.join(os.path.dirname(__file__), '..', '..', 'uploads', '069.json')
+
+LANDMARKS = ["Nest", "Cave", "Arch", "Tree"]
+TRUE = np.array([[0.0, 0.0], [10.0, 0.0], [0.0, 5.0], [7.0, 8.0]])
+
+
+def frame(estimated_rows, true=TRUE):
+    rows = []
+    for estimated in estimated_rows:
+        row = {}
+        for (landmark, (ex, ey), (tx, ty)) in zip(LANDMARKS, estimated, true):
+            row.update({f"{landmark}_X": ex, f"{landmark}_Y": ey, f"{landmark}_TrueX": tx, f"{landmark}_TrueY": ty})
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def similarity(true, scale, degrees, translation):
+    b = scale * np.exp(1j * np.radians(degrees))
+    w = translation[0] + 1j * translation[1] + b * (true[:, 0] + 1j * true[:, 1])
+    return np.column_stack([w.real, w.imag])
+
+
+def test_euclidean_recovers_an_exact_similarity():
+    estimated = similarity(TRUE, 2.0, 30.0, (1.0, -2.0))
+    result = fit_euclidean(*stack_landmark_coordinates(frame([estimated]), LANDMARKS))
+    assert result["MapEuclidean_RSq"][0] == pytest.approx(1.0)
+    assert result["MapEuclidean_Scale"][0] == pytest.approx(2.0)
+    assert result["MapEuclidean_Rotation"][0] == pytest.approx(30.0)
+    assert result["MapEuclidean_TranslationX"][0] == pytest.approx(1.0)
+    assert result["MapEuclidean_TranslationY"][0] == pytest.approx(-2.0)
+
+
+def test_affine_matches_least_squares_per_participant():
+    rng = np.random.default_rng(0)
+    estimated = [TRUE @ np.array([[1.5, 0.2], [-0.3, 0.8]]) + [3.0, 4.0] + rng.normal(0, 0.5, TRUE.shape) for _ in range(3)]
+    result = fit_affine(*stack_landmark_coordinates(frame(estimated), LANDMARKS))
+    design = np.column_stack([np.ones(len(TRUE)), TRUE])
+    for p, target in enumerate(estimated):
+        coef = np.linalg.lstsq(design, target, rcond=None)[0]
+        r2 = 1 - ((target - design @ coef) ** 2).sum() / ((target - target.mean(axis=0)) ** 2).sum()
+        assert result["MapAffine_RSq"][p] == pytest.approx(r2)
+        assert result["MapAffine_TranslationX"][p] == pytest.approx(coef[0, 0])
+        assert result["MapAffine_TranslationY"][p] == pytest.approx(coef[0, 1])
+        assert result["MapAffine_ScaleX"][p] == pytest.approx(np.hypot(*coef[1]))
+
+
+def test_affine_rotation_is_that_of_the_whole_linear_part():
+    # A rotation after a stretch along the diagonal: the X axis alone is turned by more than the rotation
+    theta = np.radians(40.0)
+    rotation = np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
+    linear = rotation @ np.array([[2.0, 0.6], [0.6, 1.0]])
+    estimated = TRUE @ linear.T + [5.0, -1.0]
+    result = fit_affine(*stack_landmark_coordinates(frame([estimated]), LANDMARKS))
+    assert result["MapAffine_Rotation"][0] == pytest.approx(40.0)
+    assert result["MapAffine_ScaleX"][0] == pytest.approx(np.hypot(*linear[:, 0]))
+    assert result["MapAffine_ScaleY"][0] == pytest.approx(np.hypot(*linear[:, 1]))
+
+
+def test_missing_landmarks_are_left_out_and_too_few_give_nan():
+    estimated = similarity(TRUE, 1.0, -45.0, (0.0, 0.0)).astype(object)
+    one_left = estimated.copy()
+    one_left[[0, 2]] = ["", ""]
+    one_left[3] = [None, None]
+    df = add_bidimensional_regression(frame([estimated, one_left]), LANDMARKS)
+    # The start position at the origin is the second point of the second participant
+    assert df["MapEuclidean_Rotation"].tolist() == pytest.approx([-45.0, -45.0])
+    # An affine fit needs three points
+    assert np.isfinite(df.loc[0, "MapAffine_RSq"]) and np.isnan(df.loc[1, "MapAffine_RSq"])
+
+
+def test_start_position_is_added_to_every_participant():
+    estimated, true, mask = add_start_position(*stack_landmark_coordinates(frame([TRUE, TRUE]), LANDMARKS))
+    assert estimated.shape == (2, len(LANDMARKS) + 1, 2) and mask[:, -1].all()
+    assert not estimated[:, -1].any() and not true[:, -1].any()
+
+
+def test_r_squared_matches_the_instrument():
+    from finalJSONtoCSV import JSONProcessor, get_column_headers, process_json_files, build_wide_table
+    from getTrialNumbers import findTrialCountsInData
+    with open(SESSION_069) as f:
+        counts = findTrialCountsInData(json.load(f))
+    df = build_wide_table(process_json_files([SESSION_069], JSONProcessor(*counts)), get_column_headers(*counts))
+    # Mapping.BidimensionalRegression of 069.json: Euclidean R2 0.146973540116293, Affine R2 0.387632249599994
+    assert df.loc[0, "MapEuclidean_RSq"] == pytest.approx(0.146973540116293, abs=1e-6)
+    assert df.loc[0, "MapAffine_RSq"] == pytest.approx(0.387632249599994, abs=1e-6)
+    assert df.loc[0, "MapEuclidean_RSq"] == pytest.approx(float(df.loc[0, "MapRSq"]), abs=1e-6)
@@ -0,0 +1,53 @@
+import os
+import io
+import hashlib
+import zipfile
+import chunkedUpload
+from syntheticSession import make_synthetic_zip
+
+CHUNK_SIZE = 2048
+
+
+def init_upload(client, filename='cohort.zip'):
+    response = client.post('/api/upload/init', json={'filename': filename, 'chunk_size': CHUNK_SIZE})
+    assert response.status_code == 200
+    return response.get_json()['upload_id']
+
+
+def put_chunk(client, upload_id, index, data):
+    return client.put(f'/api/upload/{upload_id}/chunk/{index}', data=data)
+
+
+def test_chunks_received_by_different_workers(client, monkeypatch):
+    data = make_synthetic_zip(3, seed=2)
+    chunks = [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+    assert len(chunks) >= 4
+    upload_id = init_upload(client)
+    # Two workers, each with its own ChunkedUpload of the upload, receive the chunks in turn
+    workers = [{}, {}]
+    for index, chunk in enumerate(chunks):
+        monkeypatch.setattr(chunkedUpload, '_uploads', workers[index % 2])
+        response = put_chunk(client, upload_id, index, chunk)
+        assert response.status_code == 200, response.get_json()
+        assert response.get_json()['next_chunk'] == index + 1
+    # A retried chunk is acknowledged again without being appended
+    assert put_chunk(client, upload_id, 1, chunks[1]).status_code == 200
+
+    monkeypatch.setattr(chunkedUpload, '_uploads', workers[0])
+    response = client.post(f'/api/upload/{upload_id}/finalize', json={'sha256': hashlib.sha256(data).hexdigest()})
+    assert response.status_code == 200, response.get_json()
+    with open(response.get_json()['file_path'], 'rb') as f:
+        assert f.read() == data
+    assert client.get(f'/api/upload/{upload_id}').status_code == 404
+
+
+def test_finalize_keeps_the_uploads_of_others(client, upload):
+    data = make_synthetic_zip(2, seed=3)
+    upload_id = init_upload(client, 'other.zip')
+    for index in range(0, len(data), CHUNK_SIZE):
+        assert put_chunk(client, upload_id, index // CHUNK_SIZE, data[index:index + CHUNK_SIZE]).status_code == 200
+    response = client.post(f'/api/upload/{upload_id}/finalize')
+    assert response.status_code == 200
+    assert os.path.exists(upload) and os.path.exists(upload + '.summary.json')
+    with zipfile.ZipFile(io.BytesIO(data)) as zip_ref, zipfile.ZipFile(response.get_json()['file_path']) as uploaded:
+        assert uploaded.namelist() == zip_ref.namelist()
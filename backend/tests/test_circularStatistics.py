@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+from circularStatistics import wrap_angle, signed_error, circular_summary, add_circular_statistics, circular_statistics_without
+from finalJSONtoCSV import JSONProcessor, get_column_headers
+from syntheticSession import make_synthetic_session
+
+
+def test_wrap_and_signed_error_take_the_short_way_around():
+    assert wrap_angle([180.0, -180.0, 190.0, 360.0]).tolist() == [-180.0, -180.0, -170.0, 0.0]
+    assert signed_error([10.0, 350.0], [350.0, 10.0]).tolist() == pytest.approx([20.0, -20.0])
+
+
+def test_summary_of_angles_around_the_wrap():
+    summary = circular_summary(np.array([[170.0, -170.0, np.nan], [30.0, 30.0, 30.0]]))
+    assert abs(summary["Mean"][0]) == pytest.approx(180.0)
+    assert summary["R"][0] == pytest.approx(np.cos(np.radians(10.0)))
+    assert summary["SD"][0] == pytest.approx(np.degrees(np.sqrt(-2 * np.log(np.cos(np.radians(10.0))))))
+    assert summary["Mean"][1] == pytest.approx(30.0)
+    assert summary["R"][1] == pytest.approx(1.0) and summary["SD"][1] == pytest.approx(0.0, abs=1e-6)
+
+
+def test_rows_without_angles_or_resultant_are_nan():
+    summary = circular_summary(np.array([[np.nan, np.nan], [0.0, 180.0]]))
+    assert np.isnan(summary["Mean"]).all()
+    assert np.isnan(summary["R"][0]) and summary["R"][1] == pytest.approx(0.0, abs=1e-12)
+
+
+def test_columns_added_for_the_cohort():
+    df = pd.DataFrame({"PI_FinalAngle_0": [10.0, "x"], "PI_FinalAngle_1": [20.0, 5.0],
+                       "PointingJudgement_SignedError_0_Trial_0": [-10.0, 0.0], "PointingJudgement_SignedError_1_Trial_0": [10.0, 0.0],
+                       "PerpectiveFinalAngle_0": [350.0, 90.0], "PerpectiveCorrectAngle_0": [10.0, 80.0]})
+    add_circular_statistics(df)
+    assert df["Circ_PI_FinalAngle_Mean"].tolist() == pytest.approx([15.0, 5.0])
+    assert df["Circ_PointingJudgement_SignedError_all_Mean"].tolist() == pytest.approx([0.0, 0.0], abs=1e-9)
+    assert df["PerspectiveSignedError_0"].tolist() == pytest.approx([-20.0, 10.0])
+
+
+def test_unreadable_judgement_angle_is_nan_and_keeps_the_columns():
+    session = make_synthetic_session(num_pi=2, num_pointing_tasks=2, num_judgements=2, num_pt=2)
+    session["Sessions"]["Egocentric"][0]["PointingTasks"][0]["PointingJudgements"][1]["Estimated_Angle"] = "-"
+    counts = (2, 2, 2, 2)
+    row = dict(zip(get_column_headers(*counts), JSONProcessor(*counts).extract_data(session)))
+    assert np.isnan(row["PointingJudgement_SignedError_0_Trial_1"])
+    judgements = session["Sessions"]["Egocentric"][0]["PointingTasks"]
+    assert row["PointingJudgement_SignedError_1_Trial_0"] == pytest.approx(
+        signed_error(judgements[1]["PointingJudgements"][0]["Estimated_Angle"], judgements[1]["PointingJudgements"][0]["Correct_Angle"]))
+
+
+def test_excluded_trials_are_left_out_of_the_summary():
+    df = pd.DataFrame({"PointingJudgement_SignedError_0_Trial_0": [10.0, 10.0], "PointingJudgement_SignedError_0_Trial_1": [90.0, 90.0]})
+    add_circular_statistics(df)
+    excluded = {"PointingJudgement_AbsoluteError_0_Trial_1": np.array([True, False])}
+    result = circular_statistics_without(df, excluded)
+    assert result["Circ_PointingJudgement_SignedError_0_Mean"].tolist() == pytest.approx([10.0, 50.0])
+    assert result["Circ_PointingJudgement_SignedError_all_Mean"].tolist() == pytest.approx([10.0, 50.0])
+    assert circular_statistics_without(df, {}) == {}
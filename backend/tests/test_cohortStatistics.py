@@ -0,0 +1,63 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from cohortStatistics import CohortStatistics, ColumnAccumulator, QuantileSketch, SKETCH_ACCURACY, main
+
+
+def test_accumulator_matches_numpy():
+    values = np.random.default_rng(1).normal(5.0, 2.0, 1000)
+    accumulator = ColumnAccumulator()
+    for batch in np.array_split(values, 7):
+        accumulator.update(batch)
+    result = accumulator.to_dict()
+    assert result["count"] == 1000
+    assert result["mean"] == pytest.approx(values.mean())
+    assert result["variance"] == pytest.approx(values.var(ddof=1))
+    assert (result["min"], result["max"]) == (values.min(), values.max())
+
+
+def test_quantiles_are_within_the_sketch_accuracy():
+    values = np.random.default_rng(2).lognormal(0.0, 1.0, 5000) * np.where(np.arange(5000) % 4 == 0, -1, 1)
+    sketch = QuantileSketch()
+    sketch.update(values)
+    qs = [0.05, 0.25, 0.5, 0.75, 0.95]
+    for estimate, q in zip(sketch.quantiles(qs, values.size), qs):
+        exact = np.quantile(values, q, method='lower')
+        assert abs(estimate - exact) <= 2 * SKETCH_ACCURACY * abs(exact) + 1e-9
+
+
+def test_merged_partials_equal_a_single_pass():
+    rng = np.random.default_rng(3)
+    df = pd.DataFrame({"A": rng.normal(size=300), "B": np.where(rng.random(300) < 0.2, "", rng.normal(size=300).astype(str)),
+                       "Player_ID": [f"P{i}" for i in range(300)]})
+    single = CohortStatistics()
+    single.update(df)
+    merged = CohortStatistics()
+    for part in (df.iloc[:50], df.iloc[50:51], df.iloc[51:]):
+        partial = CohortStatistics()
+        partial.update(part)
+        merged.merge(partial)
+    one, other = single.to_dict(), merged.to_dict()
+    assert one["participants"] == other["participants"] == 300
+    assert "Player_ID" not in one["columns"]
+    for col in ("A", "B"):
+        for key in ("count", "min", "max", "quantiles"):
+            assert one["columns"][col][key] == other["columns"][col][key]
+        for key in ("mean", "variance"):
+            assert one["columns"][col][key] == pytest.approx(other["columns"][col][key])
+
+
+def test_empty_column():
+    stats = CohortStatistics(["Missing"])
+    stats.update(pd.DataFrame({"Other": [1.0]}))
+    assert stats.to_dict()["columns"]["Missing"]["count"] == 0
+
+
+def test_cli_reads_the_upload_without_writing_next_to_it(tmp_path):
+    from syntheticSession import make_synthetic_zip
+    upload = tmp_path / 'cohort.zip'
+    upload.write_bytes(make_synthetic_zip(6, seed=5))
+    result = main([str(upload), '--columns', 'MapRSq', '--workers', '1', '--player-ids', 'SYN001', 'SYN002', 'SYN003'])
+    assert result['participants'] == 3 and result['columns']['MapRSq']['count'] == 3
+    assert os.listdir(tmp_path) == ['cohort.zip']
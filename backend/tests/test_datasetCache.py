@@ -0,0 +1,79 @@
+import os
+import json
+import pickle
+import random
+import zipfile
+import pandas as pd
+import pytest
+from syntheticSession import make_synthetic_session
+from datasetCache import get_valid_json_files, get_extract_folder, get_summary_path, load_summary
+from finalJSONtoCSV import SUMMARY_COLUMN_TYPES, read_summary_table, write_summary_table, type_summary_table
+
+
+class Planted:
+    """Runs code when unpickled."""
+
+    def __reduce__(self):
+        return (os.makedirs, ('pwned',))
+
+
+def write_zip(path, sessions, extra=None):
+    rng = random.Random(0)
+    with zipfile.ZipFile(path, 'w') as zip_ref:
+        for i in range(sessions):
+            zip_ref.writestr(f'data/P{i}.json', json.dumps(make_synthetic_session(rng, f'P{i}')))
+        for name, content in (extra or {}).items():
+            zip_ref.writestr(name, content)
+    return path
+
+
+def test_summary_round_trips_exactly(tmp_path):
+    summary = type_summary_table(pd.DataFrame({col: ['069', None] if dtype == 'string' else [0.1 + 0.2, float('nan')]
+                                               for col, dtype in SUMMARY_COLUMN_TYPES.items()}))
+    path = str(tmp_path / 'x.summary.json')
+    write_summary_table(summary, path)
+    pd.testing.assert_frame_equal(read_summary_table(path), summary)
+
+
+def test_stored_summary_must_have_the_summary_columns(tmp_path):
+    path = tmp_path / 'x.summary.json'
+    path.write_text(json.dumps({'columns': ['a'], 'rows': [[1]]}))
+    with pytest.raises(ValueError):
+        read_summary_table(str(path))
+
+
+def test_members_cannot_replace_the_files_stored_next_to_the_upload(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    upload_folder = tmp_path / 'uploads'
+    upload_folder.mkdir()
+    upload = str(upload_folder / 'cohort.zip')
+    planted_validation = json.dumps({'duplicate_policy': 'keep_first', 'files': []})
+    write_zip(upload, 3, {'cohort.zip.summary.json': '{}', 'cohort.zip.validation.json': planted_validation,
+                          '../cohort.zip.summary.pkl': pickle.dumps(Planted()), 'notes.txt': 'not a session'})
+
+    validation, json_files = get_valid_json_files(upload, str(upload_folder))
+    extract_folder = get_extract_folder(upload, str(upload_folder))
+    assert all(os.path.commonpath([extract_folder, path]) == extract_folder for path in json_files)
+    assert not os.path.exists(extract_folder + '/notes.txt')
+    assert not os.path.exists(upload_folder / 'cohort.zip.summary.pkl')
+    assert validation['usable_files'] == 3
+
+    summary = load_summary(upload, str(upload_folder))
+    assert len(summary) == 3
+    assert read_summary_table(get_summary_path(upload)).equals(summary)
+    assert not os.path.exists('pwned')
+
+
+def test_upload_is_validated_once_per_duplicate_policy(tmp_path, monkeypatch):
+    import datasetCache
+    monkeypatch.chdir(tmp_path)
+    upload_folder = tmp_path / 'uploads'
+    upload_folder.mkdir()
+    upload = write_zip(str(upload_folder / 'cohort.zip'), 3)
+    validation, json_files = get_valid_json_files(upload, str(upload_folder))
+
+    monkeypatch.setattr(datasetCache, 'validate_upload', lambda *args, **kwargs: pytest.fail('validated again'))
+    assert get_valid_json_files(upload, str(upload_folder)) == (validation, json_files)
+    assert all(os.path.exists(path) for path in json_files)
+    with pytest.raises(pytest.fail.Exception):
+        get_valid_json_files(upload, str(upload_folder), 'keep_latest')
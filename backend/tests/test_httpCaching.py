@@ -0,0 +1,19 @@
+import httpCaching
+
+
+def test_upload_hashes_keep_the_most_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(httpCaching, 'UPLOAD_HASH_CACHE_SIZE', 2)
+    monkeypatch.setattr(httpCaching, '_upload_hashes', httpCaching.OrderedDict())
+    paths = []
+    for i in range(3):
+        path = tmp_path / f'upload_{i}.zip'
+        path.write_bytes(bytes([i]) * 10)
+        paths.append(str(path))
+
+    first = httpCaching.get_upload_hash(paths[0])
+    httpCaching.get_upload_hash(paths[1])
+    assert httpCaching.get_upload_hash(paths[0]) == first  # now the most recently used
+    httpCaching.remember_upload_hash(paths[2], 'f' * 64)
+    cached = {key[0] for key in httpCaching._upload_hashes}
+    assert len(httpCaching._upload_hashes) == 2 and str(tmp_path / 'upload_1.zip') not in cached
+    assert httpCaching.get_upload_hash(paths[2]) == 'f' * 64
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+from incrementalAverages import IncrementalAverages, RunningMean, RECOMPUTE_EVERY, get_trial_columns
+
+
+@pytest.fixture
+def df():
+    rng = np.random.default_rng(4)
+    data = {"Player_ID": ["a", "b", "c"]}
+    for i in range(3):
+        data[f"PI_Distance_{i}"] = rng.normal(size=3)
+    data["PI_Distance_1"][1] = np.nan
+    for block in range(2):
+        for trial in range(2):
+            data[f"PointingJudgement_AbsoluteError_{block}_Trial_{trial}"] = rng.uniform(0, 90, 3)
+    for i in range(2):
+        data[f"PerspectiveErrorMeasure_{i}"] = rng.uniform(0, 90, 3)
+    df = pd.DataFrame(data)
+    df["Avg_PI_Distance"] = df[[f"PI_Distance_{i}" for i in range(3)]].mean(axis=1)
+    for block in range(2):
+        df[f"Avg_PointingJudgement_AbsoluteError_{block}"] = df[[f"PointingJudgement_AbsoluteError_{block}_Trial_{t}" for t in range(2)]].mean(axis=1)
+    df["Average_PointingJudgementError_all"] = df[["Avg_PointingJudgement_AbsoluteError_0", "Avg_PointingJudgement_AbsoluteError_1"]].mean(axis=1)
+    df["Avg_PerspectiveErrorMeasure"] = df[["PerspectiveErrorMeasure_0", "PerspectiveErrorMeasure_1"]].mean(axis=1)
+    return df
+
+
+def test_trial_columns(df):
+    assert "Avg_PI_Distance" not in get_trial_columns(df.columns)
+    assert len(get_trial_columns(df.columns)) == 3 + 4 + 2
+
+
+def test_selection_changes_match_a_fresh_computation(df):
+    original = df.copy()
+    averages = IncrementalAverages(df, 2)
+    for selection in (["PI_Distance_0", "PI_Distance_1"], ["PI_Distance_1", "PI_Distance_2", "PointingJudgement_AbsoluteError_1_Trial_0"],
+                      ["PI_Distance_2", "PointingJudgement_AbsoluteError_0_Trial_1", "PerspectiveErrorMeasure_1"]):
+        unselected = averages.apply_selection(selection)
+        pi = [col for col in selection if col.startswith("PI_")]
+        assert df["Avg_PI_Distance"].tolist() == pytest.approx(original[pi].mean(axis=1).tolist(), nan_ok=True)
+        blocks = {int(col.split('_')[2]) for col in selection if col.startswith("PointingJudgement")}
+        # Without any pointing trial selected the extracted block averages are kept, none is dropped
+        assert unselected == (sorted({0, 1} - blocks) if blocks else [])
+        for block in blocks:
+            cols = [col for col in selection if col.startswith(f"PointingJudgement_AbsoluteError_{block}_")]
+            assert df[f"Avg_PointingJudgement_AbsoluteError_{block}"].tolist() == pytest.approx(original[cols].mean(axis=1).tolist())
+    assert df["Avg_PerspectiveErrorMeasure"].tolist() == pytest.approx(original["PerspectiveErrorMeasure_1"].tolist())
+
+
+def test_reset_restores_the_extracted_averages(df):
+    original = df.copy()
+    averages = IncrementalAverages(df, 2)
+    averages.apply_selection(["PI_Distance_0", "PointingJudgement_AbsoluteError_0_Trial_0"])
+    averages.reset()
+    pd.testing.assert_frame_equal(df, original)
+
+
+def test_exclusions_leave_values_out_until_cleared(df):
+    original = df.copy()
+    averages = IncrementalAverages(df, 2)
+    averages.set_exclusions({"PI_Distance_0": np.array([True, False, False])}, key="test")
+    expected = original[["PI_Distance_1", "PI_Distance_2"]].mean(axis=1)[0]
+    assert df.loc[0, "Avg_PI_Distance"] == pytest.approx(expected)
+    averages.apply_selection(["PI_Distance_0"])
+    assert np.isnan(df.loc[0, "Avg_PI_Distance"]) and df.loc[1, "Avg_PI_Distance"] == pytest.approx(original.loc[1, "PI_Distance_0"])
+    averages.reset()
+    pd.testing.assert_frame_equal(df, original)
+    with pytest.raises(ValueError):
+        averages.set_exclusions({"PI_Distance_0": np.array([True, False, False])})
+
+
+def test_running_mean_is_recomputed_exactly_after_many_updates():
+    values = {'a': np.array([0.1, np.nan]), 'b': np.array([0.2, 3.0])}
+    running = RunningMean(2)
+    running.set_members(['a'], values)
+    running.sums += 1e-9  # rounding error of earlier updates
+    running.set_members(['a', 'b'], values)
+    assert running.sums[0] == pytest.approx(0.3 + 1e-9, abs=1e-15)
+    running.updates = RECOMPUTE_EVERY - 1
+    running.set_members(['b'], values)
+    assert running.updates == 0 and running.sums.tolist() == [0.2, 3.0] and running.counts.tolist() == [1, 1]
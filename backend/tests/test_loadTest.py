@@ -0,0 +1,10 @@
+from loadTest import percentile
+
+
+def test_nearest_rank_percentile():
+    assert percentile([], 50) is None
+    assert percentile([1, 2], 50) == 1
+    assert percentile([1, 2], 51) == 2
+    values = list(range(1, 101))
+    assert [percentile(values, q) for q in (0, 1, 50, 95, 99, 100)] == [1, 1, 50, 95, 99, 100]
+    assert percentile([7], 95) == 7
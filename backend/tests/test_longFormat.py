@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+from longFormat import parse_trial_column, to_long_format, LONG_FORMAT_COLUMNS
+
+
+def test_parse_trial_column():
+    assert parse_trial_column("PI_Corrected_PI_Angle_3") == ("PathIntegration", 0, 3, "Corrected_PI_Angle")
+    assert parse_trial_column("PointingJudgement_SignedError_2_Trial_4") == ("Pointing", 2, 4, "SignedError")
+    assert parse_trial_column("PerpectiveIdleTime_1") == ("PerspectiveTaking", 0, 1, "IdleTime")
+    assert parse_trial_column("Avg_PI_Distance") is None
+
+
+def test_long_table_values_and_dtypes():
+    df = pd.DataFrame({"Player_ID": ["a", "b"], "PI_Distance_0": [1.0, ""], "PI_Distance_1": [2.0, 3.0],
+                       "PointingJudgement_AbsoluteError_1_Trial_0": [4.0, 5.0], "Avg_PI_Distance": [1.5, 3.0]})
+    long_df = to_long_format(df)
+    assert list(long_df.columns) == LONG_FORMAT_COLUMNS
+    # Empty cells are left out, participants stay together in wide column order
+    assert long_df[["Participant", "Trial", "Value"]].values.tolist() == [[0, 0, 1.0], [0, 1, 2.0], [0, 0, 4.0], [1, 1, 3.0], [1, 0, 5.0]]
+    assert long_df["Block"].tolist() == [0, 0, 1, 0, 1]
+    assert long_df["Player_ID"].tolist() == ["a", "a", "a", "b", "b"]
+    assert all(isinstance(long_df[col].dtype, pd.CategoricalDtype) for col in ("Player_ID", "Task", "Metric"))
+    assert long_df["Participant"].dtype == np.int32
+
+
+def test_no_trial_columns_gives_an_empty_typed_table():
+    long_df = to_long_format(pd.DataFrame({"Player_ID": ["a"], "MapRSq": [0.5]}))
+    assert long_df.empty and list(long_df.columns) == LONG_FORMAT_COLUMNS
+
+
+def test_participant_columns_are_kept_on_every_row():
+    df = pd.DataFrame({"Player_ID": ["a", "b"], "PI_Distance_0": [1.0, 3.0], "PI_Distance_1": [2.0, np.nan],
+                       "Avg_PI_Distance": [1.5, 3.0], "MapRSq": [0.9, ""]})
+    long_df = to_long_format(df, participant_columns=["Avg_PI_Distance", "MapRSq"])
+    assert list(long_df.columns) == LONG_FORMAT_COLUMNS + ["Avg_PI_Distance", "MapRSq"]
+    assert long_df["Avg_PI_Distance"].tolist() == [1.5, 1.5, 3.0]
+    assert long_df["MapRSq"].tolist() == [0.9, 0.9, ""]
@@ -0,0 +1,65 @@
+import io
+import json
+import pytest
+from metadataFilter import MetadataFilter, MetadataFilterError, parse_filter, read_metadata
+
+METADATA = {'Player_Name': 'Zoë Ørsted 测试', 'Player_Age': '64', 'Settings_file': 'uSPACE',
+            'Start_Timestamp': '2024-04-08T05:11:00.0000000+02:00'}
+
+
+def session_bytes(metadata=METADATA, first=True, bom=False):
+    rest = {'PathIntegration': [{'Distance': i} for i in range(2000)]}
+    session = {'MetaData': metadata, **rest} if first else {**rest, 'MetaData': metadata}
+    return ('\ufeff' if bom else '').encode() + json.dumps(session, ensure_ascii=False).encode()
+
+
+def test_reads_only_the_head_of_the_file():
+    data = session_bytes()
+    f = io.BytesIO(data)
+    assert read_metadata(f, chunk_size=64) == METADATA
+    assert f.tell() < len(data) // 10
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 4096])
+def test_multibyte_characters_across_chunk_boundaries(chunk_size):
+    assert read_metadata(io.BytesIO(session_bytes(bom=True)), chunk_size=chunk_size) == METADATA
+
+
+def test_falls_back_to_the_whole_file():
+    data = session_bytes(first=False)
+    f = io.BytesIO(data)
+    assert read_metadata(f, chunk_size=64) == METADATA and f.tell() == len(data)
+    assert read_metadata(io.BytesIO(b'{"Other": 1}')) is None
+    assert read_metadata(io.BytesIO(b'{"MetaData": [1, 2]}')) is None
+
+
+def test_truncated_block_raises():
+    data = session_bytes()
+    with pytest.raises(ValueError):
+        read_metadata(io.BytesIO(data[:data.index(b'uSPACE')]), chunk_size=16)
+
+
+def test_start_bounds_with_and_without_offset():
+    # The session started at 05:11 local time, 03:11 UTC
+    assert parse_filter({'start_from': '2024-04-08T05:00'}).matches(METADATA)
+    assert not parse_filter({'start_from': '2024-04-08T05:30'}).matches(METADATA)
+    assert parse_filter({'start_from': '2024-04-08T03:00:00+00:00', 'start_to': '2024-04-08T03:30:00+00:00'}).matches(METADATA)
+    assert not parse_filter({'start_to': '2024-04-08T03:00:00+00:00'}).matches(METADATA)
+    naive_session = {**METADATA, 'Start_Timestamp': '2024-04-08T05:11:00'}
+    assert parse_filter({'start_from': '2024-04-08T05:00:00+09:00'}).matches(naive_session)
+    assert not parse_filter({'start_to': '2024-04-08T05:00:00+09:00'}).matches(naive_session)
+    assert parse_filter({'start_from': '2024-04-08', 'start_to': '2024-04-08'}).matches(METADATA)
+    assert not parse_filter({'start_from': '2024-04-09'}).matches(METADATA)
+    assert not parse_filter({'start_from': '2024-04-08'}).matches({**METADATA, 'Start_Timestamp': 'not a date'})
+
+
+def test_parse_filter():
+    assert parse_filter(None) is None and parse_filter({'age_min': None, 'player_ids': []}) is None
+    metadata_filter = parse_filter('{"settings_file": "uSPACE, other", "age_min": 60, "age_max": "70"}')
+    assert metadata_filter.matches(METADATA) and not metadata_filter.matches({**METADATA, 'Player_Age': '71'})
+    assert metadata_filter.key == parse_filter({'age_max': 70, 'age_min': 60, 'settings_file': ['other', 'uSPACE']}).key
+    assert MetadataFilter(player_ids=['Zoë Ørsted 测试']).matches(METADATA)
+    for options in ({'age': 1}, {'age_min': 'old'}, {'age_min': 70, 'age_max': 60}, {'start_from': '2024-13-01'},
+                    {'start_from': '2024-05-01', 'start_to': '2024-04-01'}, '[1]', 'not json'):
+        with pytest.raises(MetadataFilterError):
+            parse_filter(options)
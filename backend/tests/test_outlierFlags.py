@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+from outlierFlags import OutlierFlags, OutlierOptionError, parse_outlier_options, robust_z_scores, iqr_scores, build_outlier_reference
+
+
+def test_parse_options():
+    assert parse_outlier_options(None) is None
+    assert parse_outlier_options(True) == ("robust_z", 3.5, False)
+    assert parse_outlier_options({"method": "iqr", "threshold": "2", "exclude": 1}) == ("iqr", 2.0, True)
+    for bad in ({"method": "zscore"}, {"threshold": 0}, {"threshold": "x"}, [1]):
+        with pytest.raises(OutlierOptionError):
+            parse_outlier_options(bad)
+
+
+def test_robust_z_against_the_definition():
+    values = np.array([[1.0], [2.0], [3.0], [4.0], [100.0], [np.nan]])
+    column = values[:5, 0]
+    mad = np.median(np.abs(column - np.median(column)))
+    scores = robust_z_scores(values)
+    assert scores[:5, 0] == pytest.approx(0.6745 * (column - np.median(column)) / mad)
+    assert np.isnan(scores[5, 0])
+
+
+def test_robust_z_falls_back_when_the_mad_is_zero():
+    values = np.array([[1.0], [1.0], [1.0], [2.0]])
+    mean_ad = np.mean(np.abs(values[:, 0] - 1.0))
+    assert robust_z_scores(values)[3, 0] == pytest.approx(1.0 / (mean_ad * 1.2533))
+
+
+def test_iqr_scores():
+    values = np.array([[0.0], [1.0], [2.0], [3.0], [4.0], [10.0]])
+    q1, q3 = np.percentile(values[:, 0], [25, 75])
+    scores = iqr_scores(values)[:, 0]
+    assert scores[5] == pytest.approx((10.0 - q3) / (q3 - q1))
+    assert scores[2] == 0.0 and scores[0] == pytest.approx((0.0 - q1) / (q3 - q1))
+
+
+def test_flags_and_columns():
+    df = pd.DataFrame({"Player_ID": list("abcdef"), "PI_Distance_0": [1.0, 1.1, 0.9, 1.0, 1.05, 9.0],
+                       "PI_Distance_1": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0], "PerspectiveErrorMeasure_0": [1.0, 50.0, np.nan, np.nan, np.nan, np.nan]})
+    flags = OutlierFlags(df)
+    assert flags.summary() == {"PI_Distance_0": 1}
+    # Columns with fewer than MIN_PARTICIPANTS values are never flagged
+    assert not flags.flag_matrix(["PerspectiveErrorMeasure_0"]).any()
+    assert flags.excluded()["PI_Distance_0"].tolist() == [False] * 5 + [True]
+    out = flags.add_columns(df)
+    assert out["Outlier_Count"].tolist() == [0, 0, 0, 0, 0, 1]
+    assert out["Outlier_Trials"].iloc[5] == "PI_Distance_0"
+
+
+@pytest.mark.parametrize("method", ["robust_z", "iqr"])
+def test_rows_scored_against_a_stored_reference(method):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"PI_Distance_0": rng.normal(size=20), "PI_Distance_1": rng.exponential(size=20), "PerspectiveErrorMeasure_0": [np.nan] * 17 + [1.0, 2.0, 3.0]})
+    reference = build_outlier_reference(list(df.columns), {col: df[col].to_numpy() for col in df.columns})
+    whole = OutlierFlags(df, method, 1.0)
+    page = OutlierFlags(df.iloc[15:], method, 1.0, reference=reference)
+    np.testing.assert_array_equal(page.scores, whole.scores[15:])
+    assert page.flags.tolist() == whole.flags[15:].tolist()
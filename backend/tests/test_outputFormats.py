@@ -0,0 +1,46 @@
+import io
+import pandas as pd
+import pytest
+from outputFormats import frame_to_bytes, prepare_frame, pyarrow
+
+ARROW_FORMATS = ['csv_arrow', 'parquet', 'feather']
+
+
+def make_frame():
+    return pd.DataFrame({
+        'Player_ID': ['069', '101', '7'],
+        'SPACEStartTime': ['2024', '2025', ''],
+        'MapRSq': ['0.25', '', '1.5'],
+        'HomingTime_1': ['3', '4', ''],
+        'Nest_X': [1.23456, 2.5, None],
+    }, dtype=object)
+
+
+def read(data, fmt):
+    if fmt in ('csv', 'csv_arrow'):
+        return pd.read_csv(io.BytesIO(data), dtype={'Player_ID': str, 'SPACEStartTime': str})
+    return pd.read_parquet(io.BytesIO(data)) if fmt == 'parquet' else pd.read_feather(io.BytesIO(data))
+
+
+def test_csv_is_written_as_the_table_is():
+    df = make_frame()
+    assert frame_to_bytes(df, 'csv') == df.to_csv(index=False).encode()
+    rounded = read(frame_to_bytes(df, 'csv', float_precision=2), 'csv')
+    assert list(rounded['Player_ID']) == ['069', '101', '7'] and rounded['Nest_X'].tolist()[:2] == [1.23, 2.5]
+
+
+def test_prepare_frame_types_values_but_not_identifiers():
+    frame = prepare_frame(make_frame())
+    assert frame['Player_ID'].tolist() == ['069', '101', '7'] and isinstance(frame['Player_ID'].dtype, pd.StringDtype)
+    assert isinstance(frame['SPACEStartTime'].dtype, pd.StringDtype)
+    assert str(frame['HomingTime_1'].dtype) == 'Int64' and frame['HomingTime_1'].tolist()[:2] == [3, 4]
+    assert frame['MapRSq'].dtype == 'float64' and frame['MapRSq'][2] == 1.5
+
+
+@pytest.mark.skipif(pyarrow is None, reason='needs pyarrow')
+@pytest.mark.parametrize('fmt', ARROW_FORMATS)
+def test_arrow_formats_store_the_same_values(fmt):
+    table = read(frame_to_bytes(make_frame(), fmt, float_precision=3), fmt)
+    assert table['Player_ID'].tolist() == ['069', '101', '7']
+    assert table['HomingTime_1'].tolist()[:2] == [3, 4] and pd.isna(table['HomingTime_1'][2])
+    assert table['MapRSq'].tolist()[0] == 0.25 and table['Nest_X'].tolist()[0] == 1.235
@@ -0,0 +1,47 @@
+import pytest
+from sessionIndex import SessionIndex, DuplicateSessionError
+
+
+def reports(*sessions):
+    return [{'file': f'{name}.json', 'usable': True, 'content_hash': f'hash-{name}', 'session_key': ['', name, '2024-01-01']}
+            for name in sessions]
+
+
+@pytest.fixture
+def index(tmp_path):
+    return SessionIndex(str(tmp_path / 'index.sqlite3'))
+
+
+def test_keep_first_drops_the_sessions_of_earlier_uploads(index):
+    index.check_and_record(reports('P1', 'P2'), 'first', 'first.zip')
+    second = reports('P2', 'P3')
+    seen_before, dropped, superseded = index.check_and_record(second, 'second', 'second.zip')
+    assert seen_before == 1 and superseded == []
+    assert dropped == [{'file': 'P2.json', 'duplicate_of': 'P2.json', 'upload': 'first.zip', 'reason': 'session of another upload'}]
+    # Validating the first upload again keeps its sessions, it is still the earlier one
+    first = reports('P1', 'P2')
+    assert index.check_and_record(first, 'first', 'first.zip')[1] == []
+    assert [r.get('duplicate_of') for r in first] == [None, None] and first[1]['seen_in_uploads'][0]['upload'] == 'second.zip'
+
+
+def test_keep_latest_supersedes_earlier_uploads(index):
+    index.check_and_record(reports('P1', 'P2'), 'first', 'first.zip', 'keep_latest')
+    _, dropped, superseded = index.check_and_record(reports('P2', 'P3'), 'second', 'second.zip', 'keep_latest')
+    assert dropped == [] and superseded == ['first.zip']
+    first = reports('P1', 'P2')
+    _, dropped, superseded = index.check_and_record(first, 'first', 'first.zip', 'keep_latest')
+    assert [entry['file'] for entry in dropped] == ['P2.json'] and superseded == []
+
+
+def test_error_policy_records_nothing(index):
+    index.check_and_record(reports('P1'), 'first', 'first.zip', 'error')
+    with pytest.raises(DuplicateSessionError):
+        index.check_and_record(reports('P1', 'P2'), 'second', 'second.zip', 'error')
+    assert index.check_and_record(reports('P2'), 'third', 'third.zip', 'error')[0] == 0
+
+
+def test_forgotten_uploads_no_longer_count(index):
+    index.check_and_record(reports('P1'), 'first', 'first.zip')
+    index.check_and_record(reports('P1'), 'second', 'second.zip')
+    assert index.forget_upload('first.zip') == ['second.zip']
+    assert index.check_and_record(reports('P1'), 'second', 'second.zip')[:2] == (0, [])
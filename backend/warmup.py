@@ -0,0 +1,62 @@
+"""Warm-up of a freshly imported backend on a bundled synthetic session.
+
+Runs validation, extraction, the wide and summary tables, column groups, averages and the long format once,
+so lazily imported pandas/numpy submodules are loaded and the regex cache is filled before the first upload.
+When the app is preloaded in the gunicorn master this happens once, and the forked workers share the result
+copy-on-write.
+"""
+import io
+import os
+import json
+import time
+import random
+import shutil
+import logging
+import tempfile
+from syntheticSession import make_synthetic_session
+from finalJSONtoCSV import (JSONProcessor, get_column_headers, process_json_files, build_wide_table, build_summary_table,
+                            get_column_groups, get_summary_columns, clean_column_groups)
+from sessionValidation import validate_sessions, mark_short_sections
+from incrementalAverages import IncrementalAverages
+from longFormat import to_long_format
+
+logger = logging.getLogger(__name__)
+
+WARM_UP_PLAYER = "WARMUP"
+
+
+def warm_up_extraction(seed=0):
+    """Extracts one synthetic session end to end. Returns the wide table and its trial counts."""
+    workdir = tempfile.mkdtemp(prefix='warmup_')
+    try:
+        session_path = os.path.join(workdir, f'{WARM_UP_PLAYER}.json')
+        with open(session_path, 'w') as f:
+            json.dump(make_synthetic_session(random.Random(seed), WARM_UP_PLAYER), f)
+        reports = validate_sessions([session_path])
+        trial_counts = tuple(mark_short_sections(reports).values())
+        headers = get_column_headers(*trial_counts)
+        data = process_json_files([session_path], JSONProcessor(*trial_counts))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    build_summary_table(data, headers)
+    df = build_wide_table(data, headers)
+    clean_column_groups(get_column_groups(df, *trial_counts), df)
+    clean_column_groups(get_summary_columns(), df)
+    IncrementalAverages(df, trial_counts[2]).apply_selection(list(df.columns))
+    to_long_format(df)
+    df.to_csv(io.StringIO(), index=False)
+    return df, trial_counts
+
+
+def timed_warm_up(warm_up):
+    """Runs a warm-up callable and returns its duration in seconds. A failing warm-up is logged, never raised,
+    so it cannot keep the server from starting."""
+    start = time.perf_counter()
+    try:
+        warm_up()
+    except Exception as e:
+        logger.error(f"Warm-up failed: {e}")
+    elapsed = time.perf_counter() - start
+    logger.info(f"Warm-up finished in {elapsed:.3f}s")
+    return elapsed
@@ -4,6 +4,10 @@ import ColumnSelection from './components/ColumnSelection';
 import AnimatedEllipsis from './components/AnimatedEllipsis';
 import './styles/App.css'; 
 
+const CHUNKED_UPLOAD_THRESHOLD = 32 * 1024 * 1024;
+const CHUNK_SIZE = 8 * 1024 * 1024;
+const MAX_CHUNK_RETRIES = 5;
+
 const getAllColumns = (obj) => {
   let columns = [];
   if (Array.isArray(obj)) {
@@ -17,14 +21,21 @@ const getAllColumns = (obj) => {
   return columns;
 };
 
+const OUTPUT_EXTENSIONS = { csv: 'csv', csv_arrow: 'csv', parquet: 'parquet', feather: 'feather' };
 
 export default function App() {
   const [file, setFile] = useState(null);
   const [filePath, setFilePath] = useState(null);
   const [outputOption, setOutputOption] = useState('detailed');
+  const [outputFormat, setOutputFormat] = useState('csv');
+  const [flagOutliers, setFlagOutliers] = useState(false);
+  const [excludeOutliers, setExcludeOutliers] = useState(false);
+  const [participantFilter, setParticipantFilter] = useState({ settings_file: '', start_from: '', start_to: '', age_min: '', age_max: '', player_ids: '' });
   const [columns, setColumns] = useState([]);
   const [selectedColumns, setSelectedColumns] = useState([]);
   const [error, setError] = useState(null);
+  const [quarantined, setQuarantined] = useState([]);
+  const [duplicates, setDuplicates] = useState([]);
  
   const [isFileUploaded, setIsFileUploaded] = useState(false);
   const [isFetchingColumns, setIsFetchingColumns] = useState(false);
@@ -72,6 +83,56 @@ export default function App() {
     return categorizedColumns;
   };
 
+  // Large archives are sent in chunks; after a failed chunk the upload resumes from the last chunk the server acknowledged
+  const uploadInChunks = async (file) => {
+    const initResponse = await fetch('http://localhost:7069/api/upload/init', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ filename: file.name, chunk_size: CHUNK_SIZE }),
+      credentials: 'include'
+    });
+    if (!initResponse.ok) {
+      throw new Error(`HTTP error! status: ${initResponse.status}`);
+    }
+    const { upload_id: uploadId, chunk_size: chunkSize } = await initResponse.json();
+    const totalChunks = Math.ceil(file.size / chunkSize);
+    let nextChunk = 0;
+    let failures = 0;
+    while (nextChunk < totalChunks) {
+      try {
+        const response = await fetch(`http://localhost:7069/api/upload/${uploadId}/chunk/${nextChunk}`, {
+          method: 'PUT',
+          body: file.slice(nextChunk * chunkSize, (nextChunk + 1) * chunkSize),
+          credentials: 'include'
+        });
+        if (!response.ok && response.status !== 409) {
+          throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        nextChunk = (await response.json()).next_chunk;
+        failures = 0;
+      } catch (e) {
+        if (++failures > MAX_CHUNK_RETRIES) {
+          throw e;
+        }
+        console.warn(`Chunk ${nextChunk} failed, resuming:`, e);
+        const statusResponse = await fetch(`http://localhost:7069/api/upload/${uploadId}`, { credentials: 'include' });
+        if (statusResponse.ok) {
+          nextChunk = (await statusResponse.json()).next_chunk;
+        }
+      }
+    }
+    const finalizeResponse = await fetch(`http://localhost:7069/api/upload/${uploadId}/finalize`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({}),
+      credentials: 'include'
+    });
+    if (!finalizeResponse.ok) {
+      throw new Error(`HTTP error! status: ${finalizeResponse.status}`);
+    }
+    return finalizeResponse.json();
+  };
+
   const handleUploadAndFetchColumns = async () => {
     if (!file) {
       setError('Please select a file before uploading.');
@@ -85,17 +146,22 @@ export default function App() {
   
     try {
       console.log("Starting file upload...");
-      const formData = new FormData();
-      formData.append('file', file);
-      const uploadResponse = await fetch('http://localhost:7069/api/upload', {
-        method: 'POST',
-        body: formData,
-        credentials: 'include'
-      });
-      if (!uploadResponse.ok) {
-        throw new Error(`HTTP error! status: ${uploadResponse.status}`);
+      let uploadData;
+      if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+        uploadData = await uploadInChunks(file);
+      } else {
+        const formData = new FormData();
+        formData.append('file', file);
+        const uploadResponse = await fetch('http://localhost:7069/api/upload', {
+          method: 'POST',
+          body: formData,
+          credentials: 'include'
+        });
+        if (!uploadResponse.ok) {
+          throw new Error(`HTTP error! status: ${uploadResponse.status}`);
+        }
+        uploadData = await uploadResponse.json();
       }
-      const uploadData = await uploadResponse.json();
       if (!uploadData.success) {
         throw new Error(uploadData.message || 'Unknown error occurred during file upload');
       }
@@ -118,13 +184,23 @@ export default function App() {
     }
   };
 
+  // Only the filled-in criteria are sent, null when no participant filter is set
+  const filterOptions = useCallback(() => {
+    const options = Object.fromEntries(Object.entries(participantFilter).filter(([, value]) => value.trim() !== ''));
+    return Object.keys(options).length ? options : null;
+  }, [participantFilter]);
+
+  const updateFilter = (key) => (e) => setParticipantFilter({ ...participantFilter, [key]: e.target.value });
+
   const fetchColumns = useCallback(async (path) => {
     setError(null);
     setIsFetchingColumns(true);
     try {
       const fetchPath = path || filePath;
       console.log(`Fetching columns with option: ${outputOption.option}, file_path: ${fetchPath}`);
-      const response = await fetch(`http://localhost:7069/api/columns?option=${outputOption.option}&file_path=${encodeURIComponent(fetchPath)}`, {
+      const filter = filterOptions();
+      const filterParam = filter ? `&filter=${encodeURIComponent(JSON.stringify(filter))}` : '';
+      const response = await fetch(`http://localhost:7069/api/columns?option=${outputOption.option}&file_path=${encodeURIComponent(fetchPath)}${filterParam}`, {
         method: 'GET',
         credentials: 'include',
         headers: {
@@ -155,6 +231,8 @@ export default function App() {
       }
       // const processedColumns = processColumns(newColumns);
       setColumns(newColumns);
+      setQuarantined(data.validation ? data.validation.quarantined : []);
+      setDuplicates(data.validation ? data.validation.duplicates : []);
       console.log("Columns set in state:", newColumns);
         // Set all columns as selected by default
       const allColumns = getAllColumns(newColumns);
@@ -167,7 +245,7 @@ export default function App() {
     
       setIsFetchingColumns(false);
     }
-  }, [outputOption.option, filePath]);
+  }, [outputOption.option, filePath, filterOptions]);
 
   const handleSetSelectedColumns = (newSelectedColumns) => {
     console.log("Updating selected columns in App:", newSelectedColumns);
@@ -181,8 +259,16 @@ export default function App() {
       const requestData = { 
         columns: selectedColumns, 
         option: outputOption.option,
+        format: outputFormat,
         file_path: filePath
       };
+      if (flagOutliers && outputOption.option !== 'summary') {
+        requestData.outliers = { method: 'robust_z', exclude: excludeOutliers };
+      }
+      const filter = filterOptions();
+      if (filter) {
+        requestData.filter = filter;
+      }
       console.log('Sending download request with:', JSON.stringify(requestData, null, 2));
       const response = await fetch('http://localhost:7069/api/process', {
         method: 'POST',
@@ -204,7 +290,7 @@ export default function App() {
       const a = document.createElement('a');
       a.style.display = 'none';
       a.href = url;
-      a.download = 'combined_output.csv';
+      a.download = `combined_output.${OUTPUT_EXTENSIONS[outputFormat]}`;
       document.body.appendChild(a);
       a.click();
       window.URL.revokeObjectURL(url);
@@ -261,6 +347,62 @@ export default function App() {
                 />
                 <span>Quick Summary of Measures</span>
               </label>
+              <label style={{display: 'flex', alignItems: 'center', gap: '12px', fontSize: '1.125rem'}}>
+                <input
+                  type="radio"
+                  value="long"
+                  checked={outputOption.option === 'long'}
+                  onChange={() => setOutputOption({ option: 'long', showDetailedDescriptions: true })}
+                  style={{width: '20px', height: '20px'}}
+                />
+                <span>Long Format (one row per trial)</span>
+              </label>
+            </div>
+            <label style={{display: 'flex', alignItems: 'center', gap: '12px', fontSize: '1.125rem', marginTop: '24px'}}>
+              <span>File format:</span>
+              <select value={outputFormat} onChange={(e) => setOutputFormat(e.target.value)} style={{fontSize: '1rem', padding: '4px'}}>
+                <option value="csv">CSV</option>
+                <option value="csv_arrow">CSV (Arrow writer)</option>
+                <option value="parquet">Parquet</option>
+                <option value="feather">Feather</option>
+              </select>
+            </label>
+            <label style={{display: 'flex', alignItems: 'center', gap: '12px', fontSize: '1.125rem', marginTop: '16px'}}>
+              <input
+                type="checkbox"
+                checked={flagOutliers}
+                disabled={outputOption.option === 'summary'}
+                onChange={(e) => setFlagOutliers(e.target.checked)}
+                style={{width: '20px', height: '20px'}}
+              />
+              <span>Flag outlier trials</span>
+            </label>
+            <label style={{display: 'flex', alignItems: 'center', gap: '12px', fontSize: '1.125rem', marginTop: '8px'}}>
+              <input
+                type="checkbox"
+                checked={excludeOutliers}
+                disabled={!flagOutliers || outputOption.option === 'summary'}
+                onChange={(e) => setExcludeOutliers(e.target.checked)}
+                style={{width: '20px', height: '20px'}}
+              />
+              <span>Leave flagged trials out of averages</span>
+            </label>
+            <div style={{marginTop: '24px', fontSize: '1.125rem'}}>
+              <span>Only include participants with (leave empty for all):</span>
+              <div style={{display: 'grid', gridTemplateColumns: 'auto 1fr', gap: '8px 12px', alignItems: 'center', marginTop: '8px', fontSize: '1rem'}}>
+                <span>Settings file</span>
+                <input type="text" value={participantFilter.settings_file} onChange={updateFilter('settings_file')} placeholder="e.g. uSPACE" />
+                <span>Sessions from</span>
+                <input type="date" value={participantFilter.start_from} onChange={updateFilter('start_from')} />
+                <span>Sessions to</span>
+                <input type="date" value={participantFilter.start_to} onChange={updateFilter('start_to')} />
+                <span>Age from</span>
+                <input type="number" min="0" value={participantFilter.age_min} onChange={updateFilter('age_min')} />
+                <span>Age to</span>
+                <input type="number" min="0" value={participantFilter.age_max} onChange={updateFilter('age_max')} />
+                <span>Player IDs</span>
+                <input type="text" value={participantFilter.player_ids} onChange={updateFilter('player_ids')} placeholder="comma-separated" />
+              </div>
             </div>
           </div>
 
@@ -320,6 +462,22 @@ export default function App() {
             <p>Please try uploading the file again or contact support if the problem persists.</p>
           </div>
         )}
+        {!isUploading && !isFetchingColumns && !error && quarantined.length > 0 && (
+          <div style={{fontSize: '1rem', color: '#b45309', marginBottom: '20px'}}>
+            <p>{quarantined.length} file(s) could not be read and were left out:</p>
+            <ul>
+              {quarantined.map(q => <li key={q.file}>{q.file}: {q.errors.join('; ')}</li>)}
+            </ul>
+          </div>
+        )}
+        {!isUploading && !isFetchingColumns && !error && duplicates.length > 0 && (
+          <div style={{fontSize: '1rem', color: '#b45309', marginBottom: '20px'}}>
+            <p>{duplicates.length} duplicate session file(s) were skipped:</p>
+            <ul>
+              {duplicates.map(d => <li key={d.file}>{d.file}: {d.reason} as {d.duplicate_of}</li>)}
+            </ul>
+          </div>
+        )}
         {!isUploading && !isFetchingColumns && !isDownloading && !error && (
           isFileUploaded ? (
             console.log("Columns in render!!!!:", columns),